@@ -0,0 +1,264 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import os
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from binary_map import is_binary_map, read_map, read_settings_file
+from game_env import ACTIONS, GameEnv
+
+
+def load_map(source, gamma=None, epsilon=None):
+    """
+    Load a map of a batch. The parameters given as arguments replace the ones of the settings file.
+    :param source: path to a settings file or a binary map (str), or name and grid (tuple (str, list of lists of int or np.ndarray))
+    :param gamma: discount factor (float)
+    :param epsilon: convergence threshold (float)
+    :return: name, grid, gamma and epsilon of the map (str, np.ndarray of uint8, float, float)
+    """
+    if isinstance(source, tuple):
+        name, grid = source
+        parameters = {}
+        grid = np.asarray(grid)
+    else:
+        name = str(source)
+        if is_binary_map(source):
+            grid, parameters = read_map(source)
+            grid = np.array(grid)
+        else:
+            grid, parameters = read_settings_file(source, 'value_iteration')
+    gamma = parameters.get('gamma') if gamma is None else gamma
+    epsilon = parameters.get('epsilon') if epsilon is None else epsilon
+    if grid.ndim != 2 or grid.size == 0:
+        raise ValueError('The grid should be non-empty and have two dimensions')
+    if grid.min() < 0 or grid.max() > 3:
+        raise ValueError(f'Unknown cell code {grid.max() if grid.max() > 3 else grid.min()}, expected 0, 1, 2 or 3')
+    if gamma is None or epsilon is None:
+        raise ValueError('gamma and epsilon should be given, in the settings file or as arguments')
+    if not 0 <= gamma < 1:
+        raise ValueError(f'gamma should be in [0, 1), got {gamma}')
+    if not epsilon > 0:
+        raise ValueError(f'epsilon should be positive, got {epsilon}')
+    return name, grid.astype(np.uint8), float(gamma), float(epsilon)
+
+
+def failure(name, error):
+    """
+    :param name: name of the map (str)
+    :param error: error raised while loading or solving the map (Exception)
+    :return: result of a map that could not be solved (dict)
+    """
+    return {'name': name, 'error': f'{type(error).__name__}: {error}'}
+
+
+def block_diagonal(matrices):
+    """
+    Stack sparse matrices along the diagonal. Unlike scipy.sparse.block_diag, the entries of each row keep their order,
+    so that the products with the stack are computed exactly as the products with each matrix.
+    :param matrices: matrices (list of scipy.sparse.csr_matrix)
+    :return: block diagonal matrix (scipy.sparse.csr_matrix)
+    """
+    row_offsets = np.cumsum([0] + [m.shape[0] for m in matrices])
+    column_offsets = np.cumsum([0] + [m.shape[1] for m in matrices])
+    entry_offsets = np.cumsum([0] + [m.nnz for m in matrices])
+    indptr = np.concatenate([m.indptr[:-1].astype(np.int64) + offset for m, offset in zip(matrices, entry_offsets)] + [entry_offsets[-1:]])
+    indices = np.concatenate([m.indices.astype(np.int64) + offset for m, offset in zip(matrices, column_offsets)])
+    data = np.concatenate([m.data for m in matrices])
+    return sp.csr_matrix((data, indices, indptr), shape=(row_offsets[-1], column_offsets[-1]))
+
+
+def stacked_value_iteration(maps, max_iterations=100000):
+    """
+    Solve maps together, as the 'numpy' engine of ValueIteration in 'jacobi' mode solves each of them: the reachable
+    states of all the maps are stacked into one vector, and each sweep is a single product with the block diagonal
+    matrix of their transition models. A map is yielded as soon as it converges, the converged maps are dropped from
+    the stack once they are half of it.
+    :param maps: name, grid, gamma and epsilon of each map (list of tuples, see load_map)
+    :param max_iterations: number of sweeps after which the maps that have not converged are reported as failed (int)
+    :return: result of each map, in the order in which they converge: name, values and policy (ids of the actions in
+             ACTIONS, -1 for the states without an action) of each cell, number of iterations, or the error (generator of dict)
+    """
+    envs = [GameEnv(grid) for _, grid, _, _ in maps]
+    models = [env.compact_model() for env in envs]
+    sizes = np.array([len(rewards) for _, rewards in models])
+    epsilons = np.array([epsilon for _, _, _, epsilon in maps])
+    values = [np.zeros(size) for size in sizes]
+    done = np.zeros(len(maps), dtype=bool)
+    iterations = 0
+    while not done.all():
+        # Stack of the maps still swept, rebuilt when the converged maps are half of it
+        swept = np.flatnonzero(~done)
+        transitions = block_diagonal([models[i][0] for i in swept])
+        rewards = np.concatenate([models[i][1] for i in swept])
+        gammas = np.repeat([maps[i][2] for i in swept], sizes[swept])
+        stacked = np.concatenate([values[i] for i in swept])
+        offsets = np.concatenate([[0], np.cumsum(sizes[swept])])
+        while np.count_nonzero(~done[swept]) * 2 > len(swept):
+            iterations += 1
+            q = (transitions @ (rewards + gammas * stacked)).reshape(-1, len(ACTIONS))
+            # Maximum over the actions ignoring the NaN of the moves from a wall, faster than q.max(axis=1) on 4 columns.
+            # A state without any valid action gets NaN instead of -inf, fixed when its map is yielded.
+            new_values = np.fmax(np.fmax(q[:, 0], q[:, 1]), np.fmax(q[:, 2], q[:, 3]))
+            with np.errstate(invalid='ignore'):
+                diff = np.abs(stacked - new_values)
+            # Walls surrounded by walls have no value, they must not prevent the convergence
+            diff[~np.isfinite(diff)] = 0
+            deltas = np.add.reduceat(diff, offsets[:-1])
+            stacked = new_values
+            converged = (deltas < epsilons[swept]) & ~done[swept]
+            stopped = ~converged & ~done[swept] if iterations >= max_iterations else np.zeros(len(swept), dtype=bool)
+            for position in np.flatnonzero(converged | stopped).tolist():
+                i = swept[position]
+                done[i] = True
+                if stopped[position]:
+                    yield failure(maps[i][0], RuntimeError(f'No convergence after {max_iterations} iterations'))
+                    continue
+                values[i] = stacked[offsets[position]:offsets[position + 1]].copy()
+                values[i][np.isnan(values[i])] = float('-inf')
+                yield map_result(envs[i], models[i], maps[i][0], maps[i][2], values[i], iterations)
+        # The maps left are carried over to the next stack
+        for position in np.flatnonzero(~done[swept]).tolist():
+            values[swept[position]] = stacked[offsets[position]:offsets[position + 1]]
+
+
+def map_result(env, model, name, gamma, values, iterations):
+    """
+    :param env: GameEnv object of the map
+    :param model: compact transition model of the map (see GameEnv.compact_model)
+    :param name: name of the map (str)
+    :param gamma: discount factor (float)
+    :param values: converged values of the reachable states (np.ndarray)
+    :param iterations: number of sweeps (int)
+    :return: result of the map, see stacked_value_iteration (dict)
+    """
+    transitions, rewards = model
+    states, _ = env.compact_index()
+    # Same policy as ValueIteration.compute_policy
+    q = (transitions @ (rewards + gamma * values)).reshape(-1, len(ACTIONS))
+    q[np.isnan(q)] = float('-inf')
+    best = np.where(np.all(q == float('-inf'), axis=1), -1, q.argmax(axis=1))
+    all_values = np.zeros(env.num_states)
+    all_values[states] = values
+    policy = np.full(env.num_states, -1, dtype=np.int8)
+    policy[states] = best
+    return {'name': name, 'values': all_values.reshape(env.num_rows, env.num_cols),
+            'policy': policy.reshape(env.num_rows, env.num_cols), 'iterations': iterations, 'error': None}
+
+
+def solve_chunk(maps, max_iterations=100000):
+    """
+    Solve maps of the same shape in a worker process.
+    :param maps: name, grid, gamma and epsilon of each map (list of tuples, see load_map)
+    :param max_iterations: see stacked_value_iteration (int)
+    :return: result of each map (list of dict)
+    """
+    try:
+        return list(stacked_value_iteration(maps, max_iterations))
+    except Exception as error:
+        return [failure(name, error) for name, _, _, _ in maps]
+
+
+def chunks(maps, max_states):
+    """
+    Group the maps by shape, then split the groups so that each stack holds at most max_states cells.
+    :param maps: name, grid, gamma and epsilon of each map (list of tuples, see load_map)
+    :param max_states: maximum number of cells of a stack, a larger map is solved alone (int)
+    :return: maps of each stack (list of lists of tuples)
+    """
+    groups = {}
+    for entry in maps:
+        groups.setdefault(entry[1].shape, []).append(entry)
+    stacks = []
+    for shape, group in groups.items():
+        size = max(1, max_states // (shape[0] * shape[1]))
+        stacks += [group[i:i + size] for i in range(0, len(group), size)]
+    return stacks
+
+
+def solve_maps(sources, gamma=None, epsilon=None, workers=None, max_states=1 << 20, max_iterations=100000):
+    """
+    Solve many maps with value iteration. The maps of the same shape are stacked and swept together
+    (see stacked_value_iteration), and the stacks are spread across a process pool. A map that cannot be loaded or
+    solved is reported with its error, without stopping the others.
+    :param sources: directory of settings files and binary maps (str), or paths and (name, grid) pairs (iterable)
+    :param gamma: discount factor of every map, instead of the one of its settings file (float)
+    :param epsilon: convergence threshold of every map, instead of the one of its settings file (float)
+    :param workers: number of worker processes, None for one per CPU, 0 to solve the maps in this process (int)
+    :param max_states: maximum number of cells of a stack (int)
+    :param max_iterations: see stacked_value_iteration (int)
+    :return: result of each map, as soon as it is solved: as soon as it converges without workers, as soon as its
+             stack is solved with them, see stacked_value_iteration (generator of dict)
+    """
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [os.path.join(sources, f) for f in sorted(os.listdir(sources)) if os.path.isfile(os.path.join(sources, f))]
+    maps = []
+    for source in sources:
+        try:
+            maps.append(load_map(source, gamma, epsilon))
+        except Exception as error:
+            yield failure(source[0] if isinstance(source, tuple) else str(source), error)
+
+    stacks = chunks(maps, max_states)
+    if workers == 0:
+        for stack in stacks:
+            # Only the maps not yielded yet are reported as failed when the stack raises
+            remaining = [name for name, _, _, _ in stack]
+            try:
+                for result in stacked_value_iteration(stack, max_iterations):
+                    remaining.remove(result['name'])
+                    yield result
+            except Exception as error:
+                yield from (failure(name, error) for name in remaining)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(solve_chunk, stack, max_iterations) for stack in stacks]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def solve_batch(sources, callback=None, **kwargs):
+    """
+    Solve many maps and measure the throughput, see solve_maps.
+    :param sources: directory of settings files and binary maps (str), or paths and (name, grid) pairs (iterable)
+    :param callback: function called with the result of each map as soon as it is solved (callable)
+    :param kwargs: other arguments of solve_maps
+    :return: result of each map (list of dict), number of maps, of solved and failed maps, time and maps per second (dict)
+    """
+    start = time.perf_counter()
+    results = []
+    for result in solve_maps(sources, **kwargs):
+        results.append(result)
+        if callback is not None:
+            callback(result)
+    seconds = time.perf_counter() - start
+    failed = sum(result['error'] is not None for result in results)
+    return results, {'maps': len(results), 'solved': len(results) - failed, 'failed': failed, 'seconds': seconds,
+                     'maps_per_sec': len(results) / seconds if seconds > 0 else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve every map of a directory with value iteration.')
+    parser.add_argument('directory', help='directory of settings files and binary maps')
+    parser.add_argument('--gamma', type=float, help='discount factor of every map, instead of the one of its file')
+    parser.add_argument('--epsilon', type=float, help='convergence threshold of every map, instead of the one of its file')
+    parser.add_argument('--workers', type=int, help='number of worker processes, 0 to solve in this process')
+    parser.add_argument('--output', help='directory the values and the policy of each map are written to, as <name>.npz')
+    args = parser.parse_args()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    def report(result):
+        if result['error'] is not None:
+            print(f'{result["name"]}: FAILED {result["error"]}')
+            return
+        print(f'{result["name"]}: {result["iterations"]} iterations')
+        if args.output:
+            np.savez(os.path.join(args.output, os.path.basename(result['name']) + '.npz'),
+                     values=result['values'], policy=result['policy'])
+
+    _, stats = solve_batch(args.directory, report, gamma=args.gamma, epsilon=args.epsilon, workers=args.workers)
+    print(f'{stats["solved"]} maps solved, {stats["failed"]} failed in {stats["seconds"]:.3g} s '
+          f'({stats["maps_per_sec"]:.4g} maps/sec)')
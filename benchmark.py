@@ -0,0 +1,382 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+from evaluation import exact_evaluation
+from game_env import GameEnv
+from maze import random_maze
+from q_learning import BatchedQLearning, LinearQLearning, ParallelQLearning, QLearning
+from value_iteration import ValueIteration
+
+
+# Side of the square grids of a default run, from 100 to 4 million states
+SIZES = [10, 50, 100, 500, 1000, 2000]
+# Measured metrics: 'time' metrics are in seconds, 'rate' metrics per second, a slowdown is an increase of
+# the former or a decrease of the latter. The peak memory is reported but does not fail a comparison.
+METRICS = {'build_time': 'time', 'vi_time': 'time', 'vi_backups_per_sec': 'rate', 'policy_time': 'time',
+           'ql_steps_per_sec': 'rate', 'batched_ql_steps_per_sec': 'rate', 'peak_memory_mb': 'memory'}
+
+
+def best_of(measure, repeats):
+    """
+    Run a measure several times and keep the best value of each metric, to reduce the noise on small grids.
+    :param measure: function returning metrics (callable)
+    :param repeats: number of runs (int)
+    :return: best value of each metric (dict)
+    """
+    runs = [measure() for _ in range(repeats)]
+    return {name: (min if METRICS[name] == 'time' else max)(run[name] for run in runs) for name in runs[0]}
+
+
+def bench_size(size, wall_density=0.2, terminal_density=0.01, seed=0, gamma=0.9, epsilon=1e-6, episodes=20, num_envs=64):
+    """
+    Benchmark the solvers on a random size x size grid. Runs in its own process so that its peak memory is its own.
+    :param size: number of rows and columns of the grid (int)
+    :param wall_density: probability of each cell to be a wall (float)
+    :param terminal_density: proportion of terminal states, so that the episodes end on large grids (float)
+    :param seed: seed of the grid and of the training (int)
+    :param gamma: discount factor (float)
+    :param epsilon: convergence threshold of value iteration (float)
+    :param episodes: number of episodes of QLearning, and of each game of BatchedQLearning (int)
+    :param num_envs: number of games of BatchedQLearning (int)
+    :return: value of each metric of METRICS (dict)
+    """
+    grid = random_maze(size, size, wall_density, max(2, int(terminal_density * size * size)), seed)
+    repeats = 5 if size <= 100 else 1
+
+    def measure_build():
+        start = time.perf_counter()
+        GameEnv(grid)
+        return {'build_time': time.perf_counter() - start}
+
+    results = best_of(measure_build, repeats)
+    game_env = GameEnv(grid)
+
+    def measure_vi():
+        vi = ValueIteration.from_game_env(game_env, gamma, epsilon)
+        start = time.perf_counter()
+        vi.value_iteration()
+        vi_time = time.perf_counter() - start
+        start = time.perf_counter()
+        vi.compute_policy()
+        policy_time = time.perf_counter() - start
+        return {'vi_time': vi_time, 'vi_backups_per_sec': vi.stats['backups'] / vi_time, 'policy_time': policy_time}
+
+    def measure_ql():
+        ql = QLearning.from_game_env(game_env, gamma, 0.5, episodes, rng=seed)
+        start = time.perf_counter()
+        ql.train()
+        return {'ql_steps_per_sec': int(ql.visits.sum()) / (time.perf_counter() - start)}
+
+    def measure_batched_ql():
+        ql = BatchedQLearning.from_game_env(game_env, gamma, 0.5, episodes * num_envs, num_envs=num_envs, seed=seed)
+        start = time.perf_counter()
+        ql.train()
+        return {'batched_ql_steps_per_sec': ql.stats['steps'] / (time.perf_counter() - start)}
+
+    for measure in [measure_vi, measure_ql, measure_batched_ql]:
+        results.update(best_of(measure, repeats))
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['peak_memory_mb'] = peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+    return results
+
+
+def compare_learners(size, episodes=1000, evaluations=10, wall_density=0.2, terminal_density=0.01, seed=0, gamma=0.9):
+    """
+    Train the tabular and the linear Q-learning agents on the same random grid, and compute the expected return of
+    their greedy policy from the start state (exact_evaluation) at regular intervals, to compare how fast they learn
+    and how good their policy gets.
+    :param size: number of rows and columns of the grid (int)
+    :param episodes: number of training episodes (int)
+    :param evaluations: number of evaluations of the policies during the training (int)
+    :param wall_density: probability of each cell to be a wall (float)
+    :param terminal_density: proportion of terminal states (float)
+    :param seed: seed of the grid and of the trainings (int)
+    :param gamma: discount factor (float)
+    :return: optimal return, and for each agent the episodes of the evaluations and their returns, the training time
+             without the evaluations, the number of steps and the size of the learned parameters in bytes (dict)
+    """
+    grid = random_maze(size, size, wall_density, max(2, int(terminal_density * size * size)), seed)
+    game_env = GameEnv(grid)
+    start = (game_env.num_rows - 1) * game_env.num_cols
+    vi = ValueIteration.from_game_env(game_env, gamma, 1e-6)
+    vi.value_iteration()
+    vi.compute_policy()
+    results = {'optimal_return': float(exact_evaluation(game_env, vi, gamma)[0][start])}
+    interval = max(1, episodes // evaluations)
+    for name, cls in [('tabular', QLearning), ('linear', LinearQLearning)]:
+        agent = cls.from_game_env(game_env, gamma, 0.5, episodes, rng=seed)
+        run = {'episodes': [], 'returns': [], 'train_time': 0.0}
+        last = time.perf_counter()
+
+        def evaluate(episode):
+            nonlocal last
+            run['train_time'] += time.perf_counter() - last
+            if episode % interval == 0 or episode == episodes:
+                run['episodes'].append(episode)
+                run['returns'].append(float(exact_evaluation(game_env, agent.policy, gamma)[0][start]))
+            last = time.perf_counter()
+
+        agent.train(callback=evaluate)
+        run['steps'] = agent.stats['steps']
+        if cls is QLearning:
+            run['parameter_bytes'] = agent.q_table.nbytes + agent.visits.nbytes + agent.policy_ids.nbytes
+        else:
+            run['parameter_bytes'] = agent.weights.nbytes
+        results[name] = run
+    return results
+
+
+def print_learners(size, results):
+    """
+    Print the results of compare_learners to the console.
+    :param size: side of the grid (int)
+    :param results: results of compare_learners (dict)
+    """
+    print(f'{size}x{size}: optimal return {results["optimal_return"]:.4g}')
+    for name in ['tabular', 'linear']:
+        run = results[name]
+        print(f'  {name:>8}: {run["steps"] / run["train_time"]:.4g} steps/sec, {run["parameter_bytes"]} bytes, returns '
+              + ' '.join(f'{episode}:{value:.3g}' for episode, value in zip(run['episodes'], run['returns'])))
+
+
+def compare_workers(size, episodes=1000, worker_counts=(1, 2, 4), wall_density=0.2, terminal_density=0.01, seed=0, gamma=0.9):
+    """
+    Train the serial Q-learning agent and the parallel one with each number of workers on the same random grid, and
+    compare their episodes per second and the expected return of their greedy policy from the start state
+    (exact_evaluation) at the end of the training.
+    :param size: number of rows and columns of the grid (int)
+    :param episodes: number of training episodes, split between the workers (int)
+    :param worker_counts: numbers of workers of the parallel agent (iterable of int)
+    :param wall_density: probability of each cell to be a wall (float)
+    :param terminal_density: proportion of terminal states (float)
+    :param seed: seed of the grid and of the trainings (int)
+    :param gamma: discount factor (float)
+    :return: optimal return, and for the serial agent ('serial') and each number of workers the training time,
+             the episodes and steps per second and the return of the policy (dict)
+    """
+    grid = random_maze(size, size, wall_density, max(2, int(terminal_density * size * size)), seed)
+    game_env = GameEnv(grid)
+    start = (game_env.num_rows - 1) * game_env.num_cols
+    vi = ValueIteration.from_game_env(game_env, gamma, 1e-6)
+    vi.value_iteration()
+    vi.compute_policy()
+    results = {'optimal_return': float(exact_evaluation(game_env, vi, gamma)[0][start])}
+    agents = [('serial', QLearning.from_game_env(game_env, gamma, 0.5, episodes, rng=seed))]
+    agents += [(str(workers), ParallelQLearning.from_game_env(game_env, gamma, 0.5, episodes, workers=workers, seed=seed))
+               for workers in worker_counts]
+    for name, agent in agents:
+        train_time = time.perf_counter()
+        agent.train()
+        train_time = time.perf_counter() - train_time
+        # The throughput of the parallel agent leaves out starting the workers, train_time includes it
+        training_time = agent.stats.get('training_time', train_time)
+        results[name] = {'train_time': train_time, 'episodes_per_sec': episodes / training_time,
+                         'steps_per_sec': agent.stats['steps'] / training_time,
+                         'return': float(exact_evaluation(game_env, agent.policy, gamma)[0][start])}
+    return results
+
+
+def print_workers(size, results):
+    """
+    Print the results of compare_workers to the console.
+    :param size: side of the grid (int)
+    :param results: results of compare_workers (dict)
+    """
+    print(f'{size}x{size}: optimal return {results["optimal_return"]:.4g}')
+    serial = results['serial']['episodes_per_sec']
+    for name, run in results.items():
+        if name == 'optimal_return':
+            continue
+        label = name if name == 'serial' else f'{name} workers'
+        print(f'  {label:>10}: {run["episodes_per_sec"]:.4g} episodes/sec (x{run["episodes_per_sec"] / serial:.2f}), '
+              f'{run["steps_per_sec"]:.4g} steps/sec, return {run["return"]:.4g}')
+
+
+def compare_initializations(size, episodes=1000, evaluations=20, tolerance=0.05, wall_density=0.2, terminal_density=0.01,
+                            seed=0, gamma=0.9, epsilon=1e-6):
+    """
+    Measure how much the heuristic values estimated from the distance fields (GameEnv.heuristic_values) and the
+    exploring starts cut the work needed to converge on the same random grid: the sweeps of ValueIteration from zeros
+    and from the heuristic values, and the episodes QLearning needs, with each initialization and start distribution,
+    until the mean regret of its greedy policy over the reachable empty cells (exact_evaluation) is below tolerance.
+    :param size: number of rows and columns of the grid (int)
+    :param episodes: number of training episodes (int)
+    :param evaluations: number of evaluations of the policies during the training (int)
+    :param tolerance: mean regret under which the policy has converged (float)
+    :param wall_density: probability of each cell to be a wall (float)
+    :param terminal_density: proportion of terminal states (float)
+    :param seed: seed of the grid and of the trainings (int)
+    :param gamma: discount factor (float)
+    :param epsilon: convergence threshold of ValueIteration (float)
+    :return: time to compute the heuristic values, sweeps and time of ValueIteration for each mode and initialization,
+             and for each initialization and start distribution of QLearning the first evaluated episode with a
+             regret below tolerance (None if never), the final regret, the number of steps and the training time (dict)
+    """
+    grid = random_maze(size, size, wall_density, max(2, int(terminal_density * size * size)), seed)
+    game_env = GameEnv(grid)
+    start = time.perf_counter()
+    game_env.heuristic_values(gamma)
+    results = {'heuristic_time': time.perf_counter() - start, 'value_iteration': {}, 'q_learning': {}}
+    for mode in ['jacobi', 'gauss-seidel']:
+        for init in ['zeros', 'distance']:
+            start = time.perf_counter()
+            vi = ValueIteration.from_game_env(game_env, gamma, epsilon, mode=mode, init=init)
+            vi.value_iteration()
+            results['value_iteration'][f'{mode}/{init}'] = {'sweeps': vi.stats['iterations'],
+                                                             'time': time.perf_counter() - start}
+    vi.compute_policy()
+    states, _ = game_env.compact_index()
+    empty = states[np.frombuffer(game_env.cells, dtype=np.uint8)[states] == 0]
+    optimal = exact_evaluation(game_env, vi, gamma)[0][empty]
+    interval = max(1, episodes // evaluations)
+    for init in ['zeros', 'distance']:
+        for starts in ['corner', 'uniform', 'visits']:
+            agent = QLearning.from_game_env(GameEnv(grid), gamma, 0.5, episodes, rng=seed, init=init, starts=starts)
+            run = {'converged_at': None, 'regret': None, 'train_time': 0.0}
+            last = time.perf_counter()
+
+            def evaluate(episode):
+                nonlocal last
+                run['train_time'] += time.perf_counter() - last
+                if episode % interval == 0 or episode == episodes:
+                    run['regret'] = float(np.mean(optimal - exact_evaluation(game_env, agent.policy, gamma)[0][empty]))
+                    if run['converged_at'] is None and run['regret'] < tolerance:
+                        run['converged_at'] = episode
+                last = time.perf_counter()
+
+            agent.train(callback=evaluate)
+            run['steps'] = agent.stats['steps']
+            results['q_learning'][f'{init}/{starts}'] = run
+    return results
+
+
+def print_initializations(size, results):
+    """
+    Print the results of compare_initializations to the console.
+    :param size: side of the grid (int)
+    :param results: results of compare_initializations (dict)
+    """
+    print(f'{size}x{size}: heuristic values in {results["heuristic_time"]:.3g}s')
+    for name, run in results['value_iteration'].items():
+        print(f'  VI {name:>21}: {run["sweeps"]} sweeps, {run["time"]:.3g}s')
+    for name, run in results['q_learning'].items():
+        converged = 'not converged' if run['converged_at'] is None else f'converged at episode {run["converged_at"]}'
+        print(f'  QL {name:>21}: {converged}, final regret {run["regret"]:.3g}, {run["steps"]} steps, '
+              f'{run["train_time"]:.3g}s')
+
+
+def run_benchmark(sizes=SIZES, verbose=False, **kwargs):
+    """
+    Benchmark the solvers on a random grid of each size, each of them in a fresh process.
+    :param sizes: sides of the square grids (list of int)
+    :param verbose: print the metrics of each size as soon as they are measured (bool)
+    :param kwargs: other arguments of bench_size
+    :return: the configuration of the run and the metrics of each size (dict)
+    """
+    results = {}
+    for size in sizes:
+        # A new worker for each size: the peak memory of a process never decreases
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results[str(size)] = executor.submit(bench_size, size, **kwargs).result()
+        if verbose:
+            print_metrics(size, results[str(size)])
+    return {'config': kwargs, 'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+
+
+def compare(run, baseline, threshold=0.2):
+    """
+    Compare a run with a baseline, on the sizes measured by both.
+    :param run: results of run_benchmark (dict)
+    :param baseline: results of run_benchmark stored as baseline (dict)
+    :param threshold: relative slowdown above which a metric is a regression, e.g. 0.2 for 20% (float)
+    :return: one row per size and metric with the baseline and new values, the relative change (positive when
+             slower or larger) and whether it is a regression (list of dict)
+    """
+    if run['config'] != baseline['config']:
+        print(f'Warning: the benchmark configurations differ: {run["config"]} != {baseline["config"]}')
+    rows = []
+    for size, metrics in run['results'].items():
+        if size not in baseline['results']:
+            continue
+        for name, kind in METRICS.items():
+            old, new = baseline['results'][size].get(name), metrics.get(name)
+            if old is None or new is None:
+                continue
+            change = old / new - 1 if kind == 'rate' else new / old - 1
+            rows.append({'size': int(size), 'metric': name, 'baseline': old, 'new': new, 'change': change,
+                         'regression': kind != 'memory' and change > threshold})
+    return rows
+
+
+def print_metrics(size, metrics):
+    """
+    Print the metrics of a size to the console.
+    :param size: side of the grid (int)
+    :param metrics: value of each metric (dict)
+    """
+    print(f'{size}x{size}: ' + ', '.join(f'{name}={value:.4g}' for name, value in metrics.items()))
+
+
+def print_comparison(rows):
+    """
+    Print a comparison to the console.
+    :param rows: rows returned by compare (list of dict)
+    """
+    print(f'{"size":>6} | {"metric":^26} | {"baseline":^12} | {"new":^12} | {"change":^8}')
+    print('-' * 76)
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f'{row["size"]:>6} | {row["metric"]:^26} | {row["baseline"]:^12.4g} | {row["new"]:^12.4g} | '
+              f'{row["change"]:^+8.1%}{flag}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the solvers on random grids of increasing size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='sides of the square grids')
+    parser.add_argument('--wall-density', type=float, default=0.2)
+    parser.add_argument('--terminal-density', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--episodes', type=int, default=20)
+    parser.add_argument('--output', default='benchmark-results.json', help='file the results are written to')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown failing the comparison')
+    parser.add_argument('--learners', action='store_true',
+                        help='compare the returns of the tabular and the linear Q-learning agents instead')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        help='compare the serial Q-learning agent with the parallel one with these numbers of workers instead')
+    parser.add_argument('--init', action='store_true',
+                        help='measure the sweeps and episodes saved by the heuristic values and the exploring starts instead')
+    args = parser.parse_args()
+
+    if args.init:
+        for size in args.sizes:
+            print_initializations(size, compare_initializations(size, args.episodes, wall_density=args.wall_density,
+                                                                terminal_density=args.terminal_density, seed=args.seed))
+    elif args.workers:
+        for size in args.sizes:
+            print_workers(size, compare_workers(size, args.episodes, args.workers, wall_density=args.wall_density,
+                                                terminal_density=args.terminal_density, seed=args.seed))
+    elif args.learners:
+        for size in args.sizes:
+            print_learners(size, compare_learners(size, args.episodes, wall_density=args.wall_density,
+                                                  terminal_density=args.terminal_density, seed=args.seed))
+    else:
+        run = run_benchmark(args.sizes, verbose=True, wall_density=args.wall_density,
+                            terminal_density=args.terminal_density, seed=args.seed, episodes=args.episodes)
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+        if args.baseline:
+            with open(args.baseline, 'r') as f:
+                rows = compare(run, json.load(f), args.threshold)
+            print_comparison(rows)
+            if any(row['regression'] for row in rows):
+                sys.exit(1)
@@ -0,0 +1,112 @@
+import math
+import struct
+import sys
+
+import numpy as np
+
+
+# A binary map is a header of HEADER_SIZE bytes followed by the cell codes, one uint8 per cell in row-major order.
+# The header holds the magic bytes, the number of rows and columns, then gamma, epsilon, alpha and nb_episodes:
+# epsilon is NaN in the maps of QLearning, alpha is NaN and nb_episodes is -1 in the maps of ValueIteration.
+MAGIC = b'PACMAP\x00\x01'
+HEADER = struct.Struct('<8sIIdddq')
+HEADER_SIZE = 64
+# Parameters following the grid in the settings files of each solver
+SETTINGS = {'value_iteration': ['gamma', 'epsilon'], 'q_learning': ['gamma', 'alpha', 'nb_episodes']}
+
+
+def is_binary_map(path_to_map):
+    """
+    :param path_to_map: path to a settings file or a binary map (str)
+    :return: True if the file is a binary map (bool)
+    """
+    with open(path_to_map, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_map(path_to_map, grid, gamma, epsilon=None, alpha=None, nb_episodes=None):
+    """
+    Write a binary map.
+    :param path_to_map: path to the binary map (str)
+    :param grid: cell codes (list of lists of int or np.ndarray of shape (num_rows, num_cols))
+    :param gamma: discount factor (float)
+    :param epsilon: convergence threshold of ValueIteration (float)
+    :param alpha: initial learning rate of QLearning (float)
+    :param nb_episodes: number of episodes of QLearning (int)
+    """
+    cells = np.asarray(grid)
+    if cells.ndim != 2 or cells.size == 0:
+        raise ValueError("Grid should be non-empty")
+    if cells.min() < 0 or cells.max() > 255:
+        raise ValueError('Cell codes should be between 0 and 255')
+    header = HEADER.pack(MAGIC, cells.shape[0], cells.shape[1], gamma,
+                         math.nan if epsilon is None else epsilon, math.nan if alpha is None else alpha,
+                         -1 if nb_episodes is None else nb_episodes)
+    with open(path_to_map, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\x00'))
+        f.write(np.ascontiguousarray(cells, dtype=np.uint8).tobytes())
+
+
+def read_map(path_to_map):
+    """
+    Memory-map a binary map. The cells are not read until they are used, and the processes mapping the same file
+    share its pages. Writing to the grid only changes it in the current process, never in the file.
+    :param path_to_map: path to the binary map (str)
+    :return: grid (np.memmap of shape (num_rows, num_cols) and dtype uint8),
+             parameters of the map, among gamma, epsilon, alpha and nb_episodes (dict)
+    """
+    with open(path_to_map, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path_to_map} is not a binary map')
+    _, num_rows, num_cols, gamma, epsilon, alpha, nb_episodes = HEADER.unpack(header)
+    grid = np.memmap(path_to_map, dtype=np.uint8, mode='c', offset=HEADER_SIZE, shape=(num_rows, num_cols))
+    parameters = {'gamma': gamma}
+    if not math.isnan(epsilon):
+        parameters['epsilon'] = epsilon
+    if not math.isnan(alpha):
+        parameters['alpha'] = alpha
+    if nb_episodes >= 0:
+        parameters['nb_episodes'] = nb_episodes
+    return grid, parameters
+
+
+def read_settings_file(path_to_settings, solver):
+    """
+    Read a text settings file into an array, without building a list per row.
+    :param path_to_settings: path to the settings file (str)
+    :param solver: 'value_iteration' or 'q_learning', which tells the parameters following the grid (str)
+    :return: grid (np.ndarray of shape (num_rows, num_cols) and dtype uint8), parameters of the file (dict)
+    """
+    if solver not in SETTINGS:
+        raise ValueError(f"Unknown solver '{solver}', expected one of {list(SETTINGS)}")
+    names = SETTINGS[solver]
+    with open(path_to_settings, 'rb') as f:
+        lines = f.read().split()
+    rows = lines[:-len(names)]
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError(f'The rows of the grid of {path_to_settings} should be non-empty and of the same length')
+    grid = (np.frombuffer(b''.join(rows), dtype=np.uint8) - ord('0')).reshape(len(rows), len(rows[0]))
+    if grid.max() > 9:
+        raise ValueError(f'The grid of {path_to_settings} should only hold digits')
+    parameters = {name: (int if name == 'nb_episodes' else float)(value)
+                  for name, value in zip(names, lines[-len(names):])}
+    return grid, parameters
+
+
+def convert_settings_file(path_to_settings, path_to_map, solver):
+    """
+    Convert a text settings file into a binary map.
+    :param path_to_settings: path to the settings file (str)
+    :param path_to_map: path to the binary map (str)
+    :param solver: 'value_iteration' or 'q_learning', which tells the parameters following the grid (str)
+    """
+    grid, parameters = read_settings_file(path_to_settings, solver)
+    write_map(path_to_map, grid, **parameters)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print('Usage: python3 binary_map.py value_iteration|q_learning path/to/settings.txt path/to/map.bin')
+        sys.exit(1)
+    convert_settings_file(sys.argv[2], sys.argv[3], sys.argv[1])
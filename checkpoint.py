@@ -0,0 +1,223 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from random_stream import RandomStream
+
+
+# A checkpoint is an uncompressed .npz file: the arrays of the run, plus its other state as JSON in the '__state__'
+# array. It is written to a temporary file first, then renamed, so that a killed run always leaves a complete one.
+STATE_KEY = '__state__'
+
+
+def write_checkpoint(path, arrays, state):
+    """
+    :param path: path to the checkpoint (str)
+    :param arrays: arrays of the run (dict of np.ndarray)
+    :param state: other state of the run (dict, serializable to JSON)
+    """
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays, **{STATE_KEY: np.frombuffer(json.dumps(state).encode(), dtype=np.uint8)})
+    with open(path + '.tmp', 'wb') as f:
+        f.write(buffer.getbuffer())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def read_checkpoint(path):
+    """
+    :param path: path to the checkpoint (str)
+    :return: arrays and other state of the run (dict of np.ndarray, dict)
+    """
+    with np.load(path) as npz:
+        arrays = dict(npz)
+    return arrays, json.loads(arrays.pop(STATE_KEY).tobytes().decode())
+
+
+def random_state(rng):
+    """
+    :param rng: random module or RandomStream
+    :return: state of the random numbers (dict, serializable to JSON), numbers already generated but not drawn yet
+             (np.ndarray)
+    """
+    if isinstance(rng, RandomStream):
+        generator_state, buffered = rng.getstate()
+        return {'type': 'stream', 'generator': generator_state}, np.array(buffered)
+    return {'type': 'module', 'state': rng.getstate()}, np.zeros(0)
+
+
+def random_digest(rng):
+    """
+    :param rng: random module or RandomStream
+    :return: hash of the state of the random numbers, the same for two runs that will draw the same numbers (str)
+    """
+    state, buffered = random_state(rng)
+    digest = hashlib.blake2b(json.dumps(state, sort_keys=True).encode(), digest_size=16)
+    digest.update(buffered.tobytes())
+    return digest.hexdigest()
+
+
+def set_random_state(rng, state, buffered):
+    """
+    Restore the state of the random numbers, see random_state.
+    :param rng: random module or RandomStream
+    """
+    if isinstance(rng, RandomStream) != (state['type'] == 'stream'):
+        raise ValueError('The checkpoint was written with another kind of random numbers (rng argument)')
+    if state['type'] == 'stream':
+        rng.setstate(state['generator'], buffered.tolist())
+    else:
+        version, internal, gauss = state['state']
+        rng.setstate((version, tuple(internal), gauss))
+
+
+def check_run(state, solver, game_env, parameters):
+    """
+    Check that a checkpoint was written by the same kind of run, so that resuming it gives the same result.
+    :param state: state of the checkpoint (dict)
+    :param solver: name of the solver (str)
+    :param game_env: GameEnv object of the run
+    :param parameters: parameters the result depends on (dict)
+    """
+    if state['solver'] != solver:
+        raise ValueError(f"The checkpoint was written by {state['solver']}, not {solver}")
+    if state['model'] != game_env.model_hash():
+        raise ValueError('The checkpoint was written for another map')
+    if state['parameters'] != json.loads(json.dumps(parameters)):
+        raise ValueError(f"The checkpoint was written with the parameters {state['parameters']}, not {parameters}")
+
+
+class Checkpointer:
+    def __init__(self, path, every=None, seconds=None, background=True):
+        """
+        Writes the checkpoints of a run every `every` episodes or iterations, or every `seconds` seconds, whichever
+        comes first. The run copies its state, then the copy is written on a background thread: when the writes are
+        slower than the checkpoints, only the most recent pending one is written.
+        :param path: path to the checkpoint, replaced by each new one (str)
+        :param every: number of episodes or iterations between two checkpoints (int or None)
+        :param seconds: time between two checkpoints (float or None)
+        :param background: write the checkpoints on a background thread (bool)
+        """
+        if every is not None and every < 1:
+            raise ValueError(f'every should be at least 1, got {every}')
+        if seconds is not None and seconds <= 0:
+            raise ValueError(f'seconds should be positive, got {seconds}')
+        self.path = path
+        self.every = every
+        self.seconds = seconds
+        self.background = background
+        self.last_save = time.monotonic()
+        # Checkpoint waiting for the background thread, and whether the thread is writing one
+        self.pending = None
+        self.writing = False
+        self.closing = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+
+    def due(self, count):
+        """
+        :param count: number of episodes or iterations done (int)
+        :return: whether a checkpoint should be written now (bool)
+        """
+        if self.every is not None and count % self.every == 0:
+            return True
+        return self.seconds is not None and time.monotonic() - self.last_save >= self.seconds
+
+
+    def save(self, arrays, state):
+        """
+        Write a checkpoint, or queue it for the background thread.
+        :param arrays: arrays of the run, not modified by the run afterwards (dict of np.ndarray)
+        :param state: other state of the run (dict, serializable to JSON)
+        """
+        self.last_save = time.monotonic()
+        if not self.background:
+            write_checkpoint(self.path, arrays, state)
+            return
+        with self.condition:
+            self.raise_error()
+            self.pending = arrays, state
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.drain, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+
+    def drain(self):
+        """
+        Write the pending checkpoints until the checkpointer is closed. Runs on the background thread.
+        """
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closing:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                (arrays, state), self.pending = self.pending, None
+                self.writing = True
+            try:
+                write_checkpoint(self.path, arrays, state)
+            except Exception as error:
+                self.error = error
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+    def raise_error(self):
+        """
+        Raise the error of the last background write that failed, if any.
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+    def wait(self):
+        """
+        Wait until the pending checkpoint has been written.
+        """
+        with self.condition:
+            while self.pending is not None or self.writing:
+                self.condition.wait()
+            self.raise_error()
+
+
+    def close(self):
+        """
+        Write the pending checkpoint and stop the background thread.
+        """
+        self.wait()
+        if self.thread is not None:
+            with self.condition:
+                self.closing = True
+                self.condition.notify_all()
+            self.thread.join()
+            self.thread = None
+            self.closing = False
+
+
+    def load(self):
+        """
+        :return: arrays and other state of the last checkpoint (dict of np.ndarray, dict), None if there is none
+        """
+        self.wait()
+        if not os.path.exists(self.path):
+            return None
+        return read_checkpoint(self.path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
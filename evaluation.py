@@ -0,0 +1,184 @@
+from collections.abc import Mapping
+import argparse
+import sys
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import spsolve
+
+from game_env import ACTION_IDS, ACTIONS
+
+
+# An episode ends with the move made from a terminal state, as in QLearning.train and VectorGameEnv.step, so the
+# returns below are the ones of the episodes actually played. They differ from the values of the solvers, which
+# never end the episodes.
+
+
+def policy_action_ids(policy, game_env):
+    """
+    Convert a policy to the id of the action of each state, whatever the solver it comes from.
+    :param policy: solver with a policy attribute (ValueIteration, PolicyIteration, QLearning...), policy of
+                   ValueIteration (list of str), of QLearning (PolicyView or dict of str),
+                   or ids of the actions in ACTIONS (np.ndarray of shape (num_states,)).
+                   The states without an action ('' or -1) take a random one, as QLearning does.
+    :param game_env: GameEnv object the policy was computed for
+    :return: id of the action of each state, -1 for the states without one (np.ndarray of shape (num_states,))
+    """
+    policy = getattr(policy, 'policy', policy)
+    if isinstance(policy, np.ndarray):
+        ids = policy.astype(np.int64)
+    elif hasattr(policy, 'action_ids') and hasattr(policy, 'index'):
+        # PolicyView of QLearning, read without going through every state
+        ids = np.full(len(policy.index), -1, dtype=np.int64)
+        rows = policy.index >= 0
+        ids[rows] = policy.action_ids[policy.index[rows]]
+    else:
+        actions = [policy[state] for state in range(game_env.num_states)] if isinstance(policy, Mapping) else policy
+        ids = np.array([ACTION_IDS.get(action, -1) for action in actions], dtype=np.int64)
+    if ids.shape != (game_env.num_states,):
+        raise ValueError(f'The policy should have an action for each of the {game_env.num_states} states, got {ids.shape}')
+    if ids.min() < -1 or ids.max() >= len(ACTIONS):
+        raise ValueError(f'Action ids should be between -1 and {len(ACTIONS) - 1}')
+    return ids
+
+
+def reaching(graph, sources):
+    """
+    :param graph: adjacency matrix, graph[i, j] != 0 if there is an edge from i to j (scipy.sparse matrix)
+    :param sources: states (np.ndarray of bool)
+    :return: states from which one of the sources can be reached, the sources included (np.ndarray of bool)
+    """
+    n = graph.shape[0]
+    # Breadth-first search over the reversed edges, from an extra node n linked to every source
+    edges = graph.tocoo()
+    sources = np.flatnonzero(sources)
+    heads = np.concatenate([edges.col, np.full(len(sources), n)])
+    tails = np.concatenate([edges.row, sources])
+    reversed_graph = sp.csr_matrix((np.ones(len(heads)), (heads, tails)), shape=(n + 1, n + 1))
+    reached = np.zeros(n + 1, dtype=bool)
+    reached[csgraph.breadth_first_order(reversed_graph, n, return_predecessors=False)] = True
+    return reached[:n]
+
+
+def exact_evaluation(game_env, policy, gamma):
+    """
+    Compute the expected discounted return and the expected length of the episodes starting from each state with
+    two sparse linear solves. The length is infinite for the states whose episode may never end, their return is
+    then only defined if gamma < 1.
+    :param game_env: GameEnv object
+    :param policy: policy of any solver, see policy_action_ids
+    :param gamma: discount factor of the returns (float, between 0 and 1)
+    :return: expected return and expected length of the episodes starting from each state, NaN for the states that
+             cannot be reached from the start state (np.ndarray of shape (num_states,), np.ndarray of shape (num_states,))
+    """
+    if not 0 <= gamma <= 1:
+        raise ValueError(f'gamma should be between 0 and 1, got {gamma}')
+    ids = policy_action_ids(policy, game_env)
+    states, _ = game_env.compact_index()
+    transitions, rewards = game_env.compact_model()
+    n = len(states)
+    # Probability of each action in each state, uniform for the states without an action
+    weights = np.where(ids[states, np.newaxis] < 0, 1 / len(ACTIONS), ids[states, np.newaxis] == np.arange(len(ACTIONS)))
+    pi = sp.csr_matrix((weights.ravel(), np.arange(n * len(ACTIONS)), np.arange(0, n * len(ACTIONS) + 1, len(ACTIONS))),
+                       shape=(n, n * len(ACTIONS)))
+    policy_transitions = (pi @ transitions).tocsr()
+    expected_rewards = policy_transitions @ np.nan_to_num(rewards)
+    # The episodes do not go on after the move made from a terminal state
+    continuing = (sp.diags((~game_env.terminal[states]).astype(float)) @ policy_transitions).tocsr()
+    continuing.eliminate_zeros()
+
+    # An episode ends for sure if it cannot reach a state from which no terminal state can be reached
+    ending = reaching(continuing, game_env.terminal[states])
+    finite = ~reaching(continuing, ~ending)
+    identity = sp.identity(int(np.count_nonzero(finite)), format='csc')
+    finite_continuing = continuing[finite][:, finite].tocsc()
+    lengths = np.full(n, np.inf)
+    lengths[finite] = spsolve(identity - finite_continuing, np.ones(len(identity.indptr) - 1))
+    if gamma < 1:
+        values = spsolve(sp.identity(n, format='csc') - gamma * continuing.tocsc(), expected_rewards)
+    else:
+        values = np.full(n, np.nan)
+        values[finite] = spsolve(identity - finite_continuing, expected_rewards[finite])
+
+    all_values = np.full(game_env.num_states, np.nan)
+    all_lengths = np.full(game_env.num_states, np.nan)
+    all_values[states] = values
+    all_lengths[states] = lengths
+    return all_values, all_lengths
+
+
+def monte_carlo_evaluation(game_env, policy, gamma, num_episodes=10000, start_states=None, max_steps=10000, seed=None):
+    """
+    Play many episodes of a policy in lockstep: each step of all the running episodes is a single batch of array
+    operations, and the episodes that ended are dropped from the batch.
+    :param game_env: GameEnv object
+    :param policy: policy of any solver, see policy_action_ids
+    :param gamma: discount factor of the returns (float)
+    :param num_episodes: number of episodes (int)
+    :param start_states: start state of every episode, or a single one for all of them, by default the start state
+                         of the game (np.ndarray or int)
+    :param max_steps: episodes still running after max_steps steps are stopped and counted as truncated (int)
+    :param seed: seed of the random generator (int or None)
+    :return: number of episodes, mean, variance and standard error of their discounted return, mean and variance
+             of their length, and number of truncated episodes (dict)
+    """
+    if num_episodes < 1:
+        raise ValueError(f'num_episodes should be at least 1, got {num_episodes}')
+    ids = policy_action_ids(policy, game_env)
+    rng = np.random.default_rng(seed)
+    if start_states is None:
+        start_states = (game_env.num_rows - 1) * game_env.num_cols
+    states = np.array(np.broadcast_to(start_states, num_episodes), dtype=np.int64)
+    returns = np.zeros(num_episodes)
+    lengths = np.zeros(num_episodes, dtype=np.int64)
+    # Running episodes, and the discount of their next reward
+    running = np.arange(num_episodes)
+    discounts = np.ones(num_episodes)
+    rewards = np.nan_to_num(game_env.rewards)
+    for _ in range(max_steps):
+        actions = ids[states]
+        random_actions = actions < 0
+        actions[random_actions] = rng.integers(len(ACTIONS), size=int(np.count_nonzero(random_actions)))
+        next_states = game_env.sample_next_states(states, actions, rng)
+        returns[running] += discounts * rewards[next_states]
+        lengths[running] += 1
+        ongoing = ~game_env.terminal[states]
+        running, states, discounts = running[ongoing], next_states[ongoing], discounts[ongoing] * gamma
+        if len(running) == 0:
+            break
+
+    variance = returns.var(ddof=1) if num_episodes > 1 else 0.0
+    return {'episodes': num_episodes, 'mean_return': float(returns.mean()), 'var_return': float(variance),
+            'std_error': float(np.sqrt(variance / num_episodes)), 'mean_length': float(lengths.mean()),
+            'var_length': float(lengths.var(ddof=1) if num_episodes > 1 else 0.0), 'truncated': len(running)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve a map, then evaluate the policy from the start state.')
+    parser.add_argument('solver', choices=['value_iteration', 'q_learning'])
+    parser.add_argument('settings', help='settings file or binary map')
+    parser.add_argument('--episodes', type=int, default=10000, help='number of Monte Carlo episodes, 0 to skip them')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-return', type=float, help='expected return below which the evaluation fails')
+    args = parser.parse_args()
+
+    if args.solver == 'value_iteration':
+        from value_iteration import ValueIteration
+        solver = ValueIteration(args.settings)
+        solver.value_iteration()
+        solver.compute_policy()
+    else:
+        from q_learning import QLearning
+        solver = QLearning(args.settings)
+        solver.train()
+    env = solver.game_env
+    start = (env.num_rows - 1) * env.num_cols
+    values, lengths = exact_evaluation(env, solver, solver.gamma)
+    print(f'exact: return={values[start]:.6g}, length={lengths[start]:.6g}')
+    if args.episodes > 0:
+        results = monte_carlo_evaluation(env, solver, solver.gamma, args.episodes, seed=args.seed)
+        print('monte carlo: ' + ', '.join(f'{name}={value:.6g}' for name, value in results.items()))
+    if args.min_return is not None and not values[start] >= args.min_return:
+        print(f'The expected return {values[start]:.6g} is below {args.min_return}')
+        sys.exit(1)
@@ -1,15 +1,370 @@
-import random
+import hashlib
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from random_stream import as_random
+
+
+ACTIONS = ['up', 'down', 'left', 'right']
+ACTION_IDS = {action: i for i, action in enumerate(ACTIONS)}
+# Reward received when entering a cell, indexed by the cell code (walls have no reward)
+REWARDS = {0: -0.04, 1: 1, 2: -1}
+# For each action: intended direction, then the two directions Pacman can slip to
+SLIPS = [(0, 2, 3), (1, 2, 3), (2, 0, 1), (3, 0, 1)]
+
+
+def cumulative_probs(indptr, probs):
+    """
+    Cumulative probabilities within each row of a transition model, summed in the same order as draw_next_state does.
+    :param indptr: row pointers, rows have at most 4 entries (np.ndarray)
+    :param probs: probabilities of the entries (np.ndarray)
+    :return: cumulative probabilities of the entries (np.ndarray)
+    """
+    cum_probs = probs.copy()
+    counts = np.diff(indptr)
+    for slot in range(1, 4):
+        entries = indptr[:-1][counts > slot] + slot
+        cum_probs[entries] += cum_probs[entries - 1]
+    return cum_probs
+
+
+def splice_rows(indptr, arrays, rows, counts, new_arrays):
+    """
+    Replace rows of a structure in CSR format. The arrays are written in place if the rows keep their number of
+    entries, else new arrays are built by copying the unchanged entries by blocks.
+    :param indptr: row pointers (np.ndarray)
+    :param arrays: arrays of the entries, e.g. column indices and data (list of np.ndarray)
+    :param rows: replaced rows, in increasing order (np.ndarray)
+    :param counts: new number of entries of each replaced row (np.ndarray)
+    :param new_arrays: new entries of the replaced rows, row after row, in the same order as arrays (list of np.ndarray)
+    :return: row pointers, arrays of the entries (np.ndarray, list of np.ndarray)
+    """
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    if np.array_equal(indptr[rows + 1] - indptr[rows], counts):
+        for i, row in enumerate(rows.tolist()):
+            for array, new_array in zip(arrays, new_arrays):
+                array[indptr[row]:indptr[row + 1]] = new_array[new_offsets[i]:new_offsets[i + 1]]
+        return indptr, arrays
+
+    lengths = np.diff(indptr)
+    lengths[rows] = counts
+    spliced_indptr = np.zeros_like(indptr)
+    np.cumsum(lengths, out=spliced_indptr[1:])
+    spliced = [np.empty(spliced_indptr[-1], dtype=array.dtype) for array in arrays]
+    # Blocks of unchanged rows between the replaced rows
+    previous = 0
+    for i, row in enumerate(rows.tolist() + [len(indptr) - 1]):
+        start, stop, to = indptr[previous], indptr[row], spliced_indptr[previous]
+        for array, spliced_array in zip(arrays, spliced):
+            spliced_array[to:to + stop - start] = array[start:stop]
+        if i < len(rows):
+            for new_array, spliced_array in zip(new_arrays, spliced):
+                spliced_array[spliced_indptr[row]:spliced_indptr[row + 1]] = new_array[new_offsets[i]:new_offsets[i + 1]]
+        previous = row + 1
+    return spliced_indptr, spliced
 
 
 class GameEnv:
-    def __init__(self, grid):
+    def __init__(self, grid, rng=None):
+        """
+        :param grid: cell codes 0 (empty), 1 (reward), 2 (ghost) and 3 (wall) (list of lists of int or np.ndarray)
+        :param rng: random numbers of draw_next_state and sample_next_state: None for the random module,
+                    a seed or a RandomStream for reproducible draws independent of the other environments
+        """
         if len(grid) == 0 or len(grid[0]) == 0:
             raise ValueError("Grid should be non-empty")
+        self.rng = as_random(rng)
         self.grid = grid
         self.num_rows = len(grid)
         self.num_cols = len(grid[0])
+        self.num_states = self.num_rows * self.num_cols
         # Pacman always starts in the bottom left corner of the grid
         self.state = (self.num_rows - 1) * self.num_cols
+        self.compile_model()
+
+
+    def compile_model(self):
+        """
+        Compile the grid into a sparse transition model, so that the solvers never have to rebuild it.
+        The possible next states of the pair (state, action) are stored in CSR format:
+        self.next_states[self.indptr[k]:self.indptr[k + 1]] with their probabilities in self.probs,
+        where k = state * 4 + action id (see ACTIONS). The next states are stored in the same order as
+        the one returned by the original list-based implementation (staying in place first).
+        Must be called again if self.grid is modified.
+        """
+        # One byte per cell, the codes of the grid are 0 (empty), 1 (reward), 2 (ghost) and 3 (wall). The cells are
+        # a read-only view of the grid, not a copy: the pages of a memory-mapped grid stay shared between processes
+        cells = np.asarray(self.grid, dtype=np.uint8).ravel()
+        view = cells.view()
+        view.flags.writeable = False
+        self.cells = memoryview(view)
+        counts, next_states, probs = self.transition_rows(np.arange(self.num_states, dtype=np.int64))
+
+        # There are at most 16 entries per state, the same index type is used for indptr and next_states
+        # so that the sparse matrix below shares their memory
+        index_type = np.int32 if self.num_states * 16 < 2 ** 31 else np.int64
+        self.next_states = next_states.astype(index_type)
+        self.probs = probs
+        self.indptr = np.zeros(self.num_states * 4 + 1, dtype=index_type)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.cum_probs = cumulative_probs(self.indptr, self.probs)
+        # Row state * 4 + action id holds the probabilities of reaching each state
+        self.transitions = sp.csr_matrix((self.probs, self.next_states, self.indptr),
+                                         shape=(self.num_states * 4, self.num_states))
+
+        self.rewards = np.full(self.num_states, np.nan)
+        for code, reward in REWARDS.items():
+            self.rewards[cells == code] = reward
+        self.terminal = (cells == 1) | (cells == 2)
+        self.predecessors = None
+        self.compact = None
+        self.compact_transitions = None
+        self.fingerprint = None
+        self.distances = None
+
+
+    def transition_rows(self, states):
+        """
+        Build the rows of the transition model of some states, see compile_model.
+        :param states: states (np.ndarray of int64)
+        :return: number of possible next states of each (state, action) pair, state after state
+                 (np.ndarray of shape (len(states) * 4,)), then the possible next states of all the pairs
+                 and their probabilities (np.ndarray, np.ndarray)
+        """
+        walls = np.frombuffer(self.cells, dtype=np.uint8) == 3
+        row, col = np.divmod(states, self.num_cols)
+        # moves[d] is the state reached by moving in direction d, bumping into walls and borders
+        moves = np.empty((4, len(states)), dtype=np.int64)
+        neighbours = [(states - self.num_cols, row > 0), (states + self.num_cols, row < self.num_rows - 1),
+                      (states - 1, col > 0), (states + 1, col < self.num_cols - 1)]
+        for d, (neighbour, inside) in enumerate(neighbours):
+            neighbour = np.where(inside, neighbour, states)
+            moves[d] = np.where(walls[neighbour], states, neighbour)
+
+        # Candidates for each (state, action): stay in place, intended direction, then both slips
+        candidates = np.empty((len(states), 4, 4), dtype=np.int64)
+        probs = np.zeros((len(states), 4, 4))
+        mask = np.empty((len(states), 4, 4), dtype=bool)
+        for a, directions in enumerate(SLIPS):
+            candidates[:, a, 0] = states
+            stay = np.zeros(len(states))
+            for slot, (d, probability) in enumerate(zip(directions, (0.8, 0.1, 0.1)), start=1):
+                blocked = moves[d] == states
+                candidates[:, a, slot] = moves[d]
+                probs[:, a, slot] = probability
+                mask[:, a, slot] = ~blocked
+                stay += np.where(blocked, probability, 0.0)
+            probs[:, a, 0] = stay
+            mask[:, a, 0] = stay >= 1e-12
+        return mask.sum(axis=2).ravel(), candidates[mask], probs[mask]
+
+
+    def set_cells(self, edits):
+        """
+        Change cells of the grid and update the compiled model instead of compiling it again: only the rows of the
+        cells becoming or ceasing to be walls and of their neighbours are rebuilt, and the predecessor index is
+        patched if it has been built. The other indexes are built again when they are next used.
+        :param edits: new code of each edited cell, by position (dict of (row, col) -> int, or iterable of such pairs)
+        :return: edited states, states whose transitions changed (np.ndarray, np.ndarray)
+        """
+        # The edited cells are copied, the grid they are a view of is edited below
+        cells = bytearray(self.cells)
+        edited = set()
+        changed = set()
+        for (i, j), code in dict(edits).items():
+            if not (0 <= i < self.num_rows and 0 <= j < self.num_cols):
+                raise ValueError(f'Position {(i, j)} is outside of the grid')
+            state = self.position_to_state((i, j))
+            if (cells[state] == 3) != (code == 3):
+                # A wall appearing or disappearing changes the moves of the cell and of its neighbours
+                changed.update(self.position_to_state((n, m)) for n, m in [(i, j), (i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)]
+                               if 0 <= n < self.num_rows and 0 <= m < self.num_cols)
+            self.grid[i][j] = code
+            cells[state] = code
+            self.rewards[state] = REWARDS.get(code, np.nan)
+            self.terminal[state] = code in (1, 2)
+            edited.add(state)
+        self.cells = bytes(cells)
+        changed = np.array(sorted(changed), dtype=np.int64)
+        if len(changed) > 0:
+            self.update_rows(changed)
+        self.compact = None
+        self.compact_transitions = None
+        self.fingerprint = None
+        self.distances = None
+        return np.array(sorted(edited), dtype=np.int64), changed
+
+
+    def update_rows(self, states):
+        """
+        Rebuild the rows of the transition model of some states after their cells or their neighbours changed,
+        and patch the predecessor index if it has been built.
+        :param states: states, in increasing order (np.ndarray of int64)
+        """
+        rows = (states[:, np.newaxis] * 4 + np.arange(4)).ravel()
+        counts, next_states, probs = self.transition_rows(states)
+        local_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=local_indptr[1:])
+        old_next = {s: set(self.next_states[self.indptr[s * 4]:self.indptr[s * 4 + 4]].tolist()) for s in states.tolist()}
+        new_next = {s: set(next_states[local_indptr[i * 4]:local_indptr[i * 4 + 4]].tolist()) for i, s in enumerate(states.tolist())}
+
+        indptr, (self.next_states, self.probs, self.cum_probs) = splice_rows(
+            self.indptr, [self.next_states, self.probs, self.cum_probs], rows, counts,
+            [next_states, probs, cumulative_probs(local_indptr, probs)])
+        if indptr is not self.indptr:
+            self.indptr = indptr
+            self.transitions = sp.csr_matrix((self.probs, self.next_states, self.indptr),
+                                             shape=(self.num_states * 4, self.num_states))
+
+        if self.predecessors is not None:
+            pred_indptr, pred_states = self.predecessors
+            targets = sorted(set().union(*old_next.values(), *new_next.values()))
+            lists = []
+            for t in targets:
+                preds = {u for u in pred_states[pred_indptr[t]:pred_indptr[t + 1]].tolist() if u not in new_next}
+                preds.update(u for u, reached in new_next.items() if t in reached)
+                lists.append(sorted(preds))
+            pred_indptr, (pred_states,) = splice_rows(
+                pred_indptr, [pred_states], np.array(targets, dtype=np.int64), np.array([len(l) for l in lists]),
+                [np.array([u for l in lists for u in l], dtype=pred_states.dtype)])
+            self.predecessors = pred_indptr, pred_states
+
+
+    def predecessor_index(self):
+        """
+        Build (once per compiled model) the predecessor index of the transition model, in CSR format:
+        the states from which state s can be reached with any action are
+        pred_states[pred_indptr[s]:pred_indptr[s + 1]], each of them listed once.
+        :return: pred_indptr, pred_states (np.ndarray, np.ndarray)
+        """
+        if self.predecessors is None:
+            sources = np.repeat(np.arange(self.num_states * 4) // 4, np.diff(self.indptr))
+            adjacency = sp.csr_matrix((np.ones(len(sources), dtype=bool), (self.next_states, sources)),
+                                      shape=(self.num_states, self.num_states))
+            self.predecessors = adjacency.indptr, adjacency.indices
+        return self.predecessors
+
+
+    def compact_index(self):
+        """
+        Build (once per compiled model) the index of the states that can be reached from the start state with any
+        sequence of actions, found by a breadth-first search over the transition model. Walls and the empty cells
+        cut off from the start state are left out, the solvers only back up and store the indexed states.
+        :return: states, the reachable states in increasing order (np.ndarray),
+                 index, the position of each state in states, or -1 if it cannot be reached (np.ndarray of shape (num_states,))
+        """
+        if self.compact is None:
+            start = (self.num_rows - 1) * self.num_cols
+            # The rows of all the actions of a state are contiguous: every 4th pointer delimits the next states of a state
+            adjacency = sp.csr_matrix((self.probs, self.next_states, self.indptr[::4].copy()),
+                                      shape=(self.num_states, self.num_states))
+            states = np.sort(csgraph.breadth_first_order(adjacency, start, return_predecessors=False))
+            index = np.full(self.num_states, -1, dtype=self.indptr.dtype)
+            index[states] = np.arange(len(states), dtype=index.dtype)
+            self.compact = states, index
+        return self.compact
+
+
+    def compact_model(self):
+        """
+        Build (once per compiled model) the transition model restricted to the states of compact_index: the row
+        i * 4 + action id and the column j of the transitions are the i-th and the j-th reachable states.
+        When every state can be reached, the full model is returned without a copy.
+        :return: transitions (scipy.sparse.csr_matrix of shape (num_reachable * 4, num_reachable)),
+                 rewards (np.ndarray of shape (num_reachable,))
+        """
+        if self.compact_transitions is None:
+            states, index = self.compact_index()
+            if len(states) == self.num_states:
+                self.compact_transitions = self.transitions, self.rewards
+            else:
+                # The next states of a reachable state are reachable, and index keeps their order in each row
+                rows = self.transitions[(states[:, np.newaxis] * 4 + np.arange(4)).ravel()]
+                transitions = sp.csr_matrix((rows.data, index[rows.indices], rows.indptr),
+                                            shape=(len(states) * 4, len(states)))
+                self.compact_transitions = transitions, self.rewards[states]
+        return self.compact_transitions
+
+
+    def model_hash(self):
+        """
+        Hash (once per compiled model) the grid and the transition model, so that two environments with the same hash
+        have the same solutions.
+        :return: hexadecimal digest (str)
+        """
+        if self.fingerprint is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(np.array([self.num_rows, self.num_cols], dtype=np.int64).tobytes())
+            for array in [np.frombuffer(self.cells, dtype=np.uint8), self.rewards, self.indptr, self.next_states, self.probs]:
+                h.update(np.ascontiguousarray(array))
+            self.fingerprint = h.hexdigest()
+        return self.fingerprint
+
+
+    def distance_fields(self):
+        """
+        Build (once per compiled model) the number of moves from each state to the nearest reward and to the nearest
+        ghost, with a breadth-first search from all the cells of a kind at once over the moves of the transition model.
+        The paths to a reward do not cross a ghost, and the paths to a ghost do not cross a reward.
+        :return: distance to the nearest reward, distance to the nearest ghost (np.ndarray of float of shape
+                 (num_states,), inf if there is none on the way), nearest reward, nearest ghost (np.ndarray of int of
+                 shape (num_states,), -1 if there is none on the way)
+        """
+        if self.distances is None:
+            cells = np.frombuffer(self.cells, dtype=np.uint8)
+            # Row s holds the states the moves from s can lead to
+            adjacency = sp.csr_matrix((np.ones(len(self.next_states)), self.next_states, self.indptr[::4].copy()),
+                                      shape=(self.num_states, self.num_states))
+            fields = []
+            for code, crossed in [(1, 2), (2, 1)]:
+                targets = np.flatnonzero(cells == code)
+                if len(targets) == 0:
+                    fields.append((np.full(self.num_states, np.inf), np.full(self.num_states, -1)))
+                    continue
+                # Without the moves into the cells of the other kind, and reversed to search from the targets
+                graph = (adjacency @ sp.diags((cells != crossed).astype(float))).T.tocsr()
+                graph.eliminate_zeros()
+                distances, _, nearest = csgraph.dijkstra(graph, indices=targets, unweighted=True, min_only=True,
+                                                         return_predecessors=True)
+                fields.append((distances, np.where(nearest >= 0, nearest, -1)))
+            (reward_distances, nearest_rewards), (ghost_distances, nearest_ghosts) = fields
+            self.distances = reward_distances, ghost_distances, nearest_rewards, nearest_ghosts
+        return self.distances
+
+
+    def heuristic_values(self, gamma):
+        """
+        Estimate the value of each state from the distance fields, to start the solvers closer to the optimal values
+        than from zeros. A state goes straight to its nearest reward, then keeps collecting it: the best action of the
+        reward cell gives it again with probability p (by bumping into a wall or moving to a neighbouring reward),
+        otherwise Pacman comes back one move later. The states whose paths to a reward cross a ghost can also go
+        through their nearest ghost first. The walls and the states that cannot be reached are 0, as in a cold start.
+        :param gamma: discount factor (float, below 1)
+        :return: values (np.ndarray of shape (num_states,))
+        """
+        if not gamma < 1:
+            raise ValueError(f'The heuristic values need gamma below 1, got {gamma}')
+        step, reward, ghost = REWARDS[0], REWARDS[1], REWARDS[2]
+        reward_distances, ghost_distances, nearest_rewards, nearest_ghosts = self.distance_fields()
+        cells = np.frombuffer(self.cells, dtype=np.uint8)
+        p = (self.transitions @ (cells == 1).astype(float)).reshape(-1, 4).max(axis=1)
+        collected = (p * reward + (1 - p) * (step + gamma * reward)) / (1 - p * gamma - (1 - p) * gamma ** 2)
+
+        def through(distances, nearest, gain, after):
+            # Value of d - 1 empty cells, then the target cell, then the value after it
+            d = np.where(nearest >= 0, np.maximum(distances, 1), 1)
+            value = step * (1 - gamma ** (d - 1)) / (1 - gamma) + gamma ** (d - 1) * (gain + gamma * after[np.maximum(nearest, 0)])
+            return np.where(nearest >= 0, value, -np.inf)
+
+        values = np.where(reward_distances == 0, collected, through(reward_distances, nearest_rewards, reward, collected))
+        values = np.fmax(values, through(ghost_distances, nearest_ghosts, ghost, values))
+        # No reward on the way: the cost of moving forever
+        values[np.isneginf(values)] = step / (1 - gamma)
+        _, index = self.compact_index()
+        return np.where((index >= 0) & (cells != 3), values, 0.0)
 
 
     def state_to_position(self, state):
@@ -26,15 +381,7 @@ class GameEnv:
         :param state: current state (int)
         :return: reward (float)
         """
-        n, m = self.state_to_position(state)
-        if self.grid[n][m] == 0:
-            return -0.04
-        elif self.grid[n][m] == 1:
-            return 1
-        elif self.grid[n][m] == 2:
-            return -1
-        else:
-            return float('nan')
+        return REWARDS.get(self.cells[state], float('nan'))
 
 
     def get_next_state(self, state, action):
@@ -64,40 +411,12 @@ class GameEnv:
         Given the current state and action, return the list of possible next states after taking the action with their probabilities.
         If the action leads to bumping into a wall, it results in staying in the current state with the same probability.
         :param state: current state (int)
-        :param action: action to be taken ('up', 'down', 'left', 'right')
+        :param action: action to be taken ('up', 'down', 'left', 'right') or its id in ACTIONS
         :return: list of possible next states with their probabilities (list of tuples (next_state, probability))
         """
-        states = [(state, 0.0)]
-
-        if action == 'up' or action == 'down':
-            next_state = self.get_next_state(state, action)
-            if next_state == state:
-                states[0] = (state, states[0][1] + 0.8)
-            else:
-                states.append((next_state, 0.8))
-            for a in ['left', 'right']:
-                next_state = self.get_next_state(state, a)
-                if next_state == state:
-                    states[0] = (state, states[0][1] + 0.1)
-                else:
-                    states.append((next_state, 0.1))
-        elif action == 'left' or action == 'right':
-            next_state = self.get_next_state(state, action)
-            if next_state == state:
-                states[0] = (state, states[0][1] + 0.8)
-            else:
-                states.append((next_state, 0.8))
-            for a in ['up', 'down']:
-                next_state = self.get_next_state(state, a)
-                if next_state == state:
-                    states[0] = (state, states[0][1] + 0.1)
-                else:
-                    states.append((next_state, 0.1))
-
-        if states[0][1] < 1e-12:
-            states = states[1:]
-        
-        return states
+        k = state * 4 + ACTION_IDS.get(action, action)
+        start, end = self.indptr[k], self.indptr[k + 1]
+        return list(zip(self.next_states[start:end].tolist(), self.probs[start:end].tolist()))
 
 
     def draw_next_state(self, state, possible_next_states):
@@ -107,7 +426,7 @@ class GameEnv:
         :param possible_next_states: list of possible next states with their probabilities (list of tuples (next_state, probability))
         :return: next state (int)
         """
-        r = random.random()
+        r = self.rng.random()
         cum = 0
         for next_state, probability in possible_next_states:
             cum += probability
@@ -116,14 +435,52 @@ class GameEnv:
         return state
     
 
+    def sample_next_state(self, state, action, rng=None):
+        """
+        Draw the next state of a state-action pair from the cumulative probabilities of the compiled model, without
+        building the list of get_possible_next_states. Given the same random number, the next state is the one
+        draw_next_state would return.
+        :param state: current state (int)
+        :param action: id of the action taken in ACTIONS (int)
+        :param rng: random numbers to use instead of self.rng (RandomStream or the random module)
+        :return: next state (int)
+        """
+        r = (self.rng if rng is None else rng).random()
+        k = state * 4 + action
+        for j in range(self.indptr.item(k), self.indptr.item(k + 1)):
+            if r < self.cum_probs.item(j):
+                return self.next_states.item(j)
+        return state
+
+
+    def sample_next_states(self, states, actions, rng):
+        """
+        Draw the next state of several state-action pairs at once, as draw_next_state does for one of them.
+        :param states: current states (np.ndarray)
+        :param actions: ids of the actions taken, in ACTIONS (np.ndarray)
+        :param rng: random generator, one number is drawn per pair (np.random.Generator)
+        :return: next states (np.ndarray of int64)
+        """
+        rows = states * 4 + actions
+        start = self.indptr[rows]
+        count = self.indptr[rows + 1] - start
+        r = rng.random(len(states))
+        # Index of the first possible next state whose cumulative probability is above r, -1 if rounding errors leave none
+        chosen = np.full(len(states), -1, dtype=np.int64)
+        last = len(self.cum_probs) - 1
+        for slot in range(3, -1, -1):
+            entries = np.minimum(start + slot, last)
+            chosen = np.where((slot < count) & (r < self.cum_probs[entries]), entries, chosen)
+        return np.where(chosen >= 0, self.next_states[chosen], states)
+
+
     def is_terminal(self, state):
         """
         Check if the state is terminal.
         :param state: current state (int)
         :return: True if the state is terminal, False otherwise (bool)
         """
-        n, m = self.state_to_position(state)
-        return self.grid[n][m] in [1, 2]
+        return self.cells[state] in (1, 2)
 
 
     def print_grid(self):
@@ -146,11 +503,12 @@ class GameEnv:
         print()
 
     
-    def reset(self):
+    def reset(self, state=None):
         """
         Reset the game to the initial state.
+        :param state: state to start from instead of the bottom left corner (int)
         """
-        self.state = (self.num_rows - 1) * self.num_cols
+        self.state = (self.num_rows - 1) * self.num_cols if state is None else state
 
 
     def test_env(self):
@@ -191,6 +549,47 @@ class GameEnv:
             self.print_grid()
 
 
+class VectorGameEnv:
+    def __init__(self, game_env, num_envs, seed=None):
+        """
+        Runs num_envs independent games on the grid of game_env, stepping all of them with a single call.
+        :param game_env: GameEnv object holding the compiled transition model of the grid
+        :param num_envs: number of games (int)
+        :param seed: seed of the random generator (int or None)
+        """
+        self.game_env = game_env
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        # Pacman always starts in the bottom left corner of the grid
+        self.start_state = (game_env.num_rows - 1) * game_env.num_cols
+        self.states = np.full(num_envs, self.start_state, dtype=np.int64)
+
+
+    def reset(self):
+        """
+        Reset all the games to the initial state.
+        :return: states of the games (np.ndarray of shape (num_envs,))
+        """
+        self.states[:] = self.start_state
+        return self.states.copy()
+
+
+    def step(self, actions):
+        """
+        Take one action in every game. As in QLearning.train, an episode ends with the move made from a terminal
+        state: the games whose episode ended are reset to the initial state.
+        :param actions: ids of the actions to take, in ACTIONS (np.ndarray of shape (num_envs,))
+        :return: next states, rewards and done flags (np.ndarray of shape (num_envs,) each), the next states
+                 are the ones reached before resetting the games that are done
+        """
+        env = self.game_env
+        next_states = env.sample_next_states(self.states, actions, self.rng)
+        rewards = env.rewards[next_states]
+        done = env.terminal[self.states]
+        self.states = np.where(done, self.start_state, next_states)
+        return next_states, rewards, done
+
+
 if __name__ == "__main__":
     grid = [[0, 0, 0, 1],
             [0, 3, 0, 2],
@@ -1,14 +1,24 @@
+import sys
+
 from value_iteration import ValueIteration
 from q_learning import QLearning
+from solution_cache import SolutionCache
 
 
 # Create an instance of the ValueIteration class that reads the environment from the file 'value-iteration.txt'
 # and create its own GameEnv object.
 vi = ValueIteration('value-iteration.txt')
 # Run the value iteration algorithm and store the values for each state in self.values.
-vi.value_iteration(trace=True)
+# With 'python3 main.py --cache', the solution is stored in the directory 'solution-cache': the next runs load it
+# instead of solving the same map again, and only log that it was loaded from the cache.
+cache = SolutionCache() if '--cache' in sys.argv[1:] else None
+vi.value_iteration(trace=True, cache=cache)
 # Compute the final policy and store the policy for each state in self.policy.
 vi.compute_policy(trace=True)
+# PolicyIteration('value-iteration.txt') reads the same file and fills the same self.values and self.policy
+# with pi.policy_iteration(). Value iteration is kept here: it is the fastest solver for this map and gamma=0.5,
+# and its trace is the content of log-file_VI.txt. Policy iteration only pays off when gamma is close to 1,
+# e.g. PolicyIteration(path, eval_steps=20) solves a 100x100 maze with gamma=0.99 4 times faster.
 
 
 #Create an instance of the QLearning class that reads the environment from the file 'Q-Learning.txt'
@@ -0,0 +1,65 @@
+import numpy as np
+from scipy import ndimage
+
+
+def random_maze(num_rows, num_cols, wall_density=0.2, num_terminals=2, seed=None):
+    """
+    Generate a random grid in the format of GameEnv, in which every empty cell can be reached from the start state.
+    The walls are drawn independently with probability wall_density, then the start state (bottom left corner) is
+    connected to the largest empty region by a corridor, and the regions left unreachable are filled with walls.
+    The terminal states are drawn among the reachable cells so that every episode can end. They alternate between
+    rewards and ghosts, starting with a reward so that every grid has at least one.
+    :param num_rows: number of rows (int)
+    :param num_cols: number of columns (int)
+    :param wall_density: probability of each cell to be a wall before the unreachable regions are filled (float)
+    :param num_terminals: number of terminal states (int)
+    :param seed: seed of the random generator, the same seed always gives the same grid (int or None)
+    :return: grid, cell codes 0 (empty), 1 (reward), 2 (ghost) and 3 (wall) (list of lists of int)
+    """
+    if num_rows < 1 or num_cols < 1:
+        raise ValueError("Grid should be non-empty")
+    if not 0 <= wall_density < 1:
+        raise ValueError(f'wall_density should be in [0, 1), got {wall_density}')
+    if num_terminals < 1:
+        raise ValueError(f'num_terminals should be at least 1, got {num_terminals}')
+    rng = np.random.default_rng(seed)
+    start = (num_rows - 1, 0)
+    walls = rng.random((num_rows, num_cols)) < wall_density
+    walls[start] = False
+
+    # Corridor from the start state to the closest cell of the largest empty region: up the first column, then right
+    labels, _ = ndimage.label(~walls)
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0
+    largest = labels == sizes.argmax()
+    if not largest[start]:
+        rows, cols = np.nonzero(largest)
+        closest = np.argmin(start[0] - rows + cols)
+        walls[rows[closest]:, 0] = False
+        walls[rows[closest], :cols[closest] + 1] = False
+        labels, _ = ndimage.label(~walls)
+    reachable = (labels == labels[start]).ravel()
+
+    cells = np.where(reachable, 0, 3).astype(np.uint8)
+    candidates = np.flatnonzero(reachable)
+    candidates = candidates[candidates != start[0] * num_cols]
+    if num_terminals > len(candidates):
+        raise ValueError(f'Only {len(candidates)} cells can be terminal states, got num_terminals={num_terminals}')
+    terminals = rng.choice(candidates, size=num_terminals, replace=False)
+    cells[terminals] = np.where(np.arange(num_terminals) % 2 == 0, 1, 2)
+    return cells.reshape(num_rows, num_cols).tolist()
+
+
+def write_settings_file(path_to_settings, grid, *parameters):
+    """
+    Write a settings file that can be read by the solvers.
+    :param path_to_settings: path to the settings file (str)
+    :param grid: grid (list of lists of int)
+    :param parameters: parameters following the grid, e.g. gamma and epsilon for ValueIteration,
+                       gamma, alpha and nb_episodes for QLearning
+    """
+    with open(path_to_settings, 'w') as f:
+        for row in grid:
+            f.write(''.join(str(c) for c in row) + '\n')
+        for parameter in parameters:
+            f.write(f'{parameter}\n')
@@ -0,0 +1,195 @@
+from collections import deque
+import functools
+import json
+import threading
+import time
+
+
+class Metrics:
+    def __init__(self, max_series=10000):
+        """
+        Counters, timers and series of values of a run, e.g. the number of backups, the time spent in a method or the
+        delta of each iteration. The solvers only update it when it is given to their instrument method.
+        :param max_series: number of recent values kept in each series (int)
+        """
+        self.max_series = max_series
+        self.created = time.perf_counter()
+        self.counters = {}
+        # name -> [number of calls, total time in seconds]
+        self.timers = {}
+        # name -> recent values, and name -> [number of values, min, max]
+        self.series = {}
+        self.summaries = {}
+
+
+    def count(self, name, n=1):
+        """
+        Increment a counter.
+        :param name: name of the counter (str)
+        :param n: increment (int)
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def add_time(self, name, seconds, calls=1):
+        """
+        Add time to a timer.
+        :param name: name of the timer (str)
+        :param seconds: time spent (float)
+        :param calls: number of calls the time was spent in (int)
+        """
+        timer = self.timers.setdefault(name, [0, 0.0])
+        timer[0] += calls
+        timer[1] += seconds
+
+
+    def observe(self, name, value):
+        """
+        Append a value to a series.
+        :param name: name of the series (str)
+        :param value: value (float)
+        """
+        if name not in self.series:
+            self.series[name] = deque(maxlen=self.max_series)
+            self.summaries[name] = [0, value, value]
+        self.series[name].append(value)
+        summary = self.summaries[name]
+        summary[0] += 1
+        summary[1] = min(summary[1], value)
+        summary[2] = max(summary[2], value)
+
+
+    def wrap(self, function, name):
+        """
+        Wrap a function so that its calls and the time spent in it are added to a timer.
+        :param function: function (callable)
+        :param name: name of the timer (str)
+        :return: wrapped function (callable)
+        """
+        timer = self.timers.setdefault(name, [0, 0.0])
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer[0] += 1
+                timer[1] += perf_counter() - start
+        return timed
+
+
+    def instrument(self, obj, *names, prefix=None):
+        """
+        Time the calls to methods of an object, by shadowing them with wrapped versions on the object itself.
+        The other objects of the same class are not affected. See restore to remove the wrappers.
+        :param obj: object
+        :param names: names of the methods (str)
+        :param prefix: prefix of the names of the timers, the name of the class of obj by default (str)
+        :return: obj
+        """
+        prefix = type(obj).__name__ if prefix is None else prefix
+        for name in names:
+            setattr(obj, name, self.wrap(getattr(obj, name), f'{prefix}.{name}'))
+        return obj
+
+
+    @staticmethod
+    def restore(obj, *names):
+        """
+        Remove the wrappers added by instrument.
+        :param obj: object
+        :param names: names of the methods (str)
+        """
+        for name in names:
+            obj.__dict__.pop(name, None)
+
+
+    def snapshot(self):
+        """
+        Copy the current state of the metrics. Can be called from another thread while a solver is running.
+        :return: elapsed time since the creation of the metrics, counters, timers with their number of calls, total
+                 and mean time, and series with their number of values, last, min and max value and recent values (dict)
+        """
+        timers = {name: tuple(timer) for name, timer in dict(self.timers).items()}
+        summaries = {name: tuple(summary) for name, summary in dict(self.summaries).items()}
+        series = {name: list(values) for name, values in dict(self.series).items()}
+        return {
+            'elapsed': time.perf_counter() - self.created,
+            'counters': dict(self.counters),
+            'timers': {name: {'calls': calls, 'total': total, 'mean': total / calls if calls else 0.0}
+                       for name, (calls, total) in timers.items()},
+            'series': {name: {'count': summaries[name][0], 'last': series[name][-1] if series[name] else None,
+                              'min': summaries[name][1], 'max': summaries[name][2], 'recent': series[name]}
+                       for name in series if name in summaries},
+        }
+
+
+    def to_json(self, path=None):
+        """
+        Dump a snapshot of the metrics as JSON.
+        :param path: file to write the snapshot to, None to only return it (str)
+        :return: snapshot (str)
+        """
+        dump = json.dumps(self.snapshot())
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(dump)
+        return dump
+
+
+    def sample(self, interval, callback):
+        """
+        Call a function with a snapshot of the metrics every interval seconds, on a background thread.
+        Each snapshot also holds the rate of each counter since the previous one, e.g. the steps per second.
+        :param interval: time between two snapshots in seconds (float)
+        :param callback: function called with each snapshot (callable)
+        :return: sampler, stop it with its stop method (Sampler)
+        """
+        sampler = Sampler(self, interval, callback)
+        sampler.start()
+        return sampler
+
+
+class Sampler(threading.Thread):
+    def __init__(self, metrics, interval, callback):
+        """
+        Background thread taking the snapshots of Metrics.sample.
+        :param metrics: Metrics object
+        :param interval: time between two snapshots in seconds (float)
+        :param callback: function called with each snapshot (callable)
+        """
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.callback = callback
+        self.stopped = threading.Event()
+        self.previous = None
+
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.take()
+
+
+    def take(self):
+        """
+        Take a snapshot, add the rates of the counters since the previous one and give it to the callback.
+        """
+        snapshot = self.metrics.snapshot()
+        previous = self.previous or {'elapsed': 0.0, 'counters': {}}
+        elapsed = snapshot['elapsed'] - previous['elapsed']
+        snapshot['rates'] = {name: (value - previous['counters'].get(name, 0)) / elapsed if elapsed > 0 else 0.0
+                             for name, value in snapshot['counters'].items()}
+        self.previous = snapshot
+        self.callback(snapshot)
+
+
+    def stop(self):
+        """
+        Stop the sampler, after a last snapshot so that the end of the run is always sampled.
+        """
+        self.stopped.set()
+        self.join()
+        self.take()
@@ -0,0 +1,147 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator, bicgstab, splu, spsolve
+
+from game_env import ACTIONS
+
+
+# A level of the hierarchy is an MDP over blocks of cells: the cells of each 2x2 block of the finer level are merged
+# into one coarse state. Moving from a coarse state follows the average of the moves of its cells, and a coarse
+# value is copied back to the cells of its block. A value crosses a coarse level in half as many moves, so the
+# coarse levels carry the rewards across the grid, which the sweeps of a fine level only do one cell at a time:
+# - each level is solved starting from the values of the next coarser one (full multigrid),
+# - the values of each policy are solved with a Krylov method preconditioned by V-cycles over the coarser levels.
+
+
+class Level:
+    def __init__(self, coords, transitions, rewards):
+        """
+        :param coords: row and column of each state of the level, in units of its blocks (np.ndarray of shape (n, 2))
+        :param transitions: transition model, row state * 4 + action id (scipy.sparse.csr_matrix of shape (n * 4, n))
+        :param rewards: expected reward of each (state, action) pair (np.ndarray of shape (n * 4,))
+        """
+        self.coords = coords
+        self.transitions = transitions
+        self.rewards = rewards
+        # Averaging of the states of each block (restriction) and copy of the value of a block to its states
+        # (prolongation), set when the next coarser level is built
+        self.restriction = None
+        self.prolongation = None
+
+
+    def __len__(self):
+        return len(self.coords)
+
+
+    def coarsen(self):
+        """
+        Build the next coarser level by merging the states of each 2x2 block.
+        :return: coarser level (Level)
+        """
+        blocks, inverse = np.unique(self.coords // 2, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        n, num_blocks = len(self), len(blocks)
+        sizes = np.bincount(inverse, minlength=num_blocks)
+        self.restriction = sp.csr_matrix((1 / sizes[inverse], (inverse, np.arange(n))), shape=(num_blocks, n))
+        self.prolongation = sp.csr_matrix((np.ones(n), (np.arange(n), inverse)), shape=(n, num_blocks))
+        pairs = sp.kron(self.restriction, sp.identity(len(ACTIONS)), format='csr')
+        return Level(blocks, (pairs @ self.transitions @ self.prolongation).tocsr(), pairs @ self.rewards)
+
+
+def build_levels(coords, transitions, rewards, min_states=1000):
+    """
+    :param coords: row and column of each state (np.ndarray of shape (n, 2))
+    :param transitions: transition model (scipy.sparse.csr_matrix of shape (n * 4, n))
+    :param rewards: reward of each state (np.ndarray of shape (n,))
+    :param min_states: the coarsest level is the first one with at most min_states states (int)
+    :return: levels, from the finest to the coarsest (list of Level)
+    """
+    levels = [Level(coords, transitions, transitions @ rewards)]
+    while len(levels[-1]) > min_states:
+        coarser = levels[-1].coarsen()
+        if len(coarser) == len(levels[-1]):
+            break
+        levels.append(coarser)
+    return levels
+
+
+def v_cycle(levels, matrices, coarsest, gamma, b, smoothing=2):
+    """
+    Approximately solve (I - gamma * matrices[0]) x = b with one V-cycle: smooth with Jacobi sweeps, correct with
+    the solution of the residual equation on the coarser level, smooth again.
+    :param levels: levels, from the level of the system to the coarsest (list of Level)
+    :param matrices: transitions of the evaluated policy on each level (list of scipy.sparse.csr_matrix)
+    :param coarsest: factorization of the system of the coarsest level (scipy.sparse.linalg.SuperLU)
+    :param gamma: discount factor (float)
+    :param b: right-hand side (np.ndarray)
+    :param smoothing: number of Jacobi sweeps before and after the correction (int)
+    :return: approximate solution (np.ndarray)
+    """
+    if len(levels) == 1:
+        return coarsest.solve(b)
+    matrix = matrices[0]
+    x = b.copy()
+    for _ in range(smoothing):
+        x = b + gamma * (matrix @ x)
+    residual = b - x + gamma * (matrix @ x)
+    x += levels[0].prolongation @ v_cycle(levels[1:], matrices[1:], coarsest, gamma,
+                                          levels[0].restriction @ residual, smoothing)
+    for _ in range(smoothing):
+        x = b + gamma * (matrix @ x)
+    return x
+
+
+def evaluate_policy(levels, rows, gamma, values):
+    """
+    Solve the linear system of the values of a policy on the first level, with a Krylov method preconditioned by
+    V-cycles over the coarser levels.
+    :param levels: levels, from the level of the policy to the coarsest (list of Level)
+    :param rows: row of the transition model of the action of each state (np.ndarray)
+    :param gamma: discount factor (float)
+    :param values: starting point (np.ndarray)
+    :return: values of the policy, number of Krylov iterations (np.ndarray, int)
+    """
+    matrix = levels[0].transitions[rows]
+    system = (sp.identity(len(rows), format='csr') - gamma * matrix).tocsr()
+    rewards = levels[0].rewards[rows]
+    if len(levels) == 1:
+        return splu(system.tocsc()).solve(rewards), 0
+    # Transitions of the policy on the coarser levels, as the moves of the blocks average the moves of their states
+    matrices = [matrix]
+    for level in levels[:-1]:
+        matrices.append((level.restriction @ matrices[-1] @ level.prolongation).tocsr())
+    coarsest = splu((sp.identity(matrices[-1].shape[0], format='csc') - gamma * matrices[-1]).tocsc())
+    preconditioner = LinearOperator(system.shape, matvec=lambda b: v_cycle(levels, matrices, coarsest, gamma, b))
+    iterations = [0]
+
+    def count(_):
+        iterations[0] += 1
+
+    values, info = bicgstab(system, rewards, x0=values, rtol=1e-10, M=preconditioner, callback=count)
+    if info != 0:
+        # Not converged: fall back to a direct solve
+        values = spsolve(system.tocsc(), rewards)
+    return values, iterations[0]
+
+
+def bellman_backup(level, gamma, values):
+    """
+    :param level: Level
+    :param gamma: discount factor (float)
+    :param values: values of the states of the level (np.ndarray)
+    :return: backed up values and greedy action ids (np.ndarray, np.ndarray)
+    """
+    q = (level.rewards + gamma * (level.transitions @ values)).reshape(-1, len(ACTIONS))
+    return q.max(axis=1), q.argmax(axis=1)
+
+
+def error_bound(gamma, values, backed_up):
+    """
+    Bound of the largest distance between the backed up values and the optimal ones. Unlike the sum of the changes
+    of a sweep, it does not grow with the number of states.
+    :param gamma: discount factor (float, below 1)
+    :param values: values (np.ndarray)
+    :param backed_up: values after a Bellman backup (np.ndarray)
+    :return: bound (float)
+    """
+    return gamma / (1 - gamma) * float(np.abs(backed_up - values).max(initial=0.0))
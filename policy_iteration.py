@@ -0,0 +1,125 @@
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
+
+from game_env import ACTIONS
+from tracing import close_trace, grid_rows, open_trace
+from value_iteration import ValueIteration
+
+
+class PolicyIteration(ValueIteration):
+    # File the traces are appended to, and name of the solver in the trace records
+    log_file = 'log-file_PI.txt'
+    solver_name = 'policy_iteration'
+
+    def __init__(self, path_to_settings, eval_steps=None):
+        """
+        Reads the same settings file as ValueIteration and fills the same self.values and self.policy.
+        :param path_to_settings: path to the settings file (str)
+        :param eval_steps: None to evaluate each policy exactly with a sparse linear solve (gamma must be below 1),
+                           k to evaluate it with k Bellman backups (modified policy iteration) (int)
+        """
+        game_env, gamma, epsilon = self.parse_settings_file(path_to_settings)
+        self.setup(game_env, gamma, epsilon, eval_steps)
+
+
+    def setup(self, game_env, gamma, epsilon, eval_steps=None):
+        """
+        Initialize the solver, see the constructor for the parameters.
+        """
+        super().setup(game_env, gamma, epsilon)
+        self.eval_steps = eval_steps
+
+
+    def policy_iteration(self, trace=False, verbose=False):
+        """
+        Runs the policy iteration algorithm and stores the values and the policy for each state in self.values and self.policy.
+        Each iteration evaluates the current policy, then improves it greedily. With exact evaluation, the algorithm stops
+        when the policy is stable. With modified policy iteration, it stops when the delta of a greedy backup of the values,
+        computed as in ValueIteration, is below epsilon. Walls and unreachable states are never evaluated.
+        :param trace: (bool, str or TraceWriter) if True or 'full', write the values and the policy to the file 'log-file_PI.txt'
+                      after each iteration, if 'summary', only write the delta and the number of changed actions,
+                      see ValueIteration.value_iteration
+        :param verbose: (bool) if True, print the values to the console after each iteration
+        """
+        env = self.game_env
+        reachable, _ = env.compact_index()
+        compact_transitions, compact_rewards = env.compact_model()
+        # Position in reachable of the evaluated states (the start state can be a wall)
+        states = np.flatnonzero(np.frombuffer(env.cells, dtype=np.uint8)[reachable] != 3)
+        all_values = np.asarray(self.values, dtype=float)
+        values = all_values[reachable]
+        q = self.q_array(values, compact=True)
+        actions = q.argmax(axis=1)
+
+        writer, owned = open_trace(trace, self.log_file)
+        if writer is not None:
+            writer.write({'type': 'start', 'solver': self.solver_name, 'grid': grid_rows(env), 'gamma': self.gamma})
+        c = 0
+        backups = len(states)
+        # Backups already added to the metrics
+        recorded = 0
+        if self.metrics is not None:
+            self.iteration_start = time.perf_counter()
+        while True:
+            c += 1
+            # Transition model and expected reward of the current policy, restricted to the states that are not walls
+            transitions = compact_transitions[states * len(ACTIONS) + actions[states]]
+            rewards = transitions @ np.nan_to_num(compact_rewards)
+            transitions = transitions[:, states]
+            if self.eval_steps is None:
+                values[states] = spsolve(sp.identity(len(states), format='csc') - self.gamma * transitions.tocsc(), rewards)
+            else:
+                for _ in range(self.eval_steps):
+                    values[states] = rewards + self.gamma * (transitions @ values[states])
+                backups += self.eval_steps * len(states)
+
+            q = self.q_array(values, compact=True)
+            backups += len(states)
+            best = q.max(axis=1)
+            delta = np.abs(best[states] - values[states]).sum()
+            # Keep the current action when it is as good as the best one, so that ties never make the policy cycle
+            current = q[np.arange(len(reachable)), actions]
+            new_actions = np.where(current >= best - 1e-12 * np.abs(best), actions, q.argmax(axis=1))
+            changed = np.count_nonzero(new_actions[states] != actions[states])
+            actions = new_actions
+
+            all_values[reachable] = values
+            self.values = all_values
+            if verbose:
+                self.print_values(c, delta)
+            if writer is not None:
+                record = {'type': 'evaluation', 'iteration': c, 'delta': float(delta), 'changed': int(changed)}
+                if writer.full:
+                    record['values'] = all_values.tolist()
+                writer.write(record)
+            if self.metrics is not None:
+                self.record_iteration(delta, backups - recorded)
+                self.metrics.observe('changed', int(changed))
+                recorded = backups
+
+            if self.eval_steps is None and changed == 0:
+                break
+            if self.eval_steps is not None and delta < self.epsilon:
+                break
+
+        self.values = all_values.tolist()
+        # States without any valid action, and the unreachable states, keep an empty policy
+        actions[np.all(q == float('-inf'), axis=1)] = len(ACTIONS)
+        all_actions = np.full(env.num_states, len(ACTIONS))
+        all_actions[reachable] = actions
+        self.policy = [(ACTIONS + [''])[a] for a in all_actions.tolist()]
+        mode = 'exact' if self.eval_steps is None else f'modified-{self.eval_steps}'
+        self.stats = {'mode': mode, 'iterations': c, 'backups': backups}
+        if writer is not None:
+            writer.write({'type': 'stable' if self.eval_steps is None else 'converged', **self.stats})
+            self.trace_policy(writer)
+        close_trace(writer, owned, self.log_file)
+
+
+if __name__ == '__main__':
+    pi = PolicyIteration('value-iteration.txt')
+    pi.policy_iteration(verbose=True, trace=True)
+    pi.print_policy()
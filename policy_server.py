@@ -0,0 +1,354 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import struct
+import time
+
+import numpy as np
+
+from evaluation import policy_action_ids
+from metrics import Metrics
+
+
+# Every message starts with an opcode and the length of its payload:
+# - b'q' query, payload: states (little-endian int32), answer: b'q', then the action id of each state (int8, -1 for
+#   no action or an invalid state) followed by the value of each state (little-endian float64, NaN for an invalid state)
+# - b's' statistics, empty payload, answer: b's' and the statistics as JSON
+# - b'r' reload, payload: path to a model (UTF-8), answer: b'r' and the description of the new model as JSON
+# - answer b'e' and a message (UTF-8) when a request fails
+HEADER = struct.Struct('<cI')
+STATE_DTYPE = np.dtype('<i4')
+VALUE_DTYPE = np.dtype('<f8')
+
+
+class PolicyModel:
+    def __init__(self, actions, values, source=None):
+        """
+        Solved policy held in flat arrays, so that a query is a single array lookup.
+        :param actions: id of the action of each state in ACTIONS, -1 for none (np.ndarray of shape (num_states,))
+        :param values: value of each state (np.ndarray of shape (num_states,))
+        :param source: file the model was loaded from (str)
+        """
+        if actions.shape != values.shape or actions.ndim != 1:
+            raise ValueError(f'actions and values should have the same shape (num_states,), got {actions.shape} and {values.shape}')
+        self.actions = actions.astype(np.int8)
+        self.values = values.astype(VALUE_DTYPE)
+        self.source = source
+        self.loaded = time.time()
+
+
+    def query(self, states):
+        """
+        :param states: states (np.ndarray of int)
+        :return: action id and value of each state, -1 and NaN for the states outside of the map (np.ndarray of int8,
+                 np.ndarray of float64)
+        """
+        valid = (states >= 0) & (states < len(self.actions))
+        if valid.all():
+            return self.actions[states], self.values[states]
+        clipped = np.where(valid, states, 0)
+        return np.where(valid, self.actions[clipped], -1).astype(np.int8), np.where(valid, self.values[clipped], np.nan)
+
+
+    def describe(self):
+        """
+        :return: size and origin of the model (dict)
+        """
+        return {'states': len(self.actions), 'source': self.source, 'loaded': self.loaded}
+
+
+def save_model(path, solver):
+    """
+    Write the policy and the values of a solver in the format read by load_model, atomically so that a server
+    watching the file never reads a partial one.
+    :param path: path to the model, a .npz file (str)
+    :param solver: solver with a policy, and values (ValueIteration, PolicyIteration) or Q-values (QLearning...)
+    """
+    game_env = solver.game_env
+    actions = policy_action_ids(solver, game_env)
+    if hasattr(solver, 'values'):
+        values = np.asarray(solver.values, dtype=float)
+    else:
+        values = np.array([max(solver.q_values[state].values()) for state in range(game_env.num_states)])
+    buffer = io.BytesIO()
+    np.savez(buffer, policy=actions.astype(np.int8), values=values)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(buffer.getbuffer())
+    os.replace(path + '.tmp', path)
+
+
+def load_model(path):
+    """
+    Load a model written by save_model, or an entry of a SolutionCache solved by value_iteration.
+    :param path: path to the model (str)
+    :return: PolicyModel
+    """
+    with np.load(path) as npz:
+        if 'policy' not in npz or 'values' not in npz:
+            raise ValueError(f'{path} is not a model, it has no policy or values')
+        return PolicyModel(npz['policy'], npz['values'], path)
+
+
+class PolicyServer:
+    def __init__(self, model, metrics=None):
+        """
+        Answer the queries of a model over a socket, see HEADER for the protocol. The requests of a connection are
+        answered in order, so a client can send several of them before reading the answers.
+        :param model: PolicyModel
+        :param metrics: Metrics object updated with the number of requests ('requests', 'queries', 'states' and
+                        'errors' counters), their processing time ('request' timer) and latency ('latency' series),
+                        a new one by default
+        """
+        self.model = model
+        self.metrics = Metrics() if metrics is None else metrics
+        self.version = 1
+        self.server = None
+
+
+    async def handle(self, reader, writer):
+        """
+        Answer the requests of a connection until it is closed.
+        :param reader: asyncio.StreamReader
+        :param writer: asyncio.StreamWriter
+        """
+        try:
+            while True:
+                try:
+                    opcode, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    payload = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                start = time.perf_counter()
+                writer.write(await self.answer(opcode, payload))
+                await writer.drain()
+                latency = time.perf_counter() - start
+                self.metrics.add_time('request', latency)
+                self.metrics.observe('latency', latency)
+                self.metrics.count('requests')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def answer(self, opcode, payload):
+        """
+        :param opcode: opcode of the request (bytes)
+        :param payload: payload of the request (bytes)
+        :return: answer (bytes)
+        """
+        try:
+            if opcode == b'q':
+                states = np.frombuffer(payload, dtype=STATE_DTYPE)
+                # The model is read once: a reload during the request does not mix two models
+                actions, values = self.model.query(states)
+                self.metrics.count('queries')
+                self.metrics.count('states', len(states))
+                return HEADER.pack(b'q', len(states) * (1 + VALUE_DTYPE.itemsize)) + actions.tobytes() + values.astype(VALUE_DTYPE, copy=False).tobytes()
+            if opcode == b's':
+                return self.message(b's', json.dumps(self.stats()))
+            if opcode == b'r':
+                return self.message(b'r', json.dumps(await self.reload(payload.decode())))
+            raise ValueError(f'Unknown opcode {opcode!r}')
+        except (OSError, ValueError) as error:
+            self.metrics.count('errors')
+            return self.message(b'e', str(error))
+
+
+    @staticmethod
+    def message(opcode, text):
+        """
+        :param opcode: opcode of the answer (bytes)
+        :param text: payload (str)
+        :return: answer (bytes)
+        """
+        payload = text.encode()
+        return HEADER.pack(opcode, len(payload)) + payload
+
+
+    async def reload(self, path):
+        """
+        Load a new model on a worker thread, then swap it in between two requests: the requests are answered with
+        the old model until then, none of them is dropped. On failure the old model is kept, and an OSError or
+        a ValueError is raised.
+        :param path: path to the model (str)
+        :return: description of the new model (dict)
+        """
+        try:
+            model = await asyncio.get_running_loop().run_in_executor(None, load_model, path)
+        except (OSError, ValueError):
+            raise
+        except Exception as error:
+            # A truncated or corrupt file raises zipfile.BadZipFile, a file missing an array KeyError
+            raise ValueError(f'{path} is not a valid model: {type(error).__name__}: {error}') from error
+        self.model = model
+        self.version += 1
+        self.metrics.count('reloads')
+        return {**model.describe(), 'version': self.version}
+
+
+    async def watch(self, path, interval=1.0):
+        """
+        Reload the model whenever the file it was loaded from is replaced.
+        :param path: path to the model (str)
+        :param interval: time between two checks of the file, in seconds (float)
+        """
+        last = os.stat(path).st_mtime_ns
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                if mtime != last:
+                    last = mtime
+                    await self.reload(path)
+            except (OSError, ValueError):
+                self.metrics.count('errors')
+
+
+    def stats(self):
+        """
+        :return: version of the model, number of requests, queries, states and errors, throughput in states per
+                 second since the start, and the median, 99th percentile and maximum latency of the recent requests
+                 in seconds (dict)
+        """
+        snapshot = self.metrics.snapshot()
+        counters = snapshot['counters']
+        recent = snapshot['series'].get('latency', {}).get('recent', [])
+        stats = {'model': {**self.model.describe(), 'version': self.version},
+                 **{name: counters.get(name, 0) for name in ['requests', 'queries', 'states', 'errors', 'reloads']},
+                 'states_per_sec': counters.get('states', 0) / snapshot['elapsed']}
+        if recent:
+            p50, p99 = np.percentile(recent, [50, 99])
+            stats.update({'latency_p50': float(p50), 'latency_p99': float(p99), 'latency_max': max(recent)})
+        return stats
+
+
+    async def start(self, unix_path=None, host='127.0.0.1', port=8765):
+        """
+        Start listening, on a Unix socket if unix_path is given, else on TCP.
+        :param unix_path: path to the Unix socket (str)
+        :param host: TCP host (str)
+        :param port: TCP port, 0 for any free port (int)
+        :return: asyncio.Server
+        """
+        if unix_path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+
+class PolicyClient:
+    def __init__(self, unix_path=None, host='127.0.0.1', port=8765):
+        """
+        Blocking client of a PolicyServer, for the game servers.
+        :param unix_path: path to the Unix socket of the server, None to connect over TCP (str)
+        :param host: TCP host (str)
+        :param port: TCP port (int)
+        """
+        if unix_path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(unix_path)
+        else:
+            self.socket = socket.create_connection((host, port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile('rb')
+
+
+    def request(self, opcode, payload):
+        """
+        :param opcode: opcode of the request (bytes)
+        :param payload: payload of the request (bytes)
+        :return: opcode and payload of the answer (bytes, bytes)
+        """
+        self.socket.sendall(HEADER.pack(opcode, len(payload)) + payload)
+        opcode, length = HEADER.unpack(self.read(HEADER.size))
+        payload = self.read(length)
+        if opcode == b'e':
+            raise ValueError(payload.decode())
+        return opcode, payload
+
+
+    def read(self, size):
+        """
+        :param size: number of bytes to read (int)
+        :return: the next size bytes of the answers (bytes)
+        """
+        data = self.file.read(size)
+        if len(data) < size:
+            raise ConnectionError(f'The server closed the connection, {len(data)} of {size} bytes received')
+        return data
+
+
+    def query(self, states):
+        """
+        :param states: states (iterable of int)
+        :return: action id and value of each state (np.ndarray of int8, np.ndarray of float64)
+        """
+        _, payload = self.request(b'q', np.asarray(states, dtype=STATE_DTYPE).tobytes())
+        n = len(payload) // (1 + VALUE_DTYPE.itemsize)
+        return np.frombuffer(payload[:n], dtype=np.int8), np.frombuffer(payload[n:], dtype=VALUE_DTYPE)
+
+
+    def stats(self):
+        """
+        :return: statistics of the server, see PolicyServer.stats (dict)
+        """
+        return json.loads(self.request(b's', b'')[1])
+
+
+    def reload(self, path):
+        """
+        :param path: path to the new model, as seen by the server (str)
+        :return: description of the new model (dict)
+        """
+        return json.loads(self.request(b'r', path.encode())[1])
+
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        self.file.close()
+        self.socket.close()
+
+
+async def serve(model_path, unix_path=None, host='127.0.0.1', port=8765, watch=None):
+    """
+    Run a server until it is cancelled.
+    :param model_path: path to the model (str)
+    :param unix_path: path to the Unix socket, None to listen on TCP (str)
+    :param host: TCP host (str)
+    :param port: TCP port (int)
+    :param watch: reload the model when its file changes, checking every watch seconds, None not to (float)
+    """
+    server = PolicyServer(load_model(model_path))
+    async with await server.start(unix_path, host, port) as listener:
+        watcher = asyncio.create_task(server.watch(model_path, watch)) if watch is not None else None
+        print(f'Serving {model_path} on {unix_path or f"{host}:{port}"}')
+        try:
+            await listener.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+                try:
+                    await watcher
+                except asyncio.CancelledError:
+                    pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the actions and values of a solved model.')
+    parser.add_argument('model', help='model written by save_model, or value_iteration entry of a SolutionCache')
+    parser.add_argument('--unix', help='path to a Unix socket to listen on instead of TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--watch', type=float, help='reload the model when its file changes, checking every WATCH seconds')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.model, args.unix, args.host, args.port, args.watch))
+    except KeyboardInterrupt:
+        pass
@@ -1,23 +1,275 @@
-from game_env import GameEnv
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from types import MappingProxyType
+import functools
+import os
 import random
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from binary_map import is_binary_map, read_map
+from checkpoint import check_run, random_digest, random_state, set_random_state
+from game_env import ACTION_IDS, ACTIONS, GameEnv, VectorGameEnv
+from metrics import Metrics
+from random_stream import RandomStream, as_random
+from tracing import close_trace, grid_rows, open_trace
+
+
+# Initial Q-values of QLearning, and distribution of the start state of its episodes
+INITS = ['zeros', 'distance']
+STARTS = ['corner', 'uniform', 'visits']
+
+
+class ActionTableView(Mapping):
+    """
+    Read-only view of an array of shape (num_reachable, 4) as a dict of dicts: view[state][action],
+    where action is one of ACTIONS. index gives the row of each state, the states without a row (-1) read as zeros.
+    """
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, state):
+        if not 0 <= state < len(self.index):
+            raise KeyError(state)
+        row = self.index[state]
+        if row < 0:
+            return MappingProxyType(dict.fromkeys(ACTIONS, self.table.dtype.type(0).item()))
+        return MappingProxyType(dict(zip(ACTIONS, self.table[row].tolist())))
+
+    def __iter__(self):
+        return iter(range(len(self.index)))
+
+    def __len__(self):
+        return len(self.index)
+
+
+class PolicyView(Mapping):
+    """
+    Read-only view of an array of action ids as a dict: view[state] is one of ACTIONS,
+    or '' if no action has been chosen yet for this state (id -1). index gives the position of each state in the
+    array, the states without a position (-1) have no action.
+    """
+    def __init__(self, action_ids, index):
+        self.action_ids = action_ids
+        self.index = index
+
+    def __getitem__(self, state):
+        if not 0 <= state < len(self.index):
+            raise KeyError(state)
+        row = self.index[state]
+        action_id = self.action_ids[row] if row >= 0 else -1
+        return ACTIONS[action_id] if action_id >= 0 else ''
+
+    def __iter__(self):
+        return iter(range(len(self.index)))
+
+    def __len__(self):
+        return len(self.index)
+
+
+class LinearView(Mapping):
+    """
+    Read-only view of the Q-values (greedy=False) or of the greedy policy (greedy=True) of a LinearQLearning agent
+    as a dict, computed from its weights when read. Walls have Q-values of zero and no action ('').
+    """
+    def __init__(self, agent, greedy):
+        self.agent = agent
+        self.greedy = greedy
+
+    def __getitem__(self, state):
+        if not 0 <= state < self.agent.game_env.num_states:
+            raise KeyError(state)
+        wall = self.agent.game_env.cells[state] == 3
+        if self.greedy:
+            return '' if wall else ACTIONS[int(self.agent.q_array(state).argmax())]
+        return MappingProxyType(dict(zip(ACTIONS, [0.0] * len(ACTIONS) if wall else self.agent.q_array(state).tolist())))
+
+    def __iter__(self):
+        return iter(range(self.agent.game_env.num_states))
+
+    def __len__(self):
+        return self.agent.game_env.num_states
+
+
+class ReplayBuffer:
+    def __init__(self, capacity, state_dtype=np.int64):
+        """
+        Ring buffer of transitions (state, action id, reward, next state) held in preallocated arrays:
+        once it is full, each new transition overwrites the oldest one.
+        :param capacity: maximum number of transitions (int)
+        :param state_dtype: type of the states (np.dtype)
+        """
+        if capacity < 1:
+            raise ValueError(f'capacity should be at least 1, got {capacity}')
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=state_dtype)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(capacity, dtype=state_dtype)
+        # Number of transitions held, and position of the next one to be written
+        self.size = 0
+        self.position = 0
+
+
+    def __len__(self):
+        return self.size
+
+
+    def add(self, state, action, reward, next_state):
+        """
+        Store a transition.
+        :param state: previous state (int)
+        :param action: id of the action taken (int)
+        :param reward: reward received (float)
+        :param next_state: next state (int)
+        """
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+
+    def add_batch(self, states, actions, rewards, next_states):
+        """
+        Store several transitions at once, e.g. one per game of a VectorGameEnv.
+        :param states: previous states (np.ndarray)
+        :param actions: ids of the actions taken (np.ndarray)
+        :param rewards: rewards received (np.ndarray)
+        :param next_states: next states (np.ndarray)
+        """
+        # Only the last capacity transitions would be kept anyway
+        n = min(len(states), self.capacity)
+        positions = (self.position + np.arange(n)) % self.capacity
+        self.states[positions] = states[-n:]
+        self.actions[positions] = actions[-n:]
+        self.rewards[positions] = rewards[-n:]
+        self.next_states[positions] = next_states[-n:]
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+
+    def sample(self, n, rng):
+        """
+        Draw transitions uniformly, with replacement.
+        :param n: number of transitions (int)
+        :param rng: random generator (np.random.Generator)
+        :return: states, action ids, rewards and next states of the transitions (np.ndarray of shape (n,) each)
+        """
+        if self.size == 0:
+            raise ValueError('Cannot sample from an empty replay buffer')
+        i = rng.integers(self.size, size=n)
+        return self.states[i], self.actions[i], self.rewards[i], self.next_states[i]
 
 
 class QLearning():
-    def __init__(self, path_to_settings, epsilon=1, eps_decay=0.99):
-        self.game_env, self.gamma, self.start_alpha, self.nb_episodes = self.parse_settings_file(path_to_settings)
+    # File the traces are appended to
+    log_file = 'log-file_QL.txt'
+
+    def __init__(self, path_to_settings, epsilon=1, eps_decay=0.99, rng=None, init='zeros', starts='corner'):
+        """
+        :param path_to_settings: path to the settings file (str)
+        :param epsilon: initial exploration rate (float)
+        :param eps_decay: decay of epsilon at each step (float)
+        :param rng: random numbers of the exploration and of the moves: None for the random module (seeded with
+                    random.seed), a seed or a RandomStream for a run that only depends on it (see random_stream.py)
+        :param init: 'zeros' to start from Q-values of 0, 'distance' to start from the Q-values of the values estimated
+                     from the distances to the rewards and the ghosts (see GameEnv.heuristic_values, needs gamma below 1)
+        :param starts: state the episodes start from: 'corner' for the bottom left corner, 'uniform' for a state drawn
+                       uniformly among the reachable empty cells with a path to a reward, 'visits' for one of them drawn
+                       with a probability inversely proportional to its number of visits plus one (exploring starts)
+        """
+        game_env, gamma, start_alpha, nb_episodes = self.parse_settings_file(path_to_settings)
+        self.setup(game_env, gamma, start_alpha, nb_episodes, epsilon, eps_decay, rng, init, starts)
+
+
+    @classmethod
+    def from_game_env(cls, game_env, gamma, start_alpha, nb_episodes, **kwargs):
+        """
+        Create an agent for an existing GameEnv object instead of reading a settings file.
+        :param game_env: GameEnv object
+        :param gamma: discount factor (float)
+        :param start_alpha: initial learning rate (float)
+        :param nb_episodes: number of training episodes (int)
+        :param kwargs: other arguments of the constructor
+        :return: agent
+        """
+        agent = cls.__new__(cls)
+        agent.setup(game_env, gamma, start_alpha, nb_episodes, **kwargs)
+        return agent
+
+
+    def setup(self, game_env, gamma, start_alpha, nb_episodes, epsilon=1, eps_decay=0.99, rng=None, init='zeros',
+              starts='corner'):
+        """
+        Initialize the agent, see the constructor for the parameters.
+        """
+        if init not in INITS:
+            raise ValueError(f"Unknown init '{init}', expected one of {INITS}")
+        if starts not in STARTS:
+            raise ValueError(f"Unknown starts '{starts}', expected one of {STARTS}")
+        self.game_env, self.gamma, self.start_alpha, self.nb_episodes = game_env, gamma, start_alpha, nb_episodes
+        self.init, self.starts = init, starts
+        self.rng = as_random(rng)
         self.epsilon = epsilon
         self.eps_decay = eps_decay
-        self.q_values = {state: {'up': 0, 'down': 0, 'left': 0, 'right': 0} for state in range(self.game_env.num_cols * self.game_env.num_rows)}
-        self.policy = {state: '' for state in range(self.game_env.num_cols * self.game_env.num_rows)}
-        self.freq = {state: {'up': 0, 'down': 0, 'left': 0, 'right': 0} for state in range(self.game_env.num_cols * self.game_env.num_rows)}
+        # Only the states that can be reached from the start state have a row in the tables,
+        # index gives the row of each state, -1 for the others (see GameEnv.compact_index)
+        states, self.index = self.game_env.compact_index()
+        self.setup_tables(states)
+        # States the episodes can start from besides the corner: the reachable empty cells with a path to a reward.
+        # From the others, the best policy can be to avoid the ghosts forever, and the episode would never end.
+        if starts == 'corner':
+            self.start_states = states[:0]
+        else:
+            reward_distances = self.game_env.distance_fields()[0]
+            self.start_states = states[(np.frombuffer(self.game_env.cells, dtype=np.uint8)[states] == 0)
+                                       & np.isfinite(reward_distances[states])]
+        # Metrics updated by the trainings, see instrument
+        self.metrics = None
+        # Statistics of the last training
+        self.stats = {}
+
+
+    def setup_tables(self, states):
+        """
+        Create the tables the Q-values are learned in.
+        :param states: reachable states, one row of the tables each (np.ndarray)
+        """
+        # Q-values and number of visits of each state-action pair, the columns follow the order of ACTIONS
+        self.q_table = np.zeros((len(states), len(ACTIONS)))
+        self.visits = np.zeros((len(states), len(ACTIONS)), dtype=np.int32)
+        # Id of the greedy action of each state, -1 until the state has been reached
+        self.policy_ids = np.full(len(states), -1, dtype=np.int8)
+        self.q_values = ActionTableView(self.q_table, self.index)
+        self.freq = ActionTableView(self.visits, self.index)
+        self.policy = PolicyView(self.policy_ids, self.index)
+        if self.init == 'distance':
+            self.q_table[:] = self.heuristic_q_values()
+            self.policy_ids[:] = self.q_table.argmax(axis=1)
 
 
     def parse_settings_file(self, path_to_settings):
         """
         Parses the settings file and create a GameEnv object.
+        The settings file can also be a binary map (see binary_map.py), whose grid is memory-mapped.
         :param path_to_settings: path to the settings file (str)
         :return: GameEnv object, gamma, alpha, nb_episodes
         """
+        if is_binary_map(path_to_settings):
+            grid, parameters = read_map(path_to_settings)
+            missing = {'gamma', 'alpha', 'nb_episodes'} - set(parameters)
+            if missing:
+                raise ValueError(f'{path_to_settings} is not a map of q_learning, it has no {sorted(missing)}')
+            env = GameEnv(grid)
+            return env, parameters['gamma'], parameters['alpha'], parameters['nb_episodes']
+
         with open(path_to_settings, 'r') as f:
             settings = f.readlines()
         settings = [x.strip() for x in settings]
@@ -30,39 +282,73 @@ class QLearning():
         return env, gamma, alpha, nb_episodes
 
 
+    def instrument(self, metrics, hot_paths=False):
+        """
+        Update a Metrics object during the next trainings: the number of episodes and of steps, the time of each episode
+        ('episode' timer) and the length and the return of each episode ('episode_length' and 'episode_return' series).
+        :param metrics: Metrics object, None to stop updating it
+        :param hot_paths: also time every call to the methods run at each step, slows down the training (bool)
+        """
+        Metrics.restore(self.game_env, 'sample_next_state')
+        Metrics.restore(self, 'update_q_values', 'update_policy')
+        if metrics is not None and hot_paths:
+            metrics.instrument(self.game_env, 'sample_next_state')
+            metrics.instrument(self, 'update_q_values', 'update_policy', prefix='QLearning')
+        self.metrics = metrics
+
+
+    def record_episode(self, start, steps, episode_return):
+        """
+        Add an episode to the metrics.
+        :param start: time at which the episode started, from time.perf_counter (float)
+        :param steps: number of steps of the episode (int)
+        :param episode_return: return of the episode (float)
+        """
+        self.metrics.add_time('episode', time.perf_counter() - start)
+        self.metrics.count('episodes')
+        self.metrics.count('steps', steps)
+        self.metrics.observe('episode_length', steps)
+        self.metrics.observe('episode_return', episode_return)
+
+
     def get_next_action(self, state):
         """
         Get the next action to take and update the epsilon value.
         :param state: current state (int)
-        :return: next action (str)
+        :return: id of the next action in ACTIONS (int)
         """
         self.epsilon = self.epsilon * self.eps_decay
-        if random.uniform(0, 1) < self.epsilon or self.policy[state] == '':
-            return random.choice(['up', 'down', 'left', 'right'])
+        action_id = self.policy_ids.item(self.index.item(state))
+        if self.rng.random() < self.epsilon or action_id < 0:
+            return self.rng.randrange(len(ACTIONS))
         else:
-            return self.policy[state]
+            return action_id
 
 
     def get_alpha(self, state, action):
         """
         Get the alpha value for the given state-action pair.
         :param state: current state (int)
-        :param action: action taken (str)
+        :param action: action taken (str or id in ACTIONS)
         :return: alpha value (float)
         """
-        return self.start_alpha / self.freq[state][action]
+        return self.start_alpha / self.visits.item(self.index.item(state), ACTION_IDS.get(action, action))
 
 
     def update_q_values(self, prev_state, action, reward, curr_state):
         """
         Update the Q-values.
         :param prev_state: previous state (int)
-        :param action: action taken (str)
+        :param action: action taken (str or id in ACTIONS)
         :param reward: reward received (int)
         :param curr_state: current state (int)
         """
-        self.freq[prev_state][action] += 1
-        self.q_values[prev_state][action] = self.q_values[prev_state][action] + self.get_alpha(prev_state, action) * (reward + self.gamma * max(self.q_values[curr_state].values()) - self.q_values[prev_state][action])
+        action = ACTION_IDS.get(action, action)
+        prev_row = self.index.item(prev_state)
+        self.visits[prev_row, action] += 1
+        q_value = self.q_table.item(prev_row, action)
+        max_q = np.maximum.reduce(self.q_table[self.index.item(curr_state)])
+        self.q_table[prev_row, action] = q_value + self.get_alpha(prev_state, action) * (reward + self.gamma * max_q - q_value)
 
 
     def update_policy(self, state):
@@ -70,84 +356,222 @@ class QLearning():
         Update the policy.
         :param state: current state (int)
         """
-        self.policy[state] = max(self.q_values[state], key=lambda x: self.q_values[state][x])
+        row = self.index.item(state)
+        self.policy_ids[row] = self.q_table[row].argmax()
 
 
-    def train(self, trace=False, verbose=False):
+    def q_value(self, state, action):
+        """
+        :param state: state (int)
+        :param action: id of the action in ACTIONS (int)
+        :return: Q-value of the state-action pair (float)
+        """
+        return self.q_table.item(self.index.item(state), action)
+
+
+    def heuristic_q_values(self):
+        """
+        :return: Q-values of the values estimated from the distance fields (see GameEnv.heuristic_values), one step
+                 ahead, for the reachable states (np.ndarray of shape (num_reachable, 4))
+        """
+        states, _ = self.game_env.compact_index()
+        transitions, rewards = self.game_env.compact_model()
+        values = self.game_env.heuristic_values(self.gamma)[states]
+        q = (transitions @ (rewards + self.gamma * values)).reshape(-1, len(ACTIONS))
+        # The start state can be a wall: no move leads to it, its reward is undefined
+        return np.nan_to_num(q, nan=0.0)
+
+
+    def start_state(self):
+        """
+        Draw the state the next episode starts from, see the starts parameter of the constructor.
+        :return: state (int)
+        """
+        if self.starts == 'corner' or len(self.start_states) == 0:
+            return (self.game_env.num_rows - 1) * self.game_env.num_cols
+        if self.starts == 'uniform':
+            return self.start_states.item(int(self.rng.random() * len(self.start_states)))
+        weights = np.cumsum(1 / (1 + self.visits[self.index[self.start_states]].sum(axis=1)))
+        i = int(np.searchsorted(weights, self.rng.random() * weights[-1], side='right'))
+        return self.start_states.item(min(i, len(self.start_states) - 1))
+
+
+    def cache_parameters(self):
+        """
+        :return: parameters the Q-values depend on, see SolutionCache (dict)
+        """
+        return {'gamma': self.gamma, 'start_alpha': self.start_alpha, 'nb_episodes': self.nb_episodes,
+                'epsilon': self.epsilon, 'eps_decay': self.eps_decay, 'init': self.init, 'starts': self.starts}
+
+
+    def random_parameters(self):
+        """
+        :return: state of the random numbers at the start of a training, which the Q-values also depend on: added to
+                 the parameters of the cache key, so that a training is only loaded from the cache when it would have
+                 drawn the same random numbers (dict)
+        """
+        return {'rng': random_digest(self.rng)}
+
+
+    def load_tables(self, arrays):
+        """
+        Load the Q-values, the visits and the policy of the reachable states from arrays indexed by state.
+        :param arrays: 'q_table', 'visits' and 'policy_ids' of every state (dict of np.ndarray)
+        """
+        states, _ = self.game_env.compact_index()
+        self.q_table[:] = arrays['q_table'][states]
+        self.visits[:] = arrays['visits'][states]
+        self.policy_ids[:] = arrays['policy_ids'][states]
+
+
+    def set_tables(self, q_table, visits, policy_ids):
+        """
+        Use other arrays as the tables of the agent, e.g. arrays in shared memory updated by several agents.
+        :param q_table: Q-values of the reachable states (np.ndarray of shape (num_reachable, 4))
+        :param visits: visits of the reachable states (np.ndarray of shape (num_reachable, 4))
+        :param policy_ids: greedy action ids of the reachable states (np.ndarray of shape (num_reachable,))
+        """
+        self.q_table, self.visits, self.policy_ids = q_table, visits, policy_ids
+        self.q_values = ActionTableView(self.q_table, self.index)
+        self.freq = ActionTableView(self.visits, self.index)
+        self.policy = PolicyView(self.policy_ids, self.index)
+
+
+    def checkpoint_state(self, episode, total_steps):
+        """
+        Copy the state of a training, see Checkpointer.
+        :param episode: number of episodes done (int)
+        :param total_steps: number of steps done (int)
+        :return: arrays and other state of the training (dict of np.ndarray, dict)
+        """
+        rng, buffered = random_state(self.rng)
+        arrays = {'q_table': self.q_table.copy(), 'visits': self.visits.copy(), 'policy_ids': self.policy_ids.copy(),
+                  'rng_buffered': buffered}
+        return arrays, {'episode': episode, 'steps': total_steps, 'epsilon': self.epsilon, 'rng': rng}
+
+
+    def restore_checkpoint(self, arrays, state):
+        """
+        Restore the state of a training copied by checkpoint_state.
+        :param arrays: arrays of the training (dict of np.ndarray)
+        :param state: other state of the training (dict)
+        """
+        self.q_table[:] = arrays['q_table']
+        self.visits[:] = arrays['visits']
+        self.policy_ids[:] = arrays['policy_ids']
+        self.epsilon = state['epsilon']
+        set_random_state(self.rng, state['rng'], arrays['rng_buffered'])
+
+
+    def train(self, trace=False, verbose=False, callback=None, cache=None, checkpoint=None, resume=False):
         """
         Train the agent.
-        :param trace: write the Q-values, the policy and their computation to the file 'log-file_QL.txt' (bool)
+        :param trace: write the Q-values, the policy and their computation to the file 'log-file_QL.txt' (bool).
+                      'full' is the same as True, 'summary' only writes the length and the return of each episode.
+                      The records of the trace are written to 'log-file_QL.jsonl' and rendered at the end of the training.
+                      A TraceWriter object can also be given, its records are then left to the caller to render.
         :param verbose: print the Q-values to the console at each episode (bool)
+        :param callback: function called with the number of the episode (starting at 1) at the end of each episode (callable)
+        :param cache: (SolutionCache) if set, load the Q-values from the cache when an agent with the same hyperparameters
+                      and the same state of its random numbers has already been trained on this map, else start from the Q-values of the closest cached agent and
+                      store the new ones. self.stats['cache'] tells whether it was a 'hit', a 'warm' start or a 'miss'.
+        :param checkpoint: (Checkpointer) if set, write the state of the training to it periodically and at the end
+        :param resume: (bool) if True, continue the training from the last checkpoint, with the same random numbers as
+                       if it had not been interrupted. The checkpoint must come from the same map and hyperparameters.
         """
-        for episode in range(self.nb_episodes):
-            self.game_env.reset()
+        writer, owned = open_trace(trace, self.log_file)
+        full = writer is not None and writer.full
+        run = {'solver': type(self).__name__, 'model': self.game_env.model_hash() if checkpoint is not None else None,
+               'parameters': self.cache_parameters()}
+        if writer is not None:
+            writer.write({'type': 'start', 'solver': 'q_learning', 'grid': grid_rows(self.game_env),
+                          'gamma': self.gamma, 'start_alpha': self.start_alpha})
+        warm = None
+        if cache is not None:
+            parameters = {**self.cache_parameters(), **self.random_parameters()}
+            key = cache.key('q_learning', self.game_env.model_hash(), parameters)
+            hit = cache.get(key)
+            if hit is not None:
+                arrays, entry = hit
+                self.load_tables(arrays)
+                self.epsilon = entry['stats']['epsilon']
+                self.stats = {**entry['stats'], 'cache': 'hit'}
+                if writer is not None:
+                    writer.write({'type': 'cached', **self.stats})
+                    writer.write({'type': 'policy', 'solver': 'q_learning', 'grid': grid_rows(self.game_env), 'policy': list(self.policy.values())})
+                close_trace(writer, owned, self.log_file)
+                return
+            warm = cache.closest('q_learning', self.game_env, parameters)
+            if warm is not None:
+                self.load_tables(warm[0])
+        total_steps = 0
+        first_episode = 0
+        if resume and checkpoint is not None:
+            loaded = checkpoint.load()
+            if loaded is not None:
+                arrays, state = loaded
+                check_run(state, run['solver'], self.game_env, run['parameters'])
+                self.restore_checkpoint(arrays, state)
+                first_episode, total_steps = state['episode'], state['steps']
+        for episode in range(first_episode, self.nb_episodes):
+            self.game_env.reset(self.start_state())
             curr_state = self.game_env.state
             terminal = False
-            if trace:
-                f = open('log-file_QL.txt', 'a', encoding='utf-8')
-                f.write('=' * 100 + '\n')
-                f.write('=' * 100 + '\n\n')
-                f.write(f'Episode: {episode + 1}\n\n')
-                f.write('=' * 100 + '\n')
-                f.write('=' * 100 + '\n\n')
+            steps = 0
+            episode_return = 0
+            if full:
+                writer.write({'type': 'episode', 'episode': episode + 1})
+            if self.metrics is not None:
+                start = time.perf_counter()
             while not terminal:
                 terminal = self.game_env.is_terminal(curr_state)
                 if episode == 0:
-                    action = random.choice(['up', 'down', 'left', 'right'])
+                    action = self.rng.randrange(len(ACTIONS))
                 else:
                     action = self.get_next_action(curr_state)
                 prev_state = curr_state
-                possible_next_states = self.game_env.get_possible_next_states(curr_state, action)
-                curr_state = self.game_env.draw_next_state(prev_state, possible_next_states)
+                curr_state = self.game_env.sample_next_state(prev_state, action, self.rng)
                 reward = self.game_env.get_reward(curr_state)
                 self.update_q_values(prev_state, action, reward, curr_state)
                 if verbose:
-                    self.print_q_values(episode + 1, prev_state, action, reward, curr_state)
+                    self.print_q_values(episode + 1, prev_state, ACTIONS[action], reward, curr_state)
                 self.update_policy(curr_state)
+                steps += 1
+                episode_return += reward
+
+                if full:
+                    writer.write({'type': 'step', 'episode': episode + 1, 'state': prev_state, 'action': action,
+                                  'reward': reward, 'next': curr_state, 'q': self.q_value(prev_state, action)})
 
-                if trace:
-                    f.write('=' * 100 + '\n\n')
-                    f.write(f'Episode: {episode + 1}, State: {prev_state}, Action: {action}, Reward: {reward}, Next state: {curr_state}, N[{prev_state}][{action}] = {self.freq[prev_state][action]}\n\n')
-                    f.write(f'Q[{prev_state}][{action}] = Q[{prev_state}][{action}] + ({self.start_alpha} / N[{prev_state}][{action}]) * ({reward} + {self.gamma} * max({list(self.q_values[curr_state].values())}) - Q[{prev_state}][{action}])\n\n')
-                    f.write('Updated Q-values:\n\n')
-                    for i in range(self.game_env.num_rows):
-                        for actions in [[('up', '↑'), ('down', '↓')], [('left', '←'), ('right', '→')]]:
-                            for j in range(self.game_env.num_cols):
-                                if self.game_env.grid[i][j] == 3:
-                                    f.write('#'*17 + ' ')
-                                    if j < self.game_env.num_cols - 1:
-                                        f.write('| ')
-                                else:
-                                    for action in actions:
-                                        f.write(f'{action[1]}:{self.q_values[self.game_env.position_to_state((i, j))][action[0]]:^6.2f} ')
-                                    if j < self.game_env.num_cols - 1:
-                                        f.write('| ')
-                            f.write('\n')
-                        if i < self.game_env.num_rows - 1:
-                            f.write('-' * 19 * self.game_env.num_cols + '\n')
-                    f.write('\n')
-                
+            if writer is not None:
+                writer.write({'type': 'episode_end', 'episode': episode + 1, 'steps': steps, 'return': episode_return})
+            if self.metrics is not None:
+                self.record_episode(start, steps, episode_return)
+            total_steps += steps
+            if callback is not None:
+                callback(episode + 1)
+            if checkpoint is not None and (checkpoint.due(episode + 1) or episode + 1 == self.nb_episodes):
+                arrays, state = self.checkpoint_state(episode + 1, total_steps)
+                checkpoint.save(arrays, {**run, **state})
+
+        if checkpoint is not None:
+            checkpoint.wait()
+        self.stats = {'episodes': self.nb_episodes, 'steps': total_steps, 'epsilon': self.epsilon}
+        if cache is not None:
+            states, _ = self.game_env.compact_index()
+            arrays = {'q_table': np.zeros((self.game_env.num_states, len(ACTIONS))),
+                      'visits': np.zeros((self.game_env.num_states, len(ACTIONS)), dtype=self.visits.dtype),
+                      'policy_ids': np.full(self.game_env.num_states, -1, dtype=self.policy_ids.dtype)}
+            arrays['q_table'][states] = self.q_table
+            arrays['visits'][states] = self.visits
+            arrays['policy_ids'][states] = self.policy_ids
+            cache.put(key, arrays, 'q_learning', self.game_env, parameters, self.stats)
+            self.stats['cache'] = 'miss' if warm is None else 'warm'
         if verbose:
             self.print_policy()
-        if trace:
-            f.write('=' * 100 + '\n\n')
-            f.write('Optimal policy\n\n')
-            for i in range(self.game_env.num_rows):
-                for j in range(self.game_env.num_cols):
-                    if self.game_env.grid[i][j] == 3:
-                        f.write('# ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'up':
-                        f.write('↑ ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'down':
-                        f.write('↓ ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'left':
-                        f.write('← ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'right':
-                        f.write('→ ')
-                    else:
-                        raise ValueError('Invalid action')
-                f.write('\n')
-            f.close()
+        if writer is not None:
+            writer.write({'type': 'policy', 'solver': 'q_learning', 'grid': grid_rows(self.game_env), 'policy': list(self.policy.values())})
+        close_trace(writer, owned, self.log_file)
 
 
     def print_policy(self):
@@ -168,6 +592,9 @@ class QLearning():
                         print('←', end=' ')
                     elif self.policy[self.game_env.position_to_state((i, j))] == 'right':
                         print('→', end=' ')
+                    elif self.policy[self.game_env.position_to_state((i, j))] == '':
+                        # Unreachable or unvisited state
+                        print(' ', end=' ')
                     else:
                         raise ValueError('Invalid action')
                 print()
@@ -198,6 +625,600 @@ class QLearning():
                 print('-' * 19 * self.game_env.num_cols)
 
 
+class BatchedQLearning(QLearning):
+    def __init__(self, path_to_settings, num_envs=64, epsilon=1, eps_decay=0.99, seed=None):
+        """
+        Q-learning agent collecting its experience from num_envs games stepped together by a VectorGameEnv.
+        :param path_to_settings: path to the settings file (str)
+        :param num_envs: number of games played at the same time (int)
+        :param epsilon: initial exploration rate (float)
+        :param eps_decay: decay of epsilon at each step of each game (float)
+        :param seed: seed of the random generator of the games and of the exploration (int or None)
+        """
+        game_env, gamma, start_alpha, nb_episodes = self.parse_settings_file(path_to_settings)
+        self.setup(game_env, gamma, start_alpha, nb_episodes, num_envs, epsilon, eps_decay, seed)
+
+
+    def setup(self, game_env, gamma, start_alpha, nb_episodes, num_envs=64, epsilon=1, eps_decay=0.99, seed=None):
+        """
+        Initialize the agent, see the constructor for the parameters.
+        """
+        super().setup(game_env, gamma, start_alpha, nb_episodes, epsilon, eps_decay)
+        self.vector_env = VectorGameEnv(self.game_env, num_envs, seed)
+        self.rng = self.vector_env.rng
+
+
+    def instrument(self, metrics, hot_paths=False):
+        """
+        Update a Metrics object during the next trainings: the number of episodes and of steps and the time of each
+        batch of steps ('batch' timer).
+        :param metrics: Metrics object, None to stop updating it
+        :param hot_paths: also time every call to the methods run at each batch (bool)
+        """
+        Metrics.restore(self.vector_env, 'step')
+        Metrics.restore(self, 'get_next_actions', 'update_batch')
+        if metrics is not None and hot_paths:
+            metrics.instrument(self.vector_env, 'step')
+            metrics.instrument(self, 'get_next_actions', 'update_batch', prefix='BatchedQLearning')
+        self.metrics = metrics
+
+
+    def get_next_actions(self, states):
+        """
+        Get the next action to take in every game and update the epsilon value.
+        :param states: current states (np.ndarray of shape (num_envs,))
+        :return: ids of the next actions in ACTIONS (np.ndarray of shape (num_envs,))
+        """
+        self.epsilon = self.epsilon * self.eps_decay ** len(states)
+        greedy = self.policy_ids[self.index[states]]
+        explore = (self.rng.random(len(states)) < self.epsilon) | (greedy < 0)
+        return np.where(explore, self.rng.integers(len(ACTIONS), size=len(states)), greedy)
+
+
+    def update_batch(self, prev_states, actions, rewards, curr_states):
+        """
+        Update the Q-values and the policy with one transition of every game.
+        The transitions of a batch sharing the same state-action pair are merged:
+        their mean target is applied once, with the step size of as many consecutive visits.
+        :param prev_states: previous states (np.ndarray of shape (num_envs,))
+        :param actions: ids of the actions taken (np.ndarray of shape (num_envs,))
+        :param rewards: rewards received (np.ndarray of shape (num_envs,))
+        :param curr_states: current states (np.ndarray of shape (num_envs,))
+        """
+        targets = rewards + self.gamma * self.q_table[self.index[curr_states]].max(axis=1)
+        pairs, inverse, counts = np.unique(self.index[prev_states] * len(ACTIONS) + actions, return_inverse=True, return_counts=True)
+        rows, actions = np.divmod(pairs, len(ACTIONS))
+        mean_targets = np.bincount(inverse, weights=targets) / counts
+        self.visits[rows, actions] += counts.astype(self.visits.dtype)
+        alphas = np.minimum(1, self.start_alpha * counts / self.visits[rows, actions])
+        self.q_table[rows, actions] += alphas * (mean_targets - self.q_table[rows, actions])
+        self.policy_ids[rows] = self.q_table[rows].argmax(axis=1)
+
+
+    def train(self, trace=False, verbose=False):
+        """
+        Train the agent until nb_episodes episodes have been completed over all the games.
+        :param trace: not supported, the transitions of a batch have no meaningful order (bool)
+        :param verbose: print the policy to the console at the end of the training (bool)
+        """
+        if trace:
+            raise ValueError('BatchedQLearning cannot be traced, use QLearning instead')
+        states = self.vector_env.reset()
+        episodes = 0
+        steps = 0
+        while episodes < self.nb_episodes:
+            if self.metrics is not None:
+                start = time.perf_counter()
+            actions = self.get_next_actions(states)
+            next_states, rewards, done = self.vector_env.step(actions)
+            self.update_batch(states, actions, rewards, next_states)
+            states = self.vector_env.states
+            episodes += int(np.count_nonzero(done))
+            steps += len(states)
+            if self.metrics is not None:
+                # The games are stepped together, only the time of each batch is known
+                self.metrics.add_time('batch', time.perf_counter() - start)
+                self.metrics.count('episodes', int(np.count_nonzero(done)))
+                self.metrics.count('steps', len(states))
+        self.stats = {'episodes': episodes, 'steps': steps}
+        if verbose:
+            self.print_policy()
+
+
+def hogwild_worker(grid, tables, gamma, start_alpha, nb_episodes, epsilon, eps_decay, seed):
+    """
+    Train a QLearning agent on tables in shared memory, updated by the other workers at the same time. Runs in a
+    worker process of ParallelQLearning.
+    :param grid: grid of the map (list of lists of int or np.ndarray)
+    :param tables: shared memory name, shape and dtype of 'q_table', 'visits' and 'policy_ids' (dict)
+    :param gamma: discount factor (float)
+    :param start_alpha: initial learning rate (float)
+    :param nb_episodes: number of episodes of the worker (int)
+    :param epsilon: initial exploration rate of the worker (float)
+    :param eps_decay: decay of epsilon at each step of the worker (float)
+    :param seed: seed of the random numbers of the worker (np.random.SeedSequence)
+    :return: number of episodes and steps, training time in seconds and final epsilon of the worker (dict)
+    """
+    blocks = {name: SharedMemory(name=block_name) for name, (block_name, _, _) in tables.items()}
+    try:
+        agent = QLearning.from_game_env(GameEnv(grid), gamma, start_alpha, nb_episodes, epsilon=epsilon,
+                                        eps_decay=eps_decay, rng=RandomStream(seed))
+        agent.set_tables(*[np.ndarray(shape, dtype, buffer=blocks[name].buf)
+                           for name, (_, shape, dtype) in tables.items()])
+        start = time.perf_counter()
+        agent.train()
+        stats = {**agent.stats, 'time': time.perf_counter() - start}
+        # The tables are views on the shared memory, which cannot be closed while they exist
+        del agent
+    finally:
+        for block in blocks.values():
+            block.close()
+    return stats
+
+
+class ParallelQLearning(QLearning):
+    def __init__(self, path_to_settings, workers=None, epsilon=1, eps_decay=0.99, seed=None):
+        """
+        Q-learning agent trained by several worker processes at the same time (Hogwild): each worker plays its own
+        episodes with its own random numbers and exploration rate, and updates the Q-values, the visits and the
+        policy in shared memory without any lock. Concurrent updates of the same state-action pair can overwrite
+        each other, which is rare on large maps and only loses a few updates, so the training is not reproducible
+        with more than one worker.
+        :param path_to_settings: path to the settings file (str)
+        :param workers: number of worker processes, the number of cores by default (int)
+        :param epsilon: initial exploration rate, the same for all the workers or one per worker (float or list of float)
+        :param eps_decay: decay of epsilon at each step of a worker, the same for all the workers or one per worker
+                          (float or list of float)
+        :param seed: seed the random numbers of the workers are drawn from (int or None)
+        """
+        game_env, gamma, start_alpha, nb_episodes = self.parse_settings_file(path_to_settings)
+        self.setup(game_env, gamma, start_alpha, nb_episodes, workers, epsilon, eps_decay, seed)
+
+
+    def setup(self, game_env, gamma, start_alpha, nb_episodes, workers=None, epsilon=1, eps_decay=0.99, seed=None):
+        """
+        Initialize the agent, see the constructor for the parameters.
+        """
+        workers = (os.cpu_count() or 1) if workers is None else workers
+        if workers < 1:
+            raise ValueError(f'workers should be at least 1, got {workers}')
+        epsilons = list(epsilon) if isinstance(epsilon, (list, tuple)) else [epsilon] * workers
+        eps_decays = list(eps_decay) if isinstance(eps_decay, (list, tuple)) else [eps_decay] * workers
+        if len(epsilons) != workers or len(eps_decays) != workers:
+            raise ValueError(f'epsilon and eps_decay should have one value per worker ({workers}), '
+                             f'got {len(epsilons)} and {len(eps_decays)}')
+        # The agent itself explores as the first worker, e.g. when get_next_action is called after the training
+        super().setup(game_env, gamma, start_alpha, nb_episodes, epsilons[0], eps_decays[0])
+        # Exploration rate and decay of each worker
+        self.epsilons = epsilons
+        self.eps_decays = eps_decays
+        self.workers = workers
+        # Each training draws new seeds for the workers
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+
+    def cache_parameters(self):
+        """
+        :return: parameters the Q-values depend on (dict)
+        """
+        return {**super().cache_parameters(), 'epsilon': self.epsilons, 'eps_decay': self.eps_decays,
+                'workers': self.workers}
+
+
+    def train(self, trace=False, verbose=False):
+        """
+        Train the agent until the workers have completed nb_episodes episodes between them.
+        :param trace: not supported, the steps of the workers have no meaningful order (bool)
+        :param verbose: print the policy to the console at the end of the training (bool)
+        """
+        if trace:
+            raise ValueError('ParallelQLearning cannot be traced, use QLearning instead')
+        episodes = [self.nb_episodes // self.workers + (i < self.nb_episodes % self.workers) for i in range(self.workers)]
+        seeds = self.seed_sequence.spawn(self.workers)
+        blocks = {}
+        try:
+            tables = {}
+            for name in ['q_table', 'visits', 'policy_ids']:
+                array = getattr(self, name)
+                blocks[name] = SharedMemory(create=True, size=max(1, array.nbytes))
+                np.ndarray(array.shape, array.dtype, buffer=blocks[name].buf)[:] = array
+                tables[name] = blocks[name].name, array.shape, array.dtype.str
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(hogwild_worker, self.game_env.grid, tables, self.gamma, self.start_alpha,
+                                           episodes[i], self.epsilons[i], self.eps_decays[i], seeds[i])
+                           for i in range(self.workers) if episodes[i] > 0]
+                results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - start
+            for name, block in blocks.items():
+                array = getattr(self, name)
+                array[:] = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+        # Each worker continues from its own epsilon at the next training
+        self.epsilons = [result['epsilon'] for result in results] + self.epsilons[len(results):]
+        self.epsilon = self.epsilons[0]
+        steps = sum(result['steps'] for result in results)
+        # The throughput is measured over the episodes of the workers, without starting them and building their
+        # environments, which a longer training would not pay again
+        training_time = max(result['time'] for result in results)
+        self.stats = {'episodes': self.nb_episodes, 'steps': steps, 'epsilon': self.epsilons, 'time': elapsed,
+                      'training_time': training_time, 'episodes_per_sec': self.nb_episodes / training_time,
+                      'steps_per_sec': steps / training_time,
+                      'workers': [{key: result[key] for key in ['episodes', 'steps', 'time']} for result in results]}
+        if self.metrics is not None:
+            self.metrics.add_time('training', elapsed)
+            self.metrics.count('episodes', self.nb_episodes)
+            self.metrics.count('steps', steps)
+        if verbose:
+            self.print_policy()
+
+
+PLANNING_MODELS = ['tabular', 'replay']
+
+
+class DynaQLearning(QLearning):
+    def __init__(self, path_to_settings, planning_steps=10, model='tabular', replay_capacity=100000, epsilon=1, eps_decay=0.99, rng=None,
+                 init='zeros', starts='corner'):
+        """
+        Q-learning agent that also learns from simulated experience (Dyna-Q): every real transition is stored in a
+        replay buffer, then planning_steps state-action pairs drawn from it are updated at once.
+        :param path_to_settings: path to the settings file (str)
+        :param planning_steps: number of planning updates per real step (int)
+        :param model: 'tabular' to learn the probability of each outcome of each state-action pair from the counts of
+                      the observed transitions and update the drawn pairs with their expected target, 'replay' to
+                      update them with the target of the drawn transitions themselves
+        :param replay_capacity: number of most recent transitions the pairs are drawn from (int)
+        :param epsilon: initial exploration rate (float)
+        :param eps_decay: decay of epsilon at each step (float)
+        :param rng: random numbers of the real steps and of the planning, see QLearning
+        :param init: initial Q-values, see QLearning
+        :param starts: state the episodes start from, see QLearning
+        """
+        game_env, gamma, start_alpha, nb_episodes = self.parse_settings_file(path_to_settings)
+        self.setup(game_env, gamma, start_alpha, nb_episodes, planning_steps, model, replay_capacity, epsilon, eps_decay, rng,
+                   init, starts)
+
+
+    def setup(self, game_env, gamma, start_alpha, nb_episodes, planning_steps=10, model='tabular', replay_capacity=100000,
+              epsilon=1, eps_decay=0.99, rng=None, init='zeros', starts='corner'):
+        """
+        Initialize the agent, see the constructor for the parameters.
+        """
+        if model not in PLANNING_MODELS:
+            raise ValueError(f"Unknown model '{model}', expected one of {PLANNING_MODELS}")
+        super().setup(game_env, gamma, start_alpha, nb_episodes, epsilon, eps_decay, rng, init, starts)
+        self.planning_steps = planning_steps
+        self.model = model
+        # The minibatches are drawn from the generator of the stream, or from a generator seeded by the random module
+        if isinstance(self.rng, RandomStream):
+            self.planning_rng = self.rng.generator
+        else:
+            self.planning_rng = np.random.default_rng(random.getrandbits(64))
+        # The buffer holds the rows of the states in the tables, not the states
+        self.buffer = ReplayBuffer(replay_capacity, self.index.dtype)
+        # The possible outcomes of each pair are the entries of its row in the compact transition model, counts holds
+        # the number of times each of them was observed. Only their order is used, not their probabilities.
+        transitions, rewards = self.game_env.compact_model()
+        self.outcome_indptr = transitions.indptr
+        self.outcome_rows = transitions.indices
+        self.outcome_rewards = rewards
+        self.outcome_counts = np.zeros(len(self.outcome_rows), dtype=np.int32)
+        self.planning_updates = 0
+
+
+    def cache_parameters(self):
+        """
+        :return: parameters the Q-values depend on, see SolutionCache (dict)
+        """
+        return {**super().cache_parameters(), 'planning_steps': self.planning_steps, 'model': self.model}
+
+
+    def random_parameters(self):
+        """
+        :return: state of the random numbers at the start of a training, see QLearning.random_parameters (dict)
+        """
+        parameters = super().random_parameters()
+        if not isinstance(self.rng, RandomStream):
+            parameters['planning_rng'] = self.planning_rng.bit_generator.state
+        return parameters
+
+
+    def update_q_values(self, prev_state, action, reward, curr_state):
+        """
+        Update the Q-values with a real transition, store it and learn from it, then run the planning updates.
+        :param prev_state: previous state (int)
+        :param action: action taken (str or id in ACTIONS)
+        :param reward: reward received (int)
+        :param curr_state: current state (int)
+        """
+        super().update_q_values(prev_state, action, reward, curr_state)
+        action = ACTION_IDS.get(action, action)
+        prev_row, curr_row = self.index.item(prev_state), self.index.item(curr_state)
+        self.buffer.add(prev_row, action, reward, curr_row)
+        if self.model == 'tabular':
+            k = prev_row * len(ACTIONS) + action
+            for j in range(self.outcome_indptr.item(k), self.outcome_indptr.item(k + 1)):
+                if self.outcome_rows.item(j) == curr_row:
+                    self.outcome_counts[j] += 1
+                    break
+        if self.planning_steps > 0:
+            self.plan(self.planning_steps)
+
+
+    def plan(self, n):
+        """
+        Update n state-action pairs drawn from the replay buffer, all at once. As in BatchedQLearning.update_batch,
+        the updates of the same pair are merged: their mean target is applied once. The step size of a pair is the
+        one of its last real update, its number of visits is not changed.
+        :param n: number of planning updates (int)
+        """
+        rows, actions, rewards, next_rows = self.buffer.sample(n, self.planning_rng)
+        if self.model == 'tabular':
+            # Expected target over the (at most 4) outcomes of each pair, weighted by their observed frequency
+            pairs = rows.astype(np.int64) * len(ACTIONS) + actions
+            starts = self.outcome_indptr[pairs]
+            entries = starts[:, np.newaxis] + np.arange(4)
+            valid = entries < self.outcome_indptr[pairs + 1][:, np.newaxis]
+            entries = np.where(valid, entries, starts[:, np.newaxis])
+            counts = np.where(valid, self.outcome_counts[entries], 0)
+            outcomes = self.outcome_rows[entries]
+            values = self.outcome_rewards[outcomes] + self.gamma * self.q_table[outcomes].max(axis=2)
+            targets = (counts * values).sum(axis=1) / counts.sum(axis=1)
+        else:
+            targets = rewards + self.gamma * self.q_table[next_rows].max(axis=1)
+        pairs, inverse, counts = np.unique(rows.astype(np.int64) * len(ACTIONS) + actions, return_inverse=True, return_counts=True)
+        rows, actions = np.divmod(pairs, len(ACTIONS))
+        mean_targets = np.bincount(inverse, weights=targets) / counts
+        alphas = self.start_alpha / self.visits[rows, actions]
+        self.q_table[rows, actions] += alphas * (mean_targets - self.q_table[rows, actions])
+        self.policy_ids[rows] = self.q_table[rows].argmax(axis=1)
+        self.planning_updates += n
+
+
+    def checkpoint_state(self, episode, total_steps):
+        """
+        Copy the state of a training, with the replay buffer, the outcome counts and the planning generator.
+        """
+        arrays, state = super().checkpoint_state(episode, total_steps)
+        buffer = self.buffer
+        arrays.update({'buffer_states': buffer.states.copy(), 'buffer_actions': buffer.actions.copy(),
+                       'buffer_rewards': buffer.rewards.copy(), 'buffer_next_states': buffer.next_states.copy(),
+                       'outcome_counts': self.outcome_counts.copy()})
+        state.update({'buffer_size': buffer.size, 'buffer_position': buffer.position,
+                      'planning_updates': self.planning_updates, 'planning_rng': self.planning_rng.bit_generator.state})
+        return arrays, state
+
+
+    def restore_checkpoint(self, arrays, state):
+        """
+        Restore the state of a training copied by checkpoint_state.
+        """
+        super().restore_checkpoint(arrays, state)
+        buffer = self.buffer
+        buffer.states[:] = arrays['buffer_states']
+        buffer.actions[:] = arrays['buffer_actions']
+        buffer.rewards[:] = arrays['buffer_rewards']
+        buffer.next_states[:] = arrays['buffer_next_states']
+        buffer.size, buffer.position = state['buffer_size'], state['buffer_position']
+        self.outcome_counts[:] = arrays['outcome_counts']
+        self.planning_updates = state['planning_updates']
+        # With a RandomStream, the planning generator is the one of the stream, already restored with its buffer
+        if not isinstance(self.rng, RandomStream):
+            self.planning_rng.bit_generator.state = state['planning_rng']
+
+
+    def train(self, trace=False, verbose=False, callback=None, cache=None, checkpoint=None, resume=False):
+        """
+        Train the agent, see QLearning.train. self.stats['planning_updates'] is the number of planning updates.
+        """
+        planning_updates = self.planning_updates
+        super().train(trace, verbose, callback, cache, checkpoint, resume)
+        self.stats['planning_updates'] = self.planning_updates - planning_updates
+
+
+# Row of each action in the weights of LinearQLearning, to read the weights of all the actions at once
+ACTION_ROWS = np.arange(len(ACTIONS))[:, np.newaxis]
+
+
+class LinearQLearning(QLearning):
+    def __init__(self, path_to_settings, num_tilings=8, tile_size=4, memory_size=4096, feature_cache=65536,
+                 epsilon=1, eps_decay=0.99, min_epsilon=0.05, rng=None):
+        """
+        Q-learning agent whose Q-values are a linear function of binary features of the state and the action, instead
+        of a table: its memory does not depend on the size of the map. The features of a pair are
+        - a tile coding of the position: num_tilings grids of tile_size x tile_size tiles, shifted from each other,
+          whose tiles are hashed into memory_size weights per action,
+        - the walls around the cell (16 patterns),
+        - whether the intended move gets closer to, or farther from, the nearest reward and the nearest ghost
+          (Manhattan distance, walls ignored),
+        - a bias.
+        Each update changes the weights of the active features of the pair only, with a step size of start_alpha
+        divided by their number. Unlike the tabular agent, whose untried actions keep their optimistic Q-value of 0,
+        the features are shared by many pairs: the exploration rate never decays below min_epsilon.
+        :param path_to_settings: path to the settings file (str)
+        :param num_tilings: number of tilings (int)
+        :param tile_size: side of the tiles in cells (int)
+        :param memory_size: number of weights of the tile coding for each action, shared by the tilings (int)
+        :param feature_cache: number of states whose features are kept in memory (int)
+        :param epsilon: initial exploration rate (float)
+        :param eps_decay: decay of epsilon at each step (float)
+        :param min_epsilon: lowest exploration rate (float)
+        :param rng: random numbers of the exploration and of the moves, see QLearning
+        """
+        game_env, gamma, start_alpha, nb_episodes = self.parse_settings_file(path_to_settings)
+        self.setup(game_env, gamma, start_alpha, nb_episodes, num_tilings, tile_size, memory_size, feature_cache,
+                   epsilon, eps_decay, min_epsilon, rng)
+
+
+    def setup(self, game_env, gamma, start_alpha, nb_episodes, num_tilings=8, tile_size=4, memory_size=4096,
+              feature_cache=65536, epsilon=1, eps_decay=0.99, min_epsilon=0.05, rng=None):
+        """
+        Initialize the agent, see the constructor for the parameters.
+        """
+        if num_tilings < 1 or tile_size < 1:
+            raise ValueError(f'num_tilings and tile_size should be at least 1, got {num_tilings} and {tile_size}')
+        if memory_size < num_tilings:
+            raise ValueError(f'memory_size should be at least num_tilings ({num_tilings}), got {memory_size}')
+        self.min_epsilon = min_epsilon
+        self.num_tilings, self.tile_size, self.memory_size, self.feature_cache = (num_tilings, tile_size, memory_size,
+                                                                                  feature_cache)
+        # The episodes start from the corner, the weights from zeros
+        super().setup(game_env, gamma, start_alpha, nb_episodes, epsilon, eps_decay, rng)
+
+
+    def setup_tables(self, states):
+        """
+        Create the weights and the features the Q-values are computed from, there is no table.
+        :param states: reachable states (np.ndarray)
+        """
+        num_tilings, tile_size, memory_size = self.num_tilings, self.tile_size, self.memory_size
+        # Each tiling hashes its tiles into its own part of the weights, so that the tilings never collide
+        self.tiles_per_tiling = memory_size // num_tilings
+        # Tiling t is shifted by (t, 3t) / num_tilings tiles, the asymmetric shifts of Sutton and Barto (section 9.5.4)
+        self.tiling_offsets = np.arange(num_tilings)[:, np.newaxis] * np.array([1, 3]) * tile_size / num_tilings
+        self.wall_feature = self.tiles_per_tiling * num_tilings
+        self.reward_feature = self.wall_feature + 16
+        self.ghost_feature = self.reward_feature + 3
+        self.bias_feature = self.ghost_feature + 3
+        # Weights of the features, one row per action
+        self.weights = np.zeros((len(ACTIONS), self.bias_feature + 1))
+        self.alpha = self.start_alpha / (num_tilings + 4)
+        # Nearest reward and ghost cells, the trees only hold the terminal cells
+        cells = np.frombuffer(self.game_env.cells, dtype=np.uint8)
+        self.trees = []
+        for code in [1, 2]:
+            positions = np.stack(np.divmod(np.flatnonzero(cells == code), self.game_env.num_cols), axis=1)
+            self.trees.append(cKDTree(positions) if len(positions) > 0 else None)
+        self.features = functools.lru_cache(maxsize=self.feature_cache)(self.compute_features)
+        self.q_values = LinearView(self, greedy=False)
+        self.policy = LinearView(self, greedy=True)
+        self.updates = 0
+
+
+    def compute_features(self, state):
+        """
+        :param state: state (int)
+        :return: active features of each action, one row per action in the order of ACTIONS (np.ndarray of shape (4, num_tilings + 4))
+        """
+        env = self.game_env
+        row, col = divmod(state, env.num_cols)
+        tiles = (np.array([row, col]) + self.tiling_offsets) // self.tile_size
+        hashed = (tiles[:, 0].astype(np.int64) * 73856093 ^ tiles[:, 1].astype(np.int64) * 19349663) % self.tiles_per_tiling
+        features = np.empty((len(ACTIONS), self.num_tilings + 4), dtype=np.int64)
+        features[:, :self.num_tilings] = np.arange(self.num_tilings) * self.tiles_per_tiling + hashed
+
+        # Cell reached by moving in each direction, in the order of ACTIONS, or the cell itself if the move is blocked
+        moves = [(row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)]
+        reached = []
+        pattern = 0
+        for d, (i, j) in enumerate(moves):
+            if 0 <= i < env.num_rows and 0 <= j < env.num_cols and env.cells[i * env.num_cols + j] != 3:
+                reached.append((i, j))
+            else:
+                reached.append((row, col))
+                pattern |= 1 << d
+        features[:, self.num_tilings] = self.wall_feature + pattern
+        for k, (tree, first) in enumerate(zip(self.trees, [self.reward_feature, self.ghost_feature])):
+            if tree is None:
+                change = np.zeros(len(ACTIONS), dtype=np.int64)
+            else:
+                distances, _ = tree.query([(row, col)] + reached, p=1)
+                change = np.sign(distances[1:] - distances[0]).astype(np.int64)
+            features[:, self.num_tilings + 1 + k] = first + change + 1
+        features[:, -1] = self.bias_feature
+        return features
+
+
+    def q_array(self, state):
+        """
+        :param state: state (int)
+        :return: Q-value of each action (np.ndarray of shape (4,))
+        """
+        return self.weights[ACTION_ROWS, self.features(state)].sum(axis=1)
+
+
+    def q_value(self, state, action):
+        """
+        :param state: state (int)
+        :param action: id of the action in ACTIONS (int)
+        :return: Q-value of the state-action pair (float)
+        """
+        return float(self.weights[action, self.features(state)[action]].sum())
+
+
+    def get_next_action(self, state):
+        """
+        Get the next action to take and update the epsilon value.
+        :param state: current state (int)
+        :return: id of the next action in ACTIONS (int)
+        """
+        self.epsilon = self.epsilon * self.eps_decay
+        if self.rng.random() < max(self.epsilon, self.min_epsilon):
+            return self.rng.randrange(len(ACTIONS))
+        return int(self.q_array(state).argmax())
+
+
+    def update_q_values(self, prev_state, action, reward, curr_state):
+        """
+        Update the weights of the active features of the state-action pair.
+        :param prev_state: previous state (int)
+        :param action: action taken (str or id in ACTIONS)
+        :param reward: reward received (int)
+        :param curr_state: current state (int)
+        """
+        action = ACTION_IDS.get(action, action)
+        active = self.features(prev_state)[action]
+        q_value = self.weights[action, active].sum()
+        target = reward + self.gamma * self.q_array(curr_state).max()
+        self.weights[action, active] += self.alpha * (target - q_value)
+        self.updates += 1
+
+
+    def update_policy(self, state):
+        """
+        The greedy policy is read from the weights, there is nothing to update.
+        """
+
+
+    def cache_parameters(self):
+        """
+        :return: parameters the weights depend on (dict)
+        """
+        return {**super().cache_parameters(), 'num_tilings': self.num_tilings, 'tile_size': self.tile_size,
+                'memory_size': self.memory_size, 'min_epsilon': self.min_epsilon}
+
+
+    def checkpoint_state(self, episode, total_steps):
+        """
+        Copy the state of a training, see QLearning.checkpoint_state.
+        """
+        rng, buffered = random_state(self.rng)
+        return ({'weights': self.weights.copy(), 'rng_buffered': buffered},
+                {'episode': episode, 'steps': total_steps, 'epsilon': self.epsilon, 'updates': self.updates, 'rng': rng})
+
+
+    def restore_checkpoint(self, arrays, state):
+        """
+        Restore the state of a training copied by checkpoint_state.
+        """
+        self.weights[:] = arrays['weights']
+        self.epsilon = state['epsilon']
+        self.updates = state['updates']
+        set_random_state(self.rng, state['rng'], arrays['rng_buffered'])
+
+
+    def train(self, trace=False, verbose=False, callback=None, cache=None, checkpoint=None, resume=False):
+        """
+        Train the agent, see QLearning.train. The weights cannot be stored in a SolutionCache.
+        """
+        if cache is not None:
+            raise ValueError('LinearQLearning cannot use a SolutionCache')
+        super().train(trace, verbose, callback, None, checkpoint, resume)
+
+
 if __name__ == "__main__":
     q_learning = QLearning('Q-Learning.txt')
     q_learning.train(trace=True)
@@ -0,0 +1,91 @@
+import itertools
+import operator
+import random
+
+import numpy as np
+
+
+class RandomStream:
+    def __init__(self, seed=None, block_size=65536):
+        """
+        Stream of random numbers with the methods of the random module used by GameEnv and QLearning, drawn from its
+        own numpy generator: two streams with the same seed give the same numbers, whatever the other streams or the
+        random module do. The numbers are generated by blocks and served one by one from a buffer.
+        :param seed: seed, or generator to draw the numbers from (int, np.random.SeedSequence, np.random.Generator or None)
+        :param block_size: number of numbers generated at once (int)
+        """
+        if block_size < 1:
+            raise ValueError(f'block_size should be at least 1, got {block_size}')
+        self.generator = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+        self.block_size = block_size
+        # Current block, and iterator over the numbers of the block not drawn yet
+        self.block = []
+        self.remaining = iter(self.block)
+        # self.random() returns a number drawn uniformly in [0, 1) (float). It is the __next__ method of an iterator
+        # over the blocks, so that drawing a number never runs Python code, except to generate a new block.
+        self.random = itertools.chain.from_iterable(self.blocks()).__next__
+
+
+    def blocks(self):
+        """
+        :return: blocks of numbers drawn uniformly in [0, 1) (generator of lists of float)
+        """
+        while True:
+            self.block = self.generator.random(self.block_size).tolist()
+            self.remaining = iter(self.block)
+            yield self.remaining
+
+
+    def getstate(self):
+        """
+        :return: state of the generator (dict), numbers of the current block not drawn yet (list of float)
+        """
+        return self.generator.bit_generator.state, self.block[len(self.block) - operator.length_hint(self.remaining):]
+
+
+    def setstate(self, generator_state, buffered):
+        """
+        Restore a state returned by getstate: the next numbers are the same as after the call to getstate.
+        :param generator_state: state of the generator (dict)
+        :param buffered: numbers of the current block not drawn yet (list of float)
+        """
+        self.generator.bit_generator.state = generator_state
+        self.block = list(buffered)
+        self.remaining = iter(self.block)
+        self.random = itertools.chain(self.remaining, itertools.chain.from_iterable(self.blocks())).__next__
+
+
+    def uniform(self, a, b):
+        """
+        :return: number drawn uniformly in [a, b) (float)
+        """
+        return a + (b - a) * self.random()
+
+
+    def randrange(self, n):
+        """
+        :param n: number of values (int)
+        :return: integer drawn uniformly in [0, n) (int)
+        """
+        return int(self.random() * n)
+
+
+    def spawn(self, n):
+        """
+        Create independent streams, e.g. one per worker, from the seed of this one.
+        :param n: number of streams (int)
+        :return: streams (list of RandomStream)
+        """
+        return [RandomStream(generator, self.block_size) for generator in self.generator.spawn(n)]
+
+
+def as_random(rng):
+    """
+    :param rng: None for the random module, a seed or a generator for a new RandomStream, or a RandomStream
+    :return: object with the random, uniform and randrange methods of the random module (module or RandomStream)
+    """
+    if rng is None:
+        return random
+    if isinstance(rng, RandomStream):
+        return rng
+    return RandomStream(rng)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+class SolutionCache:
+    # File holding the metadata of every entry, the arrays of an entry are stored in <key>.npz
+    index_file = 'index.json'
+
+    def __init__(self, directory='solution-cache', max_bytes=1 << 30):
+        """
+        On-disk cache of the solutions of the solvers, keyed by the hash of the model and of the solver parameters.
+        When the entries take more than max_bytes, the least recently used ones are evicted.
+        :param directory: directory of the cache, created if needed (str)
+        :param max_bytes: maximum total size of the entries in bytes (int)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.entries = self.read_index()
+
+
+    def read_index(self):
+        """
+        :return: metadata of each entry, by key (dict)
+        """
+        try:
+            with open(os.path.join(self.directory, self.index_file), 'r') as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        # Entries whose arrays were deleted by hand are forgotten
+        return {key: entry for key, entry in entries.items() if os.path.exists(self.path(key))}
+
+
+    def write_index(self):
+        """
+        Write the metadata of the entries, atomically so that a killed run never leaves a corrupted index.
+        """
+        path = os.path.join(self.directory, self.index_file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(path + '.tmp', path)
+
+
+    def path(self, key):
+        """
+        :param key: key of an entry (str)
+        :return: path to the arrays of the entry (str)
+        """
+        return os.path.join(self.directory, key + '.npz')
+
+
+    @staticmethod
+    def key(solver, model_hash, parameters):
+        """
+        :param solver: name of the solver, e.g. 'value_iteration' (str)
+        :param model_hash: hash of the environment, see GameEnv.model_hash (str)
+        :param parameters: parameters the solution depends on (dict)
+        :return: key of the solution (str)
+        """
+        description = json.dumps({'solver': solver, 'model': model_hash, 'parameters': parameters}, sort_keys=True)
+        return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+
+    def get(self, key):
+        """
+        Load an entry and mark it as the most recently used.
+        :param key: key of the entry (str)
+        :return: arrays of the entry (dict of np.ndarray) and its metadata (dict), or None if it is not in the cache
+        """
+        if key not in self.entries:
+            return None
+        with np.load(self.path(key)) as npz:
+            arrays = dict(npz)
+        self.entries[key]['last_used'] = time.time()
+        self.write_index()
+        return arrays, self.entries[key]
+
+
+    def put(self, key, arrays, solver, game_env, parameters, stats):
+        """
+        Store an entry, then evict the least recently used entries if the cache is too large.
+        The cells of the grid are stored with it, to find the most similar map on a cache miss.
+        :param key: key of the entry (str)
+        :param arrays: arrays of the solution, indexed by state (dict of np.ndarray)
+        :param solver: name of the solver (str)
+        :param game_env: GameEnv object that was solved
+        :param parameters: parameters the solution depends on (dict)
+        :param stats: statistics of the run that computed the solution (dict)
+        """
+        cells = np.frombuffer(game_env.cells, dtype=np.uint8)
+        np.savez(self.path(key), cells=cells, **arrays)
+        self.entries[key] = {'solver': solver, 'model': game_env.model_hash(), 'shape': [game_env.num_rows, game_env.num_cols],
+                             'parameters': parameters, 'stats': stats, 'bytes': os.path.getsize(self.path(key)),
+                             'last_used': time.time()}
+        self.evict(keep=key)
+        self.write_index()
+
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        :param keep: key of an entry that is never evicted, e.g. the one just stored (str)
+        """
+        total = sum(entry['bytes'] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.entries.pop(key)['bytes']
+            os.remove(self.path(key))
+
+
+    def closest(self, solver, game_env, parameters, max_candidates=16):
+        """
+        Find the cached solution the closest to a problem, to warm-start a solver on a cache miss: a solution of the
+        same model with the closest gamma if there is one, else the solution of the grid of the same size with
+        the fewest different cells, then the closest gamma.
+        :param solver: name of the solver (str)
+        :param game_env: GameEnv object to solve
+        :param parameters: parameters of the solver, with at least gamma (dict)
+        :param max_candidates: number of most recently used grids of the same size compared cell by cell (int)
+        :return: arrays of the closest entry (dict of np.ndarray) and its metadata (dict), or None if there is none
+        """
+        model_hash = game_env.model_hash()
+        shape = [game_env.num_rows, game_env.num_cols]
+        candidates = [key for key, entry in self.entries.items() if entry['solver'] == solver and entry['shape'] == shape]
+        if not candidates:
+            return None
+
+        def gamma_distance(key):
+            return abs(self.entries[key]['parameters']['gamma'] - parameters['gamma'])
+
+        same_model = [key for key in candidates if self.entries[key]['model'] == model_hash]
+        if same_model:
+            return self.get(min(same_model, key=gamma_distance))
+        cells = np.frombuffer(game_env.cells, dtype=np.uint8)
+        candidates = sorted(candidates, key=lambda k: self.entries[k]['last_used'], reverse=True)[:max_candidates]
+        distances = {}
+        for key in candidates:
+            with np.load(self.path(key)) as npz:
+                distances[key] = (int(np.count_nonzero(npz['cells'] != cells)), gamma_distance(key))
+        return self.get(min(candidates, key=distances.get))
+
+
+    def clear(self):
+        """
+        Delete every entry.
+        """
+        for key in list(self.entries):
+            os.remove(self.path(key))
+        self.entries = {}
+        self.write_index()
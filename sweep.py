@@ -0,0 +1,178 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from q_learning import QLearning
+from value_iteration import ValueIteration
+
+
+# Hyperparameters of QLearning that can be swept, with their default values
+# (gamma, start_alpha and nb_episodes default to the ones of the settings file)
+HYPERPARAMETERS = {'gamma': None, 'start_alpha': None, 'epsilon': 1, 'eps_decay': 0.99, 'nb_episodes': None}
+
+
+def run_key(config):
+    """
+    Key identifying a run in the results file.
+    :param config: hyperparameters and seed of the run (dict)
+    :return: key (str)
+    """
+    return json.dumps(config, sort_keys=True)
+
+
+def optimal_policy(ql, gamma):
+    """
+    Compute the optimal policy of the grid of a QLearning object with value iteration.
+    :param ql: QLearning object
+    :param gamma: discount factor (float)
+    :return: ids of the optimal actions in ACTIONS (list of int)
+    """
+    vi = ValueIteration.from_game_env(ql.game_env, gamma, 1e-9)
+    vi.value_iteration()
+    return vi.q_array(np.asarray(vi.values)).argmax(axis=1).tolist()
+
+
+def run(path_to_settings, config, optimal_policies):
+    """
+    Train a QLearning agent with the given hyperparameters. Runs in a worker process.
+    :param path_to_settings: path to the settings file of QLearning (str)
+    :param config: hyperparameters and seed of the run (dict)
+    :param optimal_policies: optimal policy of each gamma of the sweep (dict)
+    :return: result of the run (dict)
+    """
+    # Each run draws its own random numbers from its seed, so that it gives the same result whatever the worker running it
+    ql = QLearning(path_to_settings, epsilon=config['epsilon'], eps_decay=config['eps_decay'], rng=config['seed'])
+    for name in ['gamma', 'start_alpha', 'nb_episodes']:
+        if config[name] is not None:
+            setattr(ql, name, config[name])
+
+    # The policy has converged at the last episode that changed it
+    last_policy = ql.policy_ids.copy()
+    converged_at = 0
+
+    def on_episode_end(episode):
+        nonlocal converged_at
+        if not np.array_equal(ql.policy_ids, last_policy):
+            last_policy[:] = ql.policy_ids
+            converged_at = episode
+
+    start = time.perf_counter()
+    ql.train(callback=on_episode_end)
+    wall_time = time.perf_counter() - start
+
+    # The policy is only compared on the states where it matters: not walls, terminal states nor unreachable states
+    reachable, _ = ql.game_env.compact_index()
+    states = [s for s in reachable.tolist() if ql.game_env.cells[s] == 0]
+    optimal = optimal_policies[ql.gamma]
+    agreement = sum(ql.policy_ids[ql.index[s]] == optimal[s] for s in states) / max(len(states), 1)
+    # The hyperparameters left to the settings file are replaced by their values
+    return {'key': run_key(config), **config, 'gamma': ql.gamma, 'start_alpha': ql.start_alpha, 'nb_episodes': ql.nb_episodes,
+            'agreement': float(agreement), 'episodes_to_convergence': converged_at, 'wall_time': wall_time}
+
+
+def read_results(path_to_results):
+    """
+    Read the results already streamed to the results file. A line cut by a killed sweep is ignored.
+    :param path_to_results: path to the results file (str)
+    :return: results (list of dict)
+    """
+    results = []
+    if not os.path.exists(path_to_results):
+        return results
+    with open(path_to_results, 'r') as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return results
+
+
+def sweep(path_to_settings, grid, seeds, path_to_results='sweep-results.jsonl', max_workers=None, verbose=False):
+    """
+    Train a QLearning agent for every combination of hyperparameters of the grid and every seed, on a process pool.
+    Each result is appended to the results file as soon as its run finishes: running the same sweep again
+    only runs the combinations missing from the file.
+    :param path_to_settings: path to the settings file of QLearning (str)
+    :param grid: values of each swept hyperparameter, see HYPERPARAMETERS (dict of lists)
+    :param seeds: seeds of the runs of each combination (list of int)
+    :param path_to_results: path to the results file, one JSON line per run (str)
+    :param max_workers: number of worker processes, all the cores by default (int)
+    :param verbose: print each result as it arrives (bool)
+    :return: aggregated results, one row per combination of hyperparameters (list of dict)
+    """
+    unknown = set(grid) - set(HYPERPARAMETERS)
+    if unknown:
+        raise ValueError(f'Unknown hyperparameters {sorted(unknown)}, expected some of {list(HYPERPARAMETERS)}')
+    names = list(HYPERPARAMETERS)
+    values = [grid.get(name, [HYPERPARAMETERS[name]]) for name in names]
+    configs = [dict(zip(names, combination), seed=seed) for combination in itertools.product(*values) for seed in seeds]
+
+    done = {result['key'] for result in read_results(path_to_results)}
+    todo = [config for config in configs if run_key(config) not in done]
+
+    # The optimal policies only depend on gamma, they are computed once here instead of in every run
+    ql = QLearning(path_to_settings)
+    gammas = {ql.gamma if config['gamma'] is None else config['gamma'] for config in todo}
+    optimal_policies = {gamma: optimal_policy(ql, gamma) for gamma in gammas}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, open(path_to_results, 'a+') as f:
+        # Terminate a line cut by a killed sweep, so that it does not swallow the next result
+        if f.tell() > 0:
+            f.seek(f.tell() - 1)
+            if f.read(1) != '\n':
+                f.write('\n')
+        futures = [executor.submit(run, path_to_settings, config, optimal_policies) for config in todo]
+        for future in as_completed(futures):
+            result = future.result()
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            if verbose:
+                print(result)
+
+    keys = {run_key(config) for config in configs}
+    return aggregate([result for result in read_results(path_to_results) if result['key'] in keys])
+
+
+def aggregate(results):
+    """
+    Aggregate the results of the runs sharing the same hyperparameters.
+    :param results: results of the runs (list of dict)
+    :return: one row per combination of hyperparameters with the mean agreement with the optimal policy,
+             the mean number of episodes to convergence and the mean wall time over the seeds (list of dict)
+    """
+    groups = {}
+    for result in results:
+        groups.setdefault(tuple(result[name] for name in HYPERPARAMETERS), []).append(result)
+    table = []
+    for combination, runs in groups.items():
+        row = dict(zip(HYPERPARAMETERS, combination))
+        row['seeds'] = len(runs)
+        for metric in ['agreement', 'episodes_to_convergence', 'wall_time']:
+            row[metric] = sum(run[metric] for run in runs) / len(runs)
+        table.append(row)
+    return table
+
+
+def print_table(table):
+    """
+    Print the aggregated results to the console.
+    :param table: aggregated results (list of dict)
+    """
+    if not table:
+        return
+    columns = list(table[0])
+    print(' | '.join(f'{column:^12}' for column in columns))
+    print('-' * 15 * len(columns))
+    for row in table:
+        print(' | '.join(f'{row[column]:^12.4g}' if isinstance(row[column], float) else f'{str(row[column]):^12}'
+                         for column in columns))
+
+
+if __name__ == '__main__':
+    table = sweep('Q-Learning.txt', {'start_alpha': [0.5, 0.9], 'eps_decay': [0.99, 0.999]}, seeds=[0, 1, 2, 3])
+    print_table(table)
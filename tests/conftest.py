@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# The modules of the repository are imported from its root directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
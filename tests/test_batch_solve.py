@@ -0,0 +1,52 @@
+import numpy as np
+
+import batch_solve
+import maze
+from game_env import ACTION_IDS, GameEnv
+from value_iteration import ValueIteration
+
+
+def random_maps(count, size=12):
+    return [(f'map-{seed}', maze.random_maze(size, size, 0.25, 3, seed=seed)) for seed in range(count)]
+
+
+def test_stacked_solve_matches_single_solves():
+    maps = random_maps(6) + [('small', maze.random_maze(5, 7, 0.2, 2, seed=0))]
+    results = {result['name']: result for result in batch_solve.solve_maps(maps, 0.9, 1e-6, workers=0)}
+    assert len(results) == len(maps)
+    for name, grid in maps:
+        result = results[name]
+        assert result['error'] is None
+        vi = ValueIteration.from_game_env(GameEnv(grid), 0.9, 1e-6)
+        vi.value_iteration()
+        vi.compute_policy()
+        values = np.array(vi.values).reshape(result['values'].shape)
+        reachable = np.isfinite(values)
+        assert np.allclose(result['values'][reachable], values[reachable], atol=1e-9)
+        assert result['iterations'] == vi.stats['iterations']
+        policy = np.array([ACTION_IDS.get(action, -1) for action in vi.policy]).reshape(result['policy'].shape)
+        assert np.array_equal(result['policy'], policy)
+
+
+def test_stacked_solve_with_workers_matches_without():
+    maps = random_maps(4)
+    inline = {r['name']: r for r in batch_solve.solve_maps(maps, 0.9, 1e-6, workers=0)}
+    pooled = {r['name']: r for r in batch_solve.solve_maps(maps, 0.9, 1e-6, workers=2, max_states=300)}
+    assert inline.keys() == pooled.keys()
+    for name in inline:
+        assert np.array_equal(inline[name]['values'], pooled[name]['values'])
+
+
+def test_failing_stack_only_reports_the_maps_not_yielded(monkeypatch):
+    solve = batch_solve.stacked_value_iteration
+
+    def failing(stack, max_iterations):
+        results = solve(stack, max_iterations)
+        yield next(results)
+        raise RuntimeError('stack failed')
+
+    monkeypatch.setattr(batch_solve, 'stacked_value_iteration', failing)
+    maps = random_maps(3)
+    results = list(batch_solve.solve_maps(maps, 0.9, 1e-6, workers=0))
+    assert sorted(result['name'] for result in results) == sorted(name for name, _ in maps)
+    assert sum(result['error'] is None for result in results) == 1
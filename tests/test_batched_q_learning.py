@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+
+from game_env import ACTIONS, GameEnv, VectorGameEnv
+from q_learning import BatchedQLearning, QLearning
+
+
+GRID = [[0, 0, 3, 0], [0, 3, 0, 3], [0, 0, 0, 1], [0, 3, 0, 2]]
+
+
+def random_transitions(env, count, seed):
+    rng = random.Random(seed)
+    states = [s for s in env.compact_index()[0].tolist() if env.cells[s] != 3]
+    for _ in range(count):
+        state, action = rng.choice(states), rng.choice(ACTIONS)
+        next_states, probabilities = zip(*env.get_possible_next_states(state, action))
+        next_state = rng.choices(next_states, probabilities)[0]
+        yield state, action, env.get_reward(next_state), next_state
+
+
+def test_vector_env_draws_the_moves_of_the_model():
+    env = GameEnv(GRID)
+    vector_env = VectorGameEnv(env, 20000, seed=0)
+    state = vector_env.start_state
+    for action in range(len(ACTIONS)):
+        vector_env.reset()
+        next_states, rewards, done = vector_env.step(np.full(vector_env.num_envs, action))
+        assert not done.any() and np.array_equal(vector_env.states, next_states)
+        assert np.array_equal(rewards, env.rewards[next_states])
+        frequencies = np.bincount(next_states, minlength=env.num_states) / vector_env.num_envs
+        for next_state, probability in env.get_possible_next_states(state, ACTIONS[action]):
+            assert abs(frequencies[next_state] - probability) < 0.02
+
+
+def test_vector_env_resets_the_games_that_end():
+    env = GameEnv(GRID)
+    vector_env = VectorGameEnv(env, 4, seed=0)
+    reward = env.position_to_state((2, 3))
+    vector_env.states[:2] = reward
+    next_states, _, done = vector_env.step(np.zeros(4, dtype=np.int64))
+    assert done.tolist() == [True, True, False, False]
+    # The moves made from the terminal state are returned, the games start again
+    assert set(next_states[:2].tolist()) <= {s for s, _ in env.get_possible_next_states(reward, 'up')}
+    assert vector_env.states[:2].tolist() == [vector_env.start_state] * 2
+    assert np.array_equal(vector_env.states[2:], next_states[2:])
+
+
+def test_batches_of_one_transition_match_the_serial_updates():
+    serial = QLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 1)
+    batched = BatchedQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 1, num_envs=1, seed=0)
+    for state, action, reward, next_state in random_transitions(serial.game_env, 1000, seed=1):
+        serial.update_q_values(state, action, reward, next_state)
+        serial.update_policy(state)
+        batched.update_batch(np.array([state]), np.array([ACTIONS.index(action)]), np.array([reward]),
+                             np.array([next_state]))
+    assert np.array_equal(batched.q_table, serial.q_table)
+    assert np.array_equal(batched.visits, serial.visits)
+    assert np.array_equal(batched.policy_ids, serial.policy_ids)
+
+
+def test_batch_merges_the_transitions_of_a_pair():
+    agent = BatchedQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 1, num_envs=3, seed=0)
+    env = agent.game_env
+    start, reward = env.position_to_state((3, 0)), env.position_to_state((2, 3))
+    agent.q_table[agent.index[reward]] = [2, 0, 0, 0]
+    above, right = env.position_to_state((2, 0)), env.position_to_state((3, 1))
+    agent.update_batch(np.array([start, start, start]), np.array([0, 0, 3]), np.array([-0.04, 1.0, -0.04]),
+                       np.array([above, reward, right]))
+    row = agent.index[start]
+    # Two visits of 'up' at once: the mean target, with the step size of the second visit
+    assert agent.visits[row].tolist() == [2, 0, 0, 1]
+    assert agent.q_table[row, 0] == 0.5 * 2 / 2 * ((-0.04 + 1.0 + 0.9 * 2) / 2)
+    assert agent.q_table[row, 3] == 0.5 * -0.04
+    assert agent.policy_ids[row] == 0
+
+
+def test_training_counts_the_episodes_of_all_the_games():
+    agent = BatchedQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 50, num_envs=8, seed=0)
+    agent.train()
+    assert agent.stats['episodes'] >= 50
+    assert agent.visits.sum() == agent.stats['steps'] and agent.stats['steps'] % 8 == 0
+    assert (agent.policy_ids[agent.index[agent.game_env.position_to_state((3, 0))]] >= 0)
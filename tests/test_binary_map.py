@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import maze
+from binary_map import read_map, write_map
+from game_env import GameEnv
+from value_iteration import ValueIteration
+
+
+@pytest.fixture
+def map_path(tmp_path):
+    path = str(tmp_path / 'map.bin')
+    write_map(path, maze.random_maze(20, 30, 0.2, 3, seed=0), 0.9, 1e-6)
+    return path
+
+
+def test_env_shares_the_mapped_grid(map_path):
+    grid, _ = read_map(map_path)
+    env = GameEnv(grid)
+    cells = np.frombuffer(env.cells, dtype=np.uint8)
+    assert np.shares_memory(cells, grid)
+    assert not cells.flags.writeable
+
+
+def test_edits_do_not_change_the_file(map_path):
+    grid, _ = read_map(map_path)
+    env = GameEnv(grid)
+    code = 3 if env.cells[0] != 3 else 0
+    env.set_cells({(0, 0): code})
+    assert env.cells[0] == code
+    assert read_map(map_path)[0][0, 0] != code
+
+
+def test_binary_map_solves_as_the_grid(map_path):
+    grid, _ = read_map(map_path)
+    mapped = ValueIteration(map_path)
+    mapped.value_iteration()
+    listed = ValueIteration.from_game_env(GameEnv(grid.tolist()), 0.9, 1e-6)
+    listed.value_iteration()
+    assert mapped.values == listed.values
@@ -0,0 +1,101 @@
+import random
+
+import numpy as np
+import pytest
+
+import maze
+from checkpoint import Checkpointer
+from game_env import GameEnv
+from metrics import Metrics
+from q_learning import DynaQLearning, QLearning
+from random_stream import RandomStream
+from value_iteration import ValueIteration
+
+
+GRID = maze.random_maze(8, 10, 0.2, 4, seed=2)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptingCheckpointer(Checkpointer):
+    # Kills the run right after its checkpoint of iteration or episode `at` is written
+    def __init__(self, path, every, at):
+        super().__init__(path, every=every, background=False)
+        self.at = at
+
+
+    def save(self, arrays, state):
+        super().save(arrays, state)
+        if state.get('episode', state.get('iteration')) == self.at:
+            raise Interrupted()
+
+
+@pytest.mark.parametrize('engine, mode', [('numpy', 'jacobi'), ('python', 'jacobi'), ('numpy', 'gauss-seidel'),
+                                          ('python', 'sor'), ('numpy', 'sor')])
+def test_value_iteration_resume_is_bit_identical(tmp_path, engine, mode):
+    path = str(tmp_path / 'run.ckpt')
+    uninterrupted = ValueIteration.from_game_env(GameEnv(GRID), 0.95, 1e-8, engine=engine, mode=mode)
+    uninterrupted.value_iteration()
+
+    interrupted = ValueIteration.from_game_env(GameEnv(GRID), 0.95, 1e-8, engine=engine, mode=mode)
+    with pytest.raises(Interrupted):
+        interrupted.value_iteration(checkpoint=InterruptingCheckpointer(path, 10, 30))
+    resumed = ValueIteration.from_game_env(GameEnv(GRID), 0.95, 1e-8, engine=engine, mode=mode)
+    metrics = Metrics()
+    resumed.instrument(metrics)
+    resumed.value_iteration(checkpoint=Checkpointer(path, every=10, background=False), resume=True)
+    assert resumed.values == uninterrupted.values
+    assert resumed.stats['iterations'] == uninterrupted.stats['iterations']
+    # Only the iterations after the checkpoint were run again
+    assert metrics.snapshot()['counters']['iterations'] == uninterrupted.stats['iterations'] - 30
+
+
+def train(cls, rng, checkpoint=None, resume=False, starts='corner', callback=None):
+    agent = cls.from_game_env(GameEnv(GRID), 0.9, 0.5, 40, rng=rng, starts=starts)
+    agent.train(callback=callback, checkpoint=checkpoint, resume=resume)
+    return agent
+
+
+@pytest.mark.parametrize('cls', [QLearning, DynaQLearning])
+@pytest.mark.parametrize('stream', [True, False])
+def test_q_learning_resume_is_bit_identical(tmp_path, cls, stream):
+    path = str(tmp_path / 'run.ckpt')
+
+    def rng():
+        # A new stream with the same seed, or the random module seeded again
+        if stream:
+            return RandomStream(7, block_size=64)
+        random.seed(7)
+        return None
+
+    uninterrupted = train(cls, rng(), starts='visits')
+    with pytest.raises(Interrupted):
+        train(cls, rng(), InterruptingCheckpointer(path, 5, 25), starts='visits')
+    # The resumed run starts from other random numbers, they are restored from the checkpoint
+    random.seed(8)
+    episodes = []
+    resumed = train(cls, RandomStream(8, block_size=64) if stream else None, Checkpointer(path, every=5), True,
+                    starts='visits', callback=episodes.append)
+    assert episodes == list(range(26, 41))
+    assert np.array_equal(resumed.q_table, uninterrupted.q_table)
+    assert np.array_equal(resumed.visits, uninterrupted.visits)
+    assert np.array_equal(resumed.policy_ids, uninterrupted.policy_ids)
+    assert resumed.epsilon == uninterrupted.epsilon
+    assert resumed.stats['steps'] == uninterrupted.stats['steps']
+
+
+def test_resume_with_other_parameters_raises(tmp_path):
+    path = str(tmp_path / 'run.ckpt')
+    train(QLearning, 1, Checkpointer(path, every=5, background=False))
+    with pytest.raises(ValueError):
+        QLearning.from_game_env(GameEnv(GRID), 0.8, 0.5, 40, rng=1).train(checkpoint=Checkpointer(path), resume=True)
+    with pytest.raises(ValueError):
+        train(QLearning, None, Checkpointer(path), True)
+
+
+def test_prioritized_mode_cannot_be_checkpointed(tmp_path):
+    vi = ValueIteration.from_game_env(GameEnv(GRID), 0.9, 1e-6, mode='prioritized')
+    with pytest.raises(ValueError):
+        vi.value_iteration(checkpoint=Checkpointer(str(tmp_path / 'run.ckpt')))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from game_env import GameEnv
+from q_learning import DynaQLearning, QLearning, ReplayBuffer
+from value_iteration import ValueIteration
+
+
+GRID = [[0, 0, 0, 1], [0, 3, 0, 2], [0, 0, 0, 0]]
+
+
+def test_replay_buffer_keeps_the_last_transitions():
+    buffer = ReplayBuffer(4)
+    with pytest.raises(ValueError):
+        buffer.sample(1, np.random.default_rng(0))
+    for i in range(6):
+        buffer.add(i, i % 4, float(i), i + 1)
+    assert len(buffer) == 4 and sorted(buffer.states.tolist()) == [2, 3, 4, 5]
+    buffer.add_batch(np.arange(10, 17), np.zeros(7, dtype=np.int8), np.zeros(7), np.arange(11, 18))
+    assert sorted(buffer.states.tolist()) == [13, 14, 15, 16]
+    # The oldest transition is overwritten next
+    buffer.add(20, 0, 0.0, 21)
+    assert sorted(buffer.states.tolist()) == [14, 15, 16, 20]
+    states, _, _, next_states = buffer.sample(100, np.random.default_rng(0))
+    assert set(states.tolist()) == {14, 15, 16, 20} and np.array_equal(next_states, states + 1)
+
+
+def test_without_planning_it_is_the_serial_agent():
+    dyna = DynaQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 30, planning_steps=0, rng=1)
+    serial = QLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 30, rng=1)
+    dyna.train()
+    serial.train()
+    assert np.array_equal(dyna.q_table, serial.q_table)
+    assert np.array_equal(dyna.visits, serial.visits)
+    assert len(dyna.buffer) == dyna.stats['steps'] == serial.stats['steps']
+
+
+def test_tabular_planning_keeps_the_values_of_value_iteration():
+    vi = ValueIteration.from_game_env(GameEnv(GRID), 0.9, 1e-12)
+    vi.value_iteration()
+    agent = DynaQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 1, planning_steps=0, rng=0)
+    states, _ = agent.game_env.compact_index()
+    q = vi.q_array(np.asarray(vi.values)[states], compact=True)
+    agent.q_table[:] = np.where(np.isfinite(q), q, 0)
+    agent.visits[:] = 1
+    # Outcomes observed as often as their probability: the expected targets are the backups of value iteration
+    transitions, _ = agent.game_env.compact_model()
+    agent.outcome_counts[:] = np.rint(transitions.data * 10).astype(np.int32)
+    cells = np.frombuffer(agent.game_env.cells, dtype=np.uint8)[states]
+    for row in np.flatnonzero(cells != 3):
+        for action in range(4):
+            agent.buffer.add(row, action, 0.0, row)
+    expected = agent.q_table.copy()
+    agent.plan(1000)
+    assert np.allclose(agent.q_table, expected, rtol=0, atol=1e-9)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import maze
+from evaluation import exact_evaluation, monte_carlo_evaluation, policy_action_ids
+from game_env import ACTION_IDS, GameEnv
+from q_learning import QLearning
+from value_iteration import ValueIteration
+
+
+GRID = maze.random_maze(6, 7, 0.2, 2, seed=0)
+
+
+def solved(gamma=0.9):
+    vi = ValueIteration.from_game_env(GameEnv(GRID), gamma, 1e-10)
+    vi.value_iteration()
+    vi.compute_policy()
+    return vi
+
+
+def test_policies_of_every_solver_give_the_same_ids():
+    vi = solved()
+    ids = policy_action_ids(vi, vi.game_env)
+    assert np.array_equal(ids, [ACTION_IDS.get(action, -1) for action in vi.policy])
+    assert np.array_equal(policy_action_ids(dict(enumerate(vi.policy)), vi.game_env), ids)
+    ql = QLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 20, rng=0)
+    ql.train()
+    assert np.array_equal(policy_action_ids(ql, ql.game_env), policy_action_ids(dict(ql.policy), ql.game_env))
+    with pytest.raises(ValueError):
+        policy_action_ids(ids[:-1], vi.game_env)
+
+
+@pytest.mark.parametrize('gamma', [0.9, 1.0])
+def test_monte_carlo_agrees_with_the_exact_evaluation(gamma):
+    vi = solved()
+    env = vi.game_env
+    values, lengths = exact_evaluation(env, vi, gamma)
+    start = (env.num_rows - 1) * env.num_cols
+    assert np.isfinite(lengths[start])
+    result = monte_carlo_evaluation(env, vi, gamma, num_episodes=20000, seed=0)
+    assert result['truncated'] == 0
+    assert abs(result['mean_return'] - values[start]) < 4 * result['std_error']
+    assert abs(result['mean_length'] - lengths[start]) < 4 * np.sqrt(result['var_length'] / result['episodes'])
+
+
+def test_exact_values_satisfy_the_bellman_equation_of_the_episodes():
+    vi = solved()
+    env = vi.game_env
+    values, lengths = exact_evaluation(env, vi, 0.9)
+    for state in np.flatnonzero(np.isfinite(values)).tolist():
+        if env.cells[state] == 3:
+            continue
+        moves = env.get_possible_next_states(state, vi.policy[state])
+        # The episode ends with the move made from a terminal state
+        go_on = 0 if env.terminal[state] else 1
+        assert values[state] == pytest.approx(sum(p * (env.get_reward(s) + go_on * 0.9 * values[s]) for s, p in moves))
+        assert lengths[state] == pytest.approx(1 + go_on * sum(p * lengths[s] for s, p in moves))
+
+
+def test_policy_that_never_ends_has_an_infinite_length():
+    env = GameEnv([[0, 0, 1], [0, 3, 2]])
+    # Always bumping into the left border, the episodes never reach a terminal state
+    ids = np.zeros(env.num_states, dtype=np.int64) + ACTION_IDS['left']
+    values, lengths = exact_evaluation(env, ids, 0.9)
+    start = env.num_cols
+    assert lengths[start] == np.inf and np.isfinite(values[start])
+    result = monte_carlo_evaluation(env, ids, 0.9, num_episodes=10, max_steps=50, seed=0)
+    assert result['truncated'] == 10
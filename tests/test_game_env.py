@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import maze
+from game_env import ACTION_IDS, GameEnv
+from value_iteration import ValueIteration
+
+
+GRID = maze.random_maze(20, 25, 0.25, 4, seed=3)
+# A wall removed, walls added, a wall moved, a reward moved and a ghost removed
+EDITS = [{(0, 0): 0}, {(5, 5): 3, (5, 6): 3}, {(4, 4): 0, (4, 5): 3}, {(7, 13): 0, (10, 12): 1, (18, 8): 0}]
+
+
+def edited_grid(edits):
+    grid = [list(row) for row in GRID]
+    for (i, j), code in edits.items():
+        grid[i][j] = code
+    return grid
+
+
+def assert_same_model(env, expected):
+    assert bytes(env.cells) == bytes(expected.cells)
+    assert np.array_equal(env.indptr, expected.indptr)
+    assert np.array_equal(env.next_states, expected.next_states)
+    assert np.array_equal(env.probs, expected.probs)
+    assert np.array_equal(env.rewards, expected.rewards, equal_nan=True)
+    assert np.array_equal(env.terminal, expected.terminal)
+    assert (env.transitions != expected.transitions).nnz == 0
+    assert np.array_equal(env.compact_index()[0], expected.compact_index()[0])
+
+
+@pytest.mark.parametrize('edits', EDITS)
+def test_set_cells_gives_the_model_of_the_edited_grid(edits):
+    env = GameEnv([list(row) for row in GRID])
+    # Built before the edits, so that it is patched
+    env.predecessor_index()
+    env.set_cells(edits)
+    expected = GameEnv(edited_grid(edits))
+    assert_same_model(env, expected)
+    for patched, built in zip(env.predecessor_index(), expected.predecessor_index()):
+        assert np.array_equal(patched, built)
+
+
+def test_set_cells_rejects_positions_outside_of_the_grid():
+    env = GameEnv([list(row) for row in GRID])
+    with pytest.raises(ValueError):
+        env.set_cells({(20, 0): 3})
+
+
+@pytest.mark.parametrize('edits', EDITS)
+def test_update_cells_matches_a_full_solve(edits):
+    vi = ValueIteration.from_game_env(GameEnv([list(row) for row in GRID]), 0.9, 1e-10)
+    vi.value_iteration()
+    vi.compute_policy()
+    vi.update_cells(edits)
+
+    expected = ValueIteration.from_game_env(GameEnv(edited_grid(edits)), 0.9, 1e-10)
+    expected.value_iteration()
+    expected.compute_policy()
+    reachable = expected.game_env.compact_index()[0]
+    reachable = reachable[np.frombuffer(expected.game_env.cells, dtype=np.uint8)[reachable] != 3]
+    values, expected_values = np.array(vi.values), np.array(expected.values)
+    assert np.allclose(values[reachable], expected_values[reachable], atol=1e-7)
+    # The actions can only differ between ties
+    q = expected.q_array(expected_values)
+    for state in reachable.tolist():
+        assert q[state, ACTION_IDS[vi.policy[state]]] == pytest.approx(q[state].max(), abs=1e-7)
+    assert 0 < vi.stats['touched'] < len(reachable)
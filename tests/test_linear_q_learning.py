@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from game_env import GameEnv
+from q_learning import LinearQLearning
+
+
+# Start state in the bottom left corner, reward in the top right one, a ghost on the way
+GRID = [[0, 0, 0, 0, 1], [0, 3, 3, 0, 0], [0, 0, 0, 0, 2], [0, 3, 0, 3, 0], [0, 0, 0, 0, 0]]
+
+
+def train(seed, **kwargs):
+    agent = LinearQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 200, rng=seed, **kwargs)
+    agent.train()
+    return agent
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_greedy_policy_reaches_the_reward(seed):
+    agent = train(seed)
+    env = agent.game_env
+    assert len(agent.index) == env.num_states and len(agent.start_states) == 0
+    state = (env.num_rows - 1) * env.num_cols
+    for _ in range(2 * env.num_states):
+        if env.cells[state] in (1, 2):
+            break
+        # The intended move of the greedy action, the most likely one
+        state = max(env.get_possible_next_states(state, agent.policy[state]), key=lambda move: move[1])[0]
+    assert env.cells[state] == 1
+
+
+def test_cached_features_equal_a_recomputation():
+    agent = train(0)
+    assert agent.features.cache_info().hits > 0
+    for state in range(agent.game_env.num_states):
+        if agent.game_env.cells[state] != 3:
+            assert np.array_equal(agent.features(state), agent.compute_features(state))
+    # A cache too small to hit learns the same weights
+    uncached = train(0, feature_cache=0)
+    assert uncached.features.cache_info().hits == 0
+    assert np.array_equal(uncached.weights, agent.weights)
@@ -0,0 +1,50 @@
+import maze
+from game_env import GameEnv
+from metrics import Metrics
+from q_learning import QLearning
+from value_iteration import ValueIteration
+
+
+GRID = maze.random_maze(8, 10, 0.2, 4, seed=2)
+
+
+def test_hot_paths_time_every_step():
+    agent = QLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 10, rng=1)
+    metrics = Metrics()
+    agent.instrument(metrics, hot_paths=True)
+    agent.train()
+    snapshot = metrics.snapshot()
+    steps = snapshot['counters']['steps']
+    assert steps == agent.stats['steps']
+    for name in ['GameEnv.sample_next_state', 'QLearning.update_q_values', 'QLearning.update_policy']:
+        assert snapshot['timers'][name]['calls'] == steps
+
+    # The wrappers are removed, the next training is not timed
+    agent.instrument(None)
+    agent.train()
+    assert metrics.snapshot()['timers']['GameEnv.sample_next_state']['calls'] == steps
+
+
+def test_value_iteration_counters_match_its_stats():
+    metrics = Metrics()
+    for mode in ['jacobi', 'gauss-seidel', 'prioritized']:
+        vi = ValueIteration.from_game_env(GameEnv(GRID), 0.9, 1e-6, mode=mode)
+        vi.instrument(metrics)
+        before = metrics.snapshot()['counters']
+        vi.value_iteration()
+        counters = metrics.snapshot()['counters']
+        assert counters['iterations'] - before.get('iterations', 0) == vi.stats['iterations']
+        assert counters['backups'] - before.get('backups', 0) == vi.stats['backups']
+    snapshot = metrics.snapshot()
+    assert snapshot['timers']['sweep']['calls'] == snapshot['counters']['iterations']
+    assert snapshot['series']['delta']['last'] < 1e-6
+
+
+def test_sampler_takes_a_last_snapshot_with_the_rates():
+    metrics = Metrics()
+    snapshots = []
+    sampler = metrics.sample(60, snapshots.append)
+    metrics.count('steps', 10)
+    sampler.stop()
+    assert len(snapshots) == 1
+    assert snapshots[0]['counters'] == {'steps': 10} and snapshots[0]['rates']['steps'] > 0
@@ -0,0 +1,55 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+import maze
+import q_learning
+from game_env import GameEnv
+from q_learning import ParallelQLearning
+
+
+GRID = maze.random_maze(8, 10, 0.2, 4, seed=2)
+
+
+def train(workers, seed, nb_episodes=40):
+    agent = ParallelQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, nb_episodes, workers=workers, seed=seed)
+    agent.train()
+    return agent
+
+
+def test_workers_update_the_shared_tables_and_unlink_them(monkeypatch):
+    created = []
+
+    class RecordingSharedMemory(SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.name)
+
+    monkeypatch.setattr(q_learning, 'SharedMemory', RecordingSharedMemory)
+    agent = train(2, 1)
+    assert [worker['episodes'] for worker in agent.stats['workers']] == [20, 20]
+    # Updates lost to concurrent writes can only make the visits fewer than the steps
+    assert 0 < agent.visits.sum() <= agent.stats['steps']
+    assert np.count_nonzero(agent.q_table) > 0 and (agent.policy_ids >= 0).any()
+    assert 0 < agent.stats['training_time'] <= agent.stats['time']
+    assert len(created) == 3
+    for name in created:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
+
+
+def test_agent_explores_as_the_first_worker_after_the_training():
+    agent = ParallelQLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 40, workers=2, epsilon=[1, 0.5],
+                                            eps_decay=[0.99, 0.9], seed=1)
+    agent.train()
+    assert len(agent.epsilons) == 2 and agent.epsilon == agent.epsilons[0]
+    assert agent.epsilons[1] < 0.5
+    assert 0 <= agent.get_next_action(0) < 4
+
+
+def test_seed_gives_the_random_numbers_of_the_workers():
+    first, again, other = train(1, 3), train(1, 3), train(1, 4)
+    assert np.array_equal(first.q_table, again.q_table)
+    assert first.stats['steps'] == again.stats['steps']
+    assert not np.array_equal(first.q_table, other.q_table)
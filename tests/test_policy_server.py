@@ -0,0 +1,179 @@
+import asyncio
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+import policy_server
+from evaluation import policy_action_ids
+from game_env import GameEnv
+from policy_server import PolicyClient, PolicyModel, PolicyServer, load_model, save_model
+from value_iteration import ValueIteration
+
+
+GRID = [[0, 0, 0, 1], [0, 3, 0, 2], [0, 0, 0, 0]]
+
+
+def solved(gamma):
+    vi = ValueIteration.from_game_env(GameEnv(GRID), gamma, 1e-6)
+    vi.value_iteration()
+    vi.compute_policy()
+    return vi
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def run(loop, coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout=10)
+
+
+def test_query_round_trip_and_reload(tmp_path, loop):
+    first, second = solved(0.9), solved(0.5)
+    first_path, second_path = str(tmp_path / 'first.npz'), str(tmp_path / 'second.npz')
+    save_model(first_path, first)
+    save_model(second_path, second)
+    server = PolicyServer(load_model(first_path))
+    listener = run(loop, server.start(str(tmp_path / 'server.sock')))
+    client = PolicyClient(str(tmp_path / 'server.sock'))
+    try:
+        states = np.arange(-1, len(first.values) + 1)
+        actions, values = client.query(states)
+        assert actions[0] == actions[-1] == -1 and np.isnan(values[[0, -1]]).all()
+        assert np.array_equal(actions[1:-1], policy_action_ids(first, first.game_env))
+        assert np.array_equal(values[1:-1], first.values)
+
+        assert client.reload(second_path)['version'] == 2
+        _, values = client.query(states[1:-1])
+        assert np.array_equal(values, second.values)
+        stats = client.stats()
+        assert (stats['queries'], stats['reloads'], stats['errors']) == (2, 1, 0)
+
+        with pytest.raises(ValueError):
+            client.reload(str(tmp_path / 'missing.npz'))
+        _, values = client.query(states[1:-1])
+        assert np.array_equal(values, second.values)
+    finally:
+        client.close()
+        listener.close()
+        run(loop, listener.wait_closed())
+
+
+@pytest.mark.parametrize('content', [b'PK\x03\x04garbage', b'not a model'])
+def test_reload_of_a_corrupt_file_keeps_the_old_model(tmp_path, loop, content):
+    model = solved(0.9)
+    path, corrupt = str(tmp_path / 'model.npz'), tmp_path / 'corrupt.npz'
+    save_model(path, model)
+    corrupt.write_bytes(content)
+    missing_array = str(tmp_path / 'missing.npz')
+    np.savez(missing_array, policy=np.zeros(3))
+    server = PolicyServer(load_model(path))
+    listener = run(loop, server.start(str(tmp_path / 'server.sock')))
+    client = PolicyClient(str(tmp_path / 'server.sock'))
+    try:
+        for bad in [str(corrupt), missing_array]:
+            with pytest.raises(ValueError):
+                client.reload(bad)
+        _, values = client.query(range(len(model.values)))
+        assert np.array_equal(values, model.values)
+        assert server.version == 1
+    finally:
+        client.close()
+        listener.close()
+        run(loop, listener.wait_closed())
+
+
+def test_watch_survives_a_corrupt_file(tmp_path, loop):
+    path = str(tmp_path / 'model.npz')
+    save_model(path, solved(0.9))
+    server = PolicyServer(load_model(path))
+    watcher = asyncio.run_coroutine_threadsafe(server.watch(path, 0.01), loop)
+    try:
+        with open(path, 'wb') as f:
+            f.write(b'PK\x03\x04garbage')
+        for _ in range(500):
+            if server.stats()['errors'] > 0:
+                break
+            threading.Event().wait(0.01)
+        assert server.stats()['errors'] > 0 and not watcher.done()
+        assert np.array_equal(server.model.values, solved(0.9).values)
+        save_model(path, solved(0.5))
+        for _ in range(500):
+            if server.version == 2:
+                break
+            threading.Event().wait(0.01)
+        assert np.array_equal(server.model.values, solved(0.5).values)
+    finally:
+        watcher.cancel()
+
+
+def test_watch_reloads_a_replaced_model(tmp_path, loop):
+    path = str(tmp_path / 'model.npz')
+    save_model(path, solved(0.9))
+    server = PolicyServer(load_model(path))
+    watcher = asyncio.run_coroutine_threadsafe(server.watch(path, 0.01), loop)
+    try:
+        save_model(path, solved(0.5))
+        for _ in range(500):
+            if server.version == 2:
+                break
+            threading.Event().wait(0.01)
+        assert server.version == 2
+        assert np.array_equal(server.model.values, solved(0.5).values)
+    finally:
+        watcher.cancel()
+
+
+def test_serve_cancels_its_watcher(tmp_path, loop):
+    path = str(tmp_path / 'model.npz')
+    save_model(path, solved(0.9))
+
+    async def serve_then_cancel():
+        task = asyncio.create_task(policy_server.serve(path, str(tmp_path / 'server.sock'), watch=0.01))
+        while not (tmp_path / 'server.sock').exists():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    assert run(loop, serve_then_cancel()) == []
+
+
+def test_client_raises_when_the_server_closes(tmp_path):
+    path = str(tmp_path / 'closing.sock')
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    client = PolicyClient(path)
+    connection, _ = listener.accept()
+
+    def answer_part_of_the_header():
+        connection.recv(policy_server.HEADER.size + 4)
+        connection.sendall(b'q')
+        connection.close()
+
+    thread = threading.Thread(target=answer_part_of_the_header)
+    thread.start()
+    try:
+        with pytest.raises(ConnectionError):
+            client.query([0])
+        thread.join()
+    finally:
+        client.close()
+        listener.close()
+
+
+def test_model_rejects_mismatched_arrays():
+    with pytest.raises(ValueError):
+        PolicyModel(np.zeros(3), np.zeros(4))
@@ -0,0 +1,59 @@
+import random
+
+import numpy as np
+
+from game_env import ACTIONS, GameEnv
+from q_learning import QLearning
+
+
+# The top right cell is enclosed by walls, it cannot be reached from the start state
+GRID = [[0, 0, 3, 0], [0, 3, 0, 3], [0, 0, 0, 1], [0, 3, 0, 2]]
+
+
+def random_transitions(env, count, seed):
+    rng = random.Random(seed)
+    states = [s for s in env.compact_index()[0].tolist() if env.cells[s] != 3]
+    transitions = []
+    for _ in range(count):
+        state, action = rng.choice(states), rng.choice(ACTIONS)
+        next_states, probabilities = zip(*env.get_possible_next_states(state, action))
+        next_state = rng.choices(next_states, probabilities)[0]
+        transitions.append((state, action, env.get_reward(next_state), next_state))
+    return transitions
+
+
+def test_array_table_matches_the_dict_updates():
+    agent = QLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 1)
+    env = agent.game_env
+    # The updates of the dicts of dicts the Q-values were stored in before the array table
+    q_values = {s: dict.fromkeys(ACTIONS, 0) for s in range(env.num_states)}
+    freq = {s: dict.fromkeys(ACTIONS, 0) for s in range(env.num_states)}
+    policy = dict.fromkeys(range(env.num_states), '')
+    for k, (state, action, reward, next_state) in enumerate(random_transitions(env, 2000, seed=0)):
+        freq[state][action] += 1
+        alpha = agent.start_alpha / freq[state][action]
+        q_values[state][action] += alpha * (reward + agent.gamma * max(q_values[next_state].values()) - q_values[state][action])
+        policy[next_state] = max(q_values[next_state], key=q_values[next_state].get)
+        # Actions given by name or by id
+        agent.update_q_values(state, action if k % 2 else ACTIONS.index(action), reward, next_state)
+        agent.update_policy(next_state)
+
+    unreachable = env.position_to_state((0, 3))
+    assert agent.index[unreachable] == -1
+    for state in range(env.num_states):
+        assert dict(agent.freq[state]) == freq[state]
+        assert np.allclose(list(agent.q_values[state].values()), list(q_values[state].values()), rtol=0, atol=1e-12)
+        assert agent.policy[state] == policy[state]
+    assert agent.policy[unreachable] == '' and set(agent.q_values[unreachable].values()) == {0}
+
+
+def test_views_follow_the_table_during_a_training():
+    agent = QLearning.from_game_env(GameEnv(GRID), 0.9, 0.5, 20, rng=0)
+    q_values, policy = agent.q_values, agent.policy
+    agent.train()
+    assert agent.visits.sum() == agent.stats['steps']
+    for state in range(agent.game_env.num_states):
+        row = agent.index[state]
+        if row >= 0:
+            assert list(q_values[state].values()) == agent.q_table[row].tolist()
+            assert policy[state] == (ACTIONS[agent.policy_ids[row]] if agent.policy_ids[row] >= 0 else '')
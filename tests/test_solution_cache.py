@@ -0,0 +1,50 @@
+import random
+
+import numpy as np
+import pytest
+
+from game_env import GameEnv
+from q_learning import DynaQLearning, QLearning
+from solution_cache import SolutionCache
+from value_iteration import ValueIteration
+
+
+GRID = [[0, 0, 0, 1], [0, 3, 0, 2], [0, 0, 0, 0]]
+
+
+def train(cls, cache, rng=None):
+    agent = cls.from_game_env(GameEnv(GRID), 0.9, 0.5, 20, rng=rng)
+    agent.train(cache=cache)
+    return agent
+
+
+@pytest.mark.parametrize('cls', [QLearning, DynaQLearning])
+def test_q_learning_hit_needs_the_same_seed(tmp_path, cls):
+    cache = SolutionCache(str(tmp_path))
+    first = train(cls, cache, rng=1)
+    assert first.stats['cache'] == 'miss'
+    assert train(cls, cache, rng=2).stats['cache'] == 'warm'
+    again = train(cls, cache, rng=1)
+    assert again.stats['cache'] == 'hit'
+    assert np.array_equal(again.q_table, first.q_table)
+
+
+@pytest.mark.parametrize('cls', [QLearning, DynaQLearning])
+def test_q_learning_hit_needs_the_same_random_module_state(tmp_path, cls):
+    cache = SolutionCache(str(tmp_path))
+    random.seed(3)
+    train(cls, cache)
+    random.seed(4)
+    assert train(cls, cache).stats['cache'] == 'warm'
+    random.seed(3)
+    assert train(cls, cache).stats['cache'] == 'hit'
+
+
+def test_value_iteration_hit(tmp_path):
+    cache = SolutionCache(str(tmp_path))
+    first = ValueIteration.from_game_env(GameEnv(GRID), 0.9, 1e-6)
+    first.value_iteration(cache=cache)
+    again = ValueIteration.from_game_env(GameEnv(GRID), 0.9, 1e-6)
+    again.value_iteration(cache=cache)
+    assert (first.stats['cache'], again.stats['cache']) == ('miss', 'hit')
+    assert again.values == first.values
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import sweep
+from game_env import ACTION_IDS, GameEnv
+from value_iteration import ValueIteration
+
+
+GRID = [[0, 0, 0, 1], [0, 3, 0, 2], [0, 0, 0, 0]]
+
+
+@pytest.fixture
+def settings(tmp_path):
+    path = tmp_path / 'settings.txt'
+    path.write_text('\n'.join(''.join(map(str, row)) for row in GRID) + '\n0.9\n0.5\n30\n')
+    return str(path)
+
+
+def test_optimal_policy_is_the_one_of_value_iteration(settings):
+    ql = sweep.QLearning(settings)
+    vi = ValueIteration.from_game_env(GameEnv(GRID), 0.8, 1e-9)
+    vi.value_iteration()
+    vi.compute_policy()
+    optimal = sweep.optimal_policy(ql, 0.8)
+    for state, action in enumerate(vi.policy):
+        if action:
+            assert optimal[state] == ACTION_IDS[action]
+
+
+def test_pooled_runs_match_inline_runs_and_are_not_run_again(settings, tmp_path):
+    results_path = str(tmp_path / 'results.jsonl')
+    grid = {'start_alpha': [0.5, 0.9], 'gamma': [0.8]}
+    table = sweep.sweep(settings, grid, seeds=[0, 1], path_to_results=results_path, max_workers=2)
+    results = sweep.read_results(results_path)
+    assert len(results) == 4 and len(table) == 2 and all(row['seeds'] == 2 for row in table)
+
+    optimal_policies = {0.8: sweep.optimal_policy(sweep.QLearning(settings), 0.8)}
+    for result in results:
+        config = {name: result[name] for name in sweep.HYPERPARAMETERS}
+        config['nb_episodes'] = None
+        inline = sweep.run(settings, {**config, 'seed': result['seed']}, optimal_policies)
+        assert inline['key'] == result['key']
+        assert (inline['agreement'], inline['episodes_to_convergence']) == (result['agreement'],
+                                                                            result['episodes_to_convergence'])
+
+    # A killed sweep left a cut line, only the missing run is run again
+    lines = open(results_path).read().splitlines()
+    with open(results_path, 'w') as f:
+        f.write('\n'.join(lines[:3]) + '\n' + lines[3][:20])
+    again = sweep.sweep(settings, grid, seeds=[0, 1], path_to_results=results_path, max_workers=2)
+    results = sweep.read_results(results_path)
+    assert len(results) == 4 and sorted(r['key'] for r in results) == sorted(json.loads(line)['key'] for line in lines)
+    agreements = {row['start_alpha']: row['agreement'] for row in table}
+    assert {row['start_alpha']: row['agreement'] for row in again} == agreements
+
+
+def test_unknown_hyperparameter_raises(settings, tmp_path):
+    with pytest.raises(ValueError):
+        sweep.sweep(settings, {'alpha': [0.5]}, seeds=[0], path_to_results=str(tmp_path / 'results.jsonl'))
@@ -0,0 +1,41 @@
+from game_env import GameEnv
+from q_learning import QLearning
+from tracing import TraceWriter, render
+
+
+def test_q_learning_log_keeps_the_integer_zeros(tmp_path):
+    agent = QLearning.from_game_env(GameEnv([[0, 0, 1], [0, 3, 2]]), 0.9, 0.5, 3, rng=0)
+    records, log = str(tmp_path / 'run.jsonl'), str(tmp_path / 'run.txt')
+    with TraceWriter(records, 'full') as writer:
+        agent.train(trace=writer)
+    render(records, log)
+    with open(log, encoding='utf-8') as f:
+        formulas = [line for line in f if line.startswith('Q[')]
+    assert formulas
+    # The Q-values never updated are written as the integer 0, as before the logs were rendered from records
+    lists = [formula.split('max(')[1].split(')')[0] for formula in formulas]
+    assert '[0, 0, 0, 0]' in lists
+    assert not any(value.strip(' []') == '0.0' for values in lists for value in values.split(','))
+
+
+def test_records_hold_the_last_run_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for _ in range(2):
+        QLearning.from_game_env(GameEnv([[0, 0, 1], [0, 3, 2]]), 0.9, 0.5, 3, rng=0).train(trace='summary')
+    with open('log-file_QL.jsonl', encoding='utf-8') as f:
+        assert sum('"type":"start"' in line for line in f) == 1
+    # The log file keeps the rendering of both runs
+    with open('log-file_QL.txt', encoding='utf-8') as f:
+        assert f.read().count('Optimal policy') == 2
+
+
+def test_appending_writer_renders_its_own_records(tmp_path):
+    records, log = str(tmp_path / 'run.jsonl'), str(tmp_path / 'run.txt')
+    for _ in range(2):
+        with TraceWriter(records, 'summary', append=True) as writer:
+            QLearning.from_game_env(GameEnv([[0, 0, 1], [0, 3, 2]]), 0.9, 0.5, 3, rng=0).train(trace=writer)
+        render(records, log, writer.start)
+    with open(records, encoding='utf-8') as f:
+        assert sum('"type":"start"' in line for line in f) == 2
+    with open(log, encoding='utf-8') as f:
+        assert f.read().count('Optimal policy') == 2
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+import maze
+from checkpoint import Checkpointer
+from game_env import GameEnv
+from policy_iteration import PolicyIteration
+from value_iteration import ValueIteration
+
+
+def solve(grid, gamma=0.95, epsilon=1e-6, **kwargs):
+    vi = ValueIteration.from_game_env(GameEnv(grid), gamma, epsilon, **kwargs)
+    vi.value_iteration()
+    return vi
+
+
+@pytest.mark.filterwarnings('error')
+@pytest.mark.parametrize('relaxation', [1.2, 1.5, 1.9])
+def test_sor_converges_on_a_mid_sized_maze(relaxation):
+    # Over-relaxing by 1.5 made the values of this maze diverge until delta was NaN, and the run never returned
+    grid = maze.random_maze(40, 40, 0.3, 6, seed=1)
+    reference = solve(grid)
+    vi = solve(grid, mode='sor', relaxation=relaxation)
+    assert np.allclose(vi.values, reference.values, atol=1e-5)
+    assert vi.stats['relaxation'] in [relaxation, 1.0]
+
+
+def test_sor_default_relaxation_is_kept_on_a_mid_sized_maze():
+    vi = solve(maze.random_maze(40, 40, 0.3, 6, seed=1), mode='sor')
+    assert vi.stats['relaxation'] == vi.relaxation > 1
+
+
+def test_sor_python_engine_falls_back_without_relaxation():
+    grid = maze.random_maze(10, 10, 0.3, 4, seed=1)
+    reference = solve(grid)
+    vi = solve(grid, engine='python', mode='sor', relaxation=1.9)
+    assert vi.stats['relaxation'] == 1.0
+    assert np.allclose(vi.values, reference.values, atol=1e-5)
+
+
+@pytest.mark.parametrize('relaxation', [0, -1, 2, 2.5])
+def test_relaxation_out_of_range_is_rejected(relaxation):
+    with pytest.raises(ValueError):
+        ValueIteration.from_game_env(GameEnv([[0, 1]]), 0.9, 1e-3, mode='sor', relaxation=relaxation)
+
+
+@pytest.mark.filterwarnings('error')
+def test_diverging_values_raise():
+    vi = ValueIteration.from_game_env(GameEnv(maze.random_maze(5, 5, 0.2, 2, seed=0)), 1.5, 1e-3, mode='gauss-seidel')
+    with pytest.raises(ValueError):
+        vi.value_iteration()
+
+
+def test_init_is_part_of_the_run_parameters(tmp_path):
+    grid = maze.random_maze(8, 8, 0.2, 2, seed=0)
+    zeros = ValueIteration.from_game_env(GameEnv(grid), 0.9, 1e-6)
+    distance = ValueIteration.from_game_env(GameEnv(grid), 0.9, 1e-6, init='distance')
+    assert zeros.cache_parameters()['init'] == 'zeros'
+    assert distance.cache_parameters()['init'] == 'distance'
+
+    checkpoint = Checkpointer(str(tmp_path / 'run.ckpt'), every=1, background=False)
+    zeros.value_iteration(checkpoint=checkpoint)
+    with pytest.raises(ValueError):
+        distance.value_iteration(checkpoint=checkpoint, resume=True)
+
+
+def test_python_engine_converges_with_walls_surrounded_by_walls():
+    # The unreachable regions of random mazes are filled with walls, whose value is -inf then NaN
+    grid = maze.random_maze(8, 10, 0.2, 4, seed=2)
+    reference = solve(grid)
+    vi = solve(grid, engine='python')
+    values, expected = np.array(vi.values), np.array(reference.values)
+    reachable = GameEnv(grid).compact_index()[0]
+    assert np.allclose(values[reachable], expected[reachable], atol=1e-5)
+
+
+@pytest.mark.parametrize('size, gamma', [(60, 0.99), (80, 0.999)])
+def test_multigrid_converges_to_the_optimal_values(size, gamma):
+    grid = maze.random_maze(size, size, 0.25, 6, seed=1)
+    vi = solve(grid, gamma, 1e-4, mode='multigrid')
+    # Exact policy iteration gives the values of an optimal policy up to the precision of the linear solves
+    reference = PolicyIteration.from_game_env(GameEnv(grid), gamma, 1e-9)
+    reference.policy_iteration()
+    reachable = GameEnv(grid).compact_index()[0]
+    values, expected = np.array(vi.values)[reachable], np.array(reference.values)[reachable]
+    finite = np.isfinite(expected)
+    assert vi.stats['error_bound'] < vi.epsilon
+    assert np.abs(values[finite] - expected[finite]).max() <= vi.stats['error_bound'] + 1e-6
+    # The levels go from the grid to a coarsest one of about 1000 states
+    states = [level['states'] for level in vi.stats['levels']]
+    assert len(states) > 1 and states == sorted(states, reverse=True) and states[-1] <= 2000
+
+
+def test_multigrid_needs_gamma_below_1():
+    with pytest.raises(ValueError):
+        ValueIteration.from_game_env(GameEnv([[0, 1]]), 1, 1e-3, mode='multigrid')
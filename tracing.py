@@ -0,0 +1,306 @@
+import json
+import queue
+import threading
+
+from game_env import ACTIONS, GameEnv
+
+
+# 'summary' writes one record per iteration or episode, 'full' also writes one record per backup or step
+LEVELS = ['none', 'summary', 'full']
+ARROWS = {'up': '↑', 'down': '↓', 'left': '←', 'right': '→'}
+
+
+class TraceWriter:
+    def __init__(self, path, level='full', background=False, buffer_size=1 << 20, append=False):
+        """
+        Writes the trace records of a solver, one JSON object per line, through a single buffered file.
+        :param path: path to the records file (str)
+        :param level: 'none', 'summary' or 'full' (str)
+        :param background: serialize and write the records on a background thread (bool)
+        :param buffer_size: size of the write buffer in bytes (int)
+        :param append: keep the records already in the file and write after them, instead of truncating it (bool)
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown trace level '{level}', expected one of {LEVELS}")
+        self.path = path
+        self.level = level
+        self.full = level == 'full'
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8', buffering=buffer_size)
+        # Position of the first record of this writer, to render only its records
+        self.start = self.file.tell()
+        self.queue = None
+        if background:
+            self.queue = queue.SimpleQueue()
+            self.thread = threading.Thread(target=self.drain, daemon=True)
+            self.thread.start()
+
+
+    def write(self, record):
+        """
+        Write a record.
+        :param record: record (dict)
+        """
+        if self.queue is not None:
+            self.queue.put(record)
+        else:
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+    def drain(self):
+        """
+        Write the records of the queue until the writer is closed. Runs on the background thread.
+        """
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+    def close(self):
+        """
+        Write the pending records and close the file.
+        """
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+        self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_trace(trace, log_file):
+    """
+    Get the writer of a traced run.
+    :param trace: False or 'none' not to trace, True or 'full' to trace every backup or step, 'summary' to trace
+                  every iteration or episode, or a TraceWriter object owned by the caller
+    :param log_file: path to the human-readable log file of the solver, the records are written next to it (str)
+    :return: writer (TraceWriter or None), True if the writer must be closed and rendered by the solver (bool)
+    """
+    if isinstance(trace, TraceWriter):
+        return trace, False
+    level = {False: 'none', True: 'full'}.get(trace, trace)
+    if level == 'none':
+        return None, False
+    return TraceWriter(records_path(log_file), level), True
+
+
+def close_trace(writer, owned, log_file):
+    """
+    Close the writer of a traced run opened by open_trace and append the rendering of its records to the log file.
+    :param writer: writer (TraceWriter or None)
+    :param owned: True if the writer was opened by the solver (bool)
+    :param log_file: path to the human-readable log file (str)
+    """
+    if writer is None or not owned:
+        return
+    writer.close()
+    render(writer.path, log_file, writer.start)
+
+
+def records_path(log_file):
+    """
+    :param log_file: path to a human-readable log file, e.g. 'log-file_VI.txt' (str)
+    :return: path to the records it is rendered from, e.g. 'log-file_VI.jsonl' (str)
+    """
+    return log_file.rsplit('.', 1)[0] + '.jsonl'
+
+
+def grid_rows(game_env):
+    """
+    :param game_env: GameEnv object
+    :return: rows of the grid as strings of cell codes, as in the settings files (list of str)
+    """
+    return [''.join(str(int(c)) for c in row) for row in game_env.grid]
+
+
+def render(path_to_records, path_to_log, start=0):
+    """
+    Append the human-readable rendering of trace records to a log file.
+    :param path_to_records: path to the records file (str)
+    :param path_to_log: path to the log file (str)
+    :param start: position in the records file of the first record to render (int)
+    """
+    with open(path_to_records, 'r', encoding='utf-8') as records, open(path_to_log, 'a', encoding='utf-8') as f:
+        records.seek(start)
+        renderer = Renderer(f)
+        for line in records:
+            renderer.render(json.loads(line))
+
+
+class Renderer:
+    def __init__(self, f):
+        """
+        Renders trace records in the format of the log files.
+        :param f: log file (file object)
+        """
+        self.f = f
+        self.game_env = None
+        self.episode = None
+
+
+    def render(self, record):
+        """
+        Render a record.
+        :param record: record (dict)
+        """
+        getattr(self, 'render_' + record['type'])(record)
+
+
+    def render_start(self, record):
+        self.solver = record['solver']
+        self.game_env = GameEnv([[int(c) for c in row] for row in record['grid']])
+        self.gamma = record['gamma']
+        if self.solver == 'q_learning':
+            self.start_alpha = record['start_alpha']
+            # Q-values never updated are the integer 0, as in the log files written before the records
+            self.q_values = [[0] * len(ACTIONS) for _ in range(self.game_env.num_states)]
+            self.freq = [[0] * len(ACTIONS) for _ in range(self.game_env.num_states)]
+        else:
+            # The values are only recorded at the 'full' level
+            self.old_values = record.get('values')
+            self.values = list(self.old_values) if self.old_values is not None else None
+
+
+    def render_sweep(self, record):
+        self.f.write('\n' + '=' * 50 + '\n\n')
+        self.f.write(f'Iteration {record["iteration"]}\n\n')
+
+
+    def render_backup(self, record):
+        env = self.game_env
+        state = record['state']
+        self.f.write(f'U[{state}] = max(')
+        for action in ACTIONS:
+            next_states = env.get_possible_next_states(state, action)
+            for next_state, probability in next_states:
+                self.f.write(f'{probability} * [{env.get_reward(next_state)} + {self.gamma} * {self.old_values[next_state]}]')
+                if next_state != next_states[-1][0]:
+                    self.f.write(' + ')
+            if action != 'right':
+                self.f.write(', ')
+        self.f.write(')\n')
+        self.f.write(f'     = {record["value"]:.5f}\n')
+        self.values[state] = record['value']
+
+
+    def render_iteration(self, record):
+        if self.values is None:
+            self.f.write('\n' + '=' * 50 + '\n\n')
+            self.f.write(f'Iteration {record["iteration"]}\n\n')
+            self.f.write(f'delta: {record["delta"]:.8f}\n')
+        else:
+            self.f.write('\nUpdated values:\n\n')
+            self.write_values(self.values)
+            self.old_values = list(self.values)
+            self.f.write(f'\n\ndelta: {record["delta"]:.8f}\n')
+
+
+    def render_converged(self, record):
+        self.f.write('\ndelta < epsilon, algorithm converged\n')
+
+
+    def render_cached(self, record):
+        self.f.write('\nsolution loaded from the cache\n')
+
+
+    def render_evaluation(self, record):
+        self.f.write('\n' + '=' * 50 + '\n\n')
+        self.f.write(f'Iteration {record["iteration"]}\n\n')
+        if 'values' in record:
+            self.f.write('Values of the current policy:\n\n')
+            self.write_values(record['values'])
+            self.f.write('\n')
+        self.f.write(f'\ndelta: {record["delta"]:.8f}, changed actions: {record["changed"]}\n')
+
+
+    def render_stable(self, record):
+        self.f.write('\npolicy stable, algorithm converged\n')
+
+
+    def render_episode(self, record):
+        # The steps of this episode are traced, its summary is not rendered
+        self.episode = record['episode']
+        self.f.write('=' * 100 + '\n')
+        self.f.write('=' * 100 + '\n\n')
+        self.f.write(f'Episode: {record["episode"]}\n\n')
+        self.f.write('=' * 100 + '\n')
+        self.f.write('=' * 100 + '\n\n')
+
+
+    def render_step(self, record):
+        env = self.game_env
+        state, action, reward, next_state = record['state'], ACTIONS[record['action']], record['reward'], record['next']
+        self.freq[state][record['action']] += 1
+        self.q_values[state][record['action']] = record['q']
+        self.f.write('=' * 100 + '\n\n')
+        self.f.write(f'Episode: {record["episode"]}, State: {state}, Action: {action}, Reward: {reward}, Next state: {next_state}, N[{state}][{action}] = {self.freq[state][record["action"]]}\n\n')
+        self.f.write(f'Q[{state}][{action}] = Q[{state}][{action}] + ({self.start_alpha} / N[{state}][{action}]) * ({reward} + {self.gamma} * max({self.q_values[next_state]}) - Q[{state}][{action}])\n\n')
+        self.f.write('Updated Q-values:\n\n')
+        for i in range(env.num_rows):
+            for actions in [['up', 'down'], ['left', 'right']]:
+                for j in range(env.num_cols):
+                    if env.grid[i][j] == 3:
+                        self.f.write('#' * 17 + ' ')
+                    else:
+                        for a in actions:
+                            self.f.write(f'{ARROWS[a]}:{self.q_values[env.position_to_state((i, j))][ACTIONS.index(a)]:^6.2f} ')
+                    if j < env.num_cols - 1:
+                        self.f.write('| ')
+                self.f.write('\n')
+            if i < env.num_rows - 1:
+                self.f.write('-' * 19 * env.num_cols + '\n')
+        self.f.write('\n')
+
+
+    def render_episode_end(self, record):
+        if self.episode == record['episode']:
+            return
+        self.f.write(f'Episode: {record["episode"]}, steps: {record["steps"]}, return: {record["return"]:.5f}\n')
+
+
+    def render_policy(self, record):
+        game_env = GameEnv([[int(c) for c in row] for row in record['grid']])
+        if record['solver'] == 'q_learning':
+            self.f.write('=' * 100 + '\n\n')
+        else:
+            self.f.write('\n' + '=' * 50 + '\n\n')
+        self.f.write('Optimal policy\n\n')
+        for i in range(game_env.num_rows):
+            for j in range(game_env.num_cols):
+                action = record['policy'][game_env.position_to_state((i, j))]
+                if game_env.grid[i][j] == 3:
+                    self.f.write('# ')
+                elif action in ARROWS:
+                    self.f.write(ARROWS[action] + ' ')
+                elif action == '':
+                    # Unreachable or unvisited state
+                    self.f.write('  ')
+                else:
+                    raise ValueError('Invalid action')
+            self.f.write('\n')
+
+
+    def write_values(self, values):
+        """
+        Write a grid of values.
+        :param values: value of each state (list of float)
+        """
+        env = self.game_env
+        for i in range(env.num_rows):
+            for j in range(env.num_cols):
+                if env.grid[i][j] == 3:
+                    self.f.write('#' * 6)
+                else:
+                    self.f.write(f'{values[i * env.num_cols + j]:^6.2f}')
+                if j < env.num_cols - 1:
+                    self.f.write('|')
+            if i < env.num_rows - 1:
+                self.f.write('\n' + '-' * 7 * env.num_cols + '\n')
@@ -1,19 +1,107 @@
-from game_env import GameEnv
+import heapq
+import math
+import time
+
+import numpy as np
+
+from binary_map import is_binary_map, read_map
+from checkpoint import check_run
+from game_env import ACTION_IDS, ACTIONS, GameEnv
+from metrics import Metrics
+from multigrid import bellman_backup, build_levels, error_bound, evaluate_policy
+from tracing import close_trace, grid_rows, open_trace
+
+
+ENGINES = ['python', 'numpy']
+MODES = ['jacobi', 'gauss-seidel', 'sor', 'prioritized', 'multigrid']
+INITS = ['zeros', 'distance']
+# The 'sor' mode gives up over-relaxing when a value gets this many times larger than any value a policy can have
+DIVERGENCE_FACTOR = 10
 
 
 class ValueIteration:
-    def __init__(self, path_to_settings):
-        self.game_env, self.gamma, self.epsilon = self.parse_settings_file(path_to_settings)
-        self.values = [0 for _ in range(self.game_env.num_cols * self.game_env.num_rows)]
+    # File the traces are appended to, and name of the solver in the trace records
+    log_file = 'log-file_VI.txt'
+    solver_name = 'value_iteration'
+
+    def __init__(self, path_to_settings, engine='numpy', mode='jacobi', relaxation=1.2, init='zeros'):
+        """
+        :param path_to_settings: path to the settings file (str)
+        :param engine: 'numpy' to run the sweeps as sparse matrix products, 'python' to run them state by state.
+                       Traced runs always use the 'python' engine since they log every backup.
+        :param mode: 'jacobi' to compute each sweep from the values of the previous one, 'gauss-seidel' to update
+                     the values in place, 'sor' to update them in place with successive over-relaxation,
+                     'prioritized' to back up the states with the largest Bellman residual first,
+                     'multigrid' to solve coarsened versions of the grid first (see multigrid.py)
+        :param relaxation: over-relaxation factor of the 'sor' mode (float, between 0 and 2). Over-relaxing a max
+                           is not guaranteed to converge: when the values diverge, the run starts over with a factor of 1
+        :param init: 'zeros' to start from values of 0, 'distance' to start from values estimated from the distances
+                     to the rewards and the ghosts (see GameEnv.heuristic_values, needs gamma below 1)
+        """
+        game_env, gamma, epsilon = self.parse_settings_file(path_to_settings)
+        self.setup(game_env, gamma, epsilon, engine, mode, relaxation, init)
+
+
+    @classmethod
+    def from_game_env(cls, game_env, gamma, epsilon, **kwargs):
+        """
+        Create a solver for an existing GameEnv object instead of reading a settings file.
+        :param game_env: GameEnv object
+        :param gamma: discount factor (float)
+        :param epsilon: convergence threshold (float)
+        :param kwargs: other arguments of the constructor
+        :return: solver
+        """
+        solver = cls.__new__(cls)
+        solver.setup(game_env, gamma, epsilon, **kwargs)
+        return solver
+
+
+    def setup(self, game_env, gamma, epsilon, engine='numpy', mode='jacobi', relaxation=1.2, init='zeros'):
+        """
+        Initialize the solver, see the constructor for the parameters.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}', expected one of {MODES}")
+        if mode == 'multigrid' and not gamma < 1:
+            raise ValueError(f"The 'multigrid' mode needs gamma below 1, got {gamma}")
+        if init not in INITS:
+            raise ValueError(f"Unknown init '{init}', expected one of {INITS}")
+        if not 0 < relaxation < 2:
+            raise ValueError(f'relaxation should be in (0, 2), got {relaxation}')
+        self.engine = engine
+        self.mode = mode
+        self.relaxation = relaxation
+        self.init = init
+        # Number of iterations and of Bellman backups of the last run of value_iteration
+        self.stats = {}
+        # Metrics updated by the runs, see instrument
+        self.metrics = None
+        self.game_env, self.gamma, self.epsilon = game_env, gamma, epsilon
+        if init == 'distance':
+            self.values = self.game_env.heuristic_values(gamma).tolist()
+        else:
+            self.values = [0 for _ in range(self.game_env.num_cols * self.game_env.num_rows)]
         self.policy = ['' for _ in range(self.game_env.num_cols * self.game_env.num_rows)]
 
 
     def parse_settings_file(self, path_to_settings):
         """
         Parses the settings file and create a GameEnv object.
+        The settings file can also be a binary map (see binary_map.py), whose grid is memory-mapped.
         :param path_to_settings: path to the settings file (str)
         :return: GameEnv object, gamma, epsilon
         """
+        if is_binary_map(path_to_settings):
+            grid, parameters = read_map(path_to_settings)
+            missing = {'gamma', 'epsilon'} - set(parameters)
+            if missing:
+                raise ValueError(f'{path_to_settings} is not a map of value_iteration, it has no {sorted(missing)}')
+            env = GameEnv(grid)
+            return env, parameters['gamma'], parameters['epsilon']
+
         with open(path_to_settings, 'r') as f:
             settings = f.readlines()
         settings = [x.strip() for x in settings]
@@ -25,85 +113,645 @@ class ValueIteration:
         return env, gamma, epsilon
 
 
-    def value_iteration(self, trace=False, verbose=False):
+    def value_iteration(self, trace=False, verbose=False, cache=None, checkpoint=None, resume=False):
         """
         Runs the value iteration algorithm and stores the values for each state in self.values.
-        :param trace: (bool) if True, write the values to the file 'log-file_VI.txt' after each iteration
+        :param trace: (bool or str) if True or 'full', write the values and their computation to the file 'log-file_VI.txt'
+                      after each iteration, if 'summary', only write the delta of each iteration. The records of the trace
+                      are written to 'log-file_VI.jsonl' and rendered at the end of the run.
+                      A TraceWriter object can also be given, its records are then left to the caller to render.
         :param verbose: (bool) if True, print the values to the console after each iteration
+        :param cache: (SolutionCache) if set, load the values and the policy from the cache when this map has already
+                      been solved with the same parameters, else start from the closest cached solution and store the
+                      new one. self.stats['cache'] tells whether it was a 'hit', a 'warm' start or a 'miss'.
+        :param checkpoint: (Checkpointer) if set, write the values to it periodically and once converged.
+                           Not available in the 'prioritized' and 'multigrid' modes.
+        :param resume: (bool) if True, continue from the values and the iteration of the last checkpoint, which must
+                       come from the same map and parameters
         """
-        c = 0
+        if checkpoint is not None and self.mode in ['prioritized', 'multigrid']:
+            raise ValueError(f"The '{self.mode}' mode cannot be checkpointed")
+        writer, owned = open_trace(trace, self.log_file)
+        if writer is not None and writer.full and self.mode != 'jacobi':
+            raise ValueError(f"Only the 'jacobi' mode can be traced at the 'full' level, not '{self.mode}'")
+        warm = None
+        if cache is not None:
+            parameters = self.cache_parameters()
+            key = cache.key(self.solver_name, self.game_env.model_hash(), parameters)
+            hit = cache.get(key)
+            if hit is not None:
+                arrays, entry = hit
+                self.values = arrays['values'].tolist()
+                self.policy = [(ACTIONS + [''])[a] for a in arrays['policy'].tolist()]
+                self.stats = {**entry['stats'], 'cache': 'hit'}
+                if writer is not None:
+                    writer.write({'type': 'start', 'solver': 'value_iteration', 'grid': grid_rows(self.game_env), 'gamma': self.gamma})
+                    writer.write({'type': 'cached', **self.stats})
+                close_trace(writer, owned, self.log_file)
+                return
+            warm = cache.closest(self.solver_name, self.game_env, parameters)
+            if warm is not None:
+                # The states that cannot be reached here start from 0 as in a cold start, and the walls of the
+                # cached map can have infinite or undefined values
+                _, index = self.game_env.compact_index()
+                values = np.where(index >= 0, warm[0]['values'], 0.0)
+                self.values = np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0).tolist()
+        first_iteration = 0
+        finished = None
+        if resume and checkpoint is not None:
+            loaded = checkpoint.load()
+            if loaded is not None:
+                arrays, state = loaded
+                check_run(state, self.solver_name, self.game_env, self.cache_parameters())
+                self.values = arrays['values'].tolist()
+                first_iteration = state['iteration']
+                finished = state.get('stats')
+        if writer is not None:
+            record = {'type': 'start', 'solver': 'value_iteration', 'grid': grid_rows(self.game_env), 'gamma': self.gamma}
+            if writer.full:
+                record['values'] = list(self.values)
+            writer.write(record)
+
+        if self.metrics is not None:
+            self.iteration_start = time.perf_counter()
+        if finished is not None:
+            # The checkpoint was written once converged
+            self.stats = dict(finished)
+        elif self.mode == 'prioritized':
+            self.prioritized_sweeping(verbose, writer)
+        elif self.mode == 'multigrid':
+            self.multigrid_value_iteration(verbose, writer)
+        elif self.mode in ['gauss-seidel', 'sor']:
+            self.in_place_value_iteration(verbose, writer, checkpoint, first_iteration)
+        elif self.engine == 'numpy' and (writer is None or not writer.full):
+            self.vectorized_value_iteration(verbose, writer, checkpoint, first_iteration)
+        else:
+            self.python_value_iteration(verbose, writer, checkpoint, first_iteration)
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint, self.stats['iterations'], self.values, self.stats)
+            checkpoint.wait()
+
+        if cache is not None:
+            self.compute_policy()
+            policy = np.array([ACTION_IDS.get(action, -1) for action in self.policy], dtype=np.int8)
+            cache.put(key, {'values': np.asarray(self.values, dtype=float), 'policy': policy},
+                      self.solver_name, self.game_env, parameters, self.stats)
+            self.stats['cache'] = 'miss' if warm is None else 'warm'
+        if writer is not None:
+            writer.write({'type': 'converged', **self.stats})
+        close_trace(writer, owned, self.log_file)
+
+
+    def cache_parameters(self):
+        """
+        :return: parameters the solution depends on, see SolutionCache (dict)
+        """
+        return {'gamma': self.gamma, 'epsilon': self.epsilon, 'engine': self.engine, 'mode': self.mode,
+                'relaxation': self.relaxation if self.mode == 'sor' else None, 'init': self.init}
+
+
+    def save_checkpoint(self, checkpoint, iteration, values, stats=None):
+        """
+        Write the values reached after an iteration to a checkpoint.
+        :param checkpoint: Checkpointer
+        :param iteration: number of iterations done (int)
+        :param values: values of every state (list or np.ndarray)
+        :param stats: statistics of the run once converged, None before (dict)
+        """
+        state = {'solver': self.solver_name, 'model': self.game_env.model_hash(),
+                 'parameters': self.cache_parameters(), 'iteration': iteration}
+        if stats is not None:
+            state['stats'] = stats
+        checkpoint.save({'values': np.array(values, dtype=float)}, state)
+
+
+    def python_value_iteration(self, verbose=False, writer=None, checkpoint=None, first_iteration=0):
+        """
+        Runs the value iteration algorithm state by state and stores the values for each state in self.values.
+        :param verbose: (bool) if True, print the values to the console after each iteration
+        :param writer: (TraceWriter) writer of the trace, None not to trace
+        :param checkpoint: (Checkpointer) writer of the checkpoints, None not to write any
+        :param first_iteration: (int) number of iterations done before, when resuming from a checkpoint
+        """
+        full = writer is not None and writer.full
+        c = first_iteration
         delta = 0
         while True:
             c += 1
             delta = 0
 
-            if trace:
-                f = open('log-file_VI.txt', 'a', encoding='utf-8')
-                f.write('\n' + '=' * 50 + '\n\n')
-                f.write(f'Iteration {c}\n\n')
+            if full:
+                writer.write({'type': 'sweep', 'iteration': c})
             if verbose:
                 self.print_values(c, delta)
             
             old_values = self.values.copy()
             for state in range(self.game_env.num_cols * self.game_env.num_rows):
-
-                if trace:
-                    f.write(f'U[{state}] = max(')
-                
                 max_v = float('-inf')
                 for action in ['up', 'down', 'left', 'right']:
                     next_states = self.game_env.get_possible_next_states(state, action)
                     action_v = 0
                     for next_state, probability in next_states:
-
-                        if trace:
-                            f.write(f'{probability} * [{self.game_env.get_reward(next_state)} + {self.gamma} * {old_values[next_state]}]')
-                            if next_state != next_states[-1][0]:
-                                f.write(' + ')
-                        
                         action_v += probability * (self.game_env.get_reward(next_state) + self.gamma * old_values[next_state])
-                    
-                    if trace:
-                        if action != 'right':
-                            f.write(', ')
-
                     max_v = max(max_v, action_v)
                 self.values[state] = max_v
 
-                if trace:
-                    f.write(')\n')
-                    f.write(f'     = {max_v:.5f}\n')
+                if full:
+                    writer.write({'type': 'backup', 'state': state, 'value': max_v})
 
-                delta += abs(old_values[state] - self.values[state])
+                diff = abs(old_values[state] - self.values[state])
+                # Walls surrounded by walls have no value, they must not prevent the convergence
+                if math.isfinite(diff):
+                    delta += diff
             
-            if trace:
-                f.write('\nUpdated values:\n\n')
-                for i in range(self.game_env.num_rows):
-                    for j in range(self.game_env.num_cols):
-                        if self.game_env.grid[i][j] == 3:
-                            f.write('#' * 6)
-                        else:
-                            f.write(f'{self.values[i * self.game_env.num_cols + j]:^6.2f}')
-                        if j < self.game_env.num_cols - 1:
-                            f.write('|')
-                    if i < self.game_env.num_rows - 1:
-                        f.write('\n' + '-' * 7 * self.game_env.num_cols + '\n')
-                f.write(f'\n\ndelta: {delta:.8f}\n')
+            if writer is not None:
+                writer.write({'type': 'iteration', 'iteration': c, 'delta': delta})
+            if self.metrics is not None:
+                self.record_iteration(delta, self.game_env.num_states)
             
             if delta < self.epsilon:
                 break
+            if checkpoint is not None and checkpoint.due(c):
+                self.save_checkpoint(checkpoint, c, self.values)
         
-        if trace:
-            f.write('\ndelta < epsilon, algorithm converged\n')
-            f.close()
+        self.stats = {'mode': self.mode, 'iterations': c, 'backups': c * self.game_env.num_states}
+
+
+    def instrument(self, metrics, hot_paths=False):
+        """
+        Update a Metrics object during the next runs: the number of iterations and of Bellman backups, the time
+        of each sweep ('sweep' timer) and the delta of each iteration ('delta' series).
+        :param metrics: Metrics object, None to stop updating it
+        :param hot_paths: also time every call to the methods of the environment backing up a state one by one,
+                          slows down the 'python' engine (bool)
+        """
+        Metrics.restore(self.game_env, 'get_possible_next_states', 'get_reward')
+        if metrics is not None and hot_paths:
+            metrics.instrument(self.game_env, 'get_possible_next_states', 'get_reward')
+        self.metrics = metrics
+
+
+    def record_iteration(self, delta, backups, iterations=1):
+        """
+        Add iterations to the metrics.
+        :param delta: delta of the last iteration (float)
+        :param backups: number of Bellman backups of the iterations (int)
+        :param iterations: number of iterations (int)
+        """
+        now = time.perf_counter()
+        self.metrics.add_time('sweep', now - self.iteration_start, iterations)
+        self.iteration_start = now
+        self.metrics.count('iterations', iterations)
+        self.metrics.count('backups', backups)
+        self.metrics.observe('delta', float(delta))
+
+
+    def q_array(self, values, compact=False):
+        """
+        Computes the value of every state-action pair with a single sparse matrix product.
+        Actions bumping into a wall from a wall cell have no value, they are set to -inf so that they are never picked.
+        :param values: values of the states (np.ndarray of shape (num_states,))
+        :param compact: the values, and the Q-values, are those of the reachable states only (see GameEnv.compact_index)
+        :return: Q-values (np.ndarray of shape (num_states, 4), the columns following the order of ACTIONS)
+        """
+        transitions, rewards = self.game_env.compact_model() if compact else (self.game_env.transitions, self.game_env.rewards)
+        q = (transitions @ (rewards + self.gamma * values)).reshape(-1, len(ACTIONS))
+        q[np.isnan(q)] = float('-inf')
+        return q
+
+
+    def vectorized_value_iteration(self, verbose=False, writer=None, checkpoint=None, first_iteration=0):
+        """
+        Runs the value iteration algorithm with synchronous sweeps computed as array operations
+        and stores the values for each state in self.values. Only the reachable states are backed up,
+        the values of the other states are left unchanged.
+        :param verbose: (bool) if True, print the values to the console after each iteration
+        :param writer: (TraceWriter) writer of the trace summary, None not to trace
+        :param checkpoint: (Checkpointer) writer of the checkpoints, None not to write any
+        :param first_iteration: (int) number of iterations done before, when resuming from a checkpoint
+        """
+        states, _ = self.game_env.compact_index()
+        all_values = np.asarray(self.values, dtype=float)
+        values = all_values[states]
+        c = first_iteration
+        delta = 0
+        while True:
+            c += 1
+            delta = 0
+            if verbose:
+                all_values[states] = values
+                self.values = all_values
+                self.print_values(c, delta)
+
+            new_values = self.q_array(values, compact=True).max(axis=1)
+            with np.errstate(invalid='ignore'):
+                diff = np.abs(values - new_values)
+            # Walls surrounded by walls have no value, they must not prevent the convergence
+            delta = diff[np.isfinite(diff)].sum()
+            values = new_values
+            if writer is not None:
+                writer.write({'type': 'iteration', 'iteration': c, 'delta': float(delta)})
+            if self.metrics is not None:
+                self.record_iteration(delta, len(states))
+
+            if delta < self.epsilon:
+                break
+            if checkpoint is not None and checkpoint.due(c):
+                all_values[states] = values
+                self.save_checkpoint(checkpoint, c, all_values)
+
+        all_values[states] = values
+        self.values = all_values.tolist()
+        self.stats = {'mode': self.mode, 'iterations': c, 'backups': c * len(states)}
+
+
+    def in_place_value_iteration(self, verbose=False, writer=None, checkpoint=None, first_iteration=0):
+        """
+        Runs the value iteration algorithm updating the values in place (Gauss-Seidel), with successive
+        over-relaxation in the 'sor' mode, and stores the values for each state in self.values.
+        Only the reachable states that are not walls are backed up. With the 'numpy' engine, the grid is swept in
+        red-black order: a move always changes the color of the cell, so all the cells of one color are backed up at once.
+        Over-relaxation can make the values diverge: when delta is not finite or a value leaves the range of the values
+        of the policies, the run starts over from the initial values without relaxation. self.stats['relaxation'] is
+        the factor the run converged with.
+        :param verbose: (bool) if True, print the values to the console after each iteration
+        :param writer: (TraceWriter) writer of the trace summary, None not to trace
+        :param checkpoint: (Checkpointer) writer of the checkpoints, None not to write any
+        :param first_iteration: (int) number of iterations done before, when resuming from a checkpoint
+        """
+        factor = self.relaxation if self.mode == 'sor' else 1.0
+        env = self.game_env
+        reachable, _ = env.compact_index()
+        # Position in reachable of the states backed up (the start state can be a wall)
+        backed_up = np.flatnonzero(np.frombuffer(env.cells, dtype=np.uint8)[reachable] != 3)
+        states = reachable[backed_up]
+        if self.engine == 'numpy':
+            all_values = np.asarray(self.values, dtype=float)
+            values = all_values[reachable]
+            compact_transitions, rewards = env.compact_model()
+            colors = (states // env.num_cols + states % env.num_cols) % 2
+            groups = []
+            for color in [0, 1]:
+                group = backed_up[colors == color]
+                rows = (group[:, np.newaxis] * len(ACTIONS) + np.arange(len(ACTIONS))).ravel()
+                groups.append((group, compact_transitions[rows]))
+        else:
+            values = [float(v) for v in self.values]
+        initial = values.copy()
+        # Largest absolute value a policy can have, none when gamma is 1
+        limit = None
+        if self.gamma < 1:
+            rewards_bound = np.nanmax(np.abs(env.rewards)) / (1 - self.gamma)
+            limit = DIVERGENCE_FACTOR * max(rewards_bound, max((abs(v) for v in initial), default=0.0))
+
+        c = first_iteration
+        delta = 0
+        while True:
+            c += 1
+            delta = 0
+            largest = 0.0
+            if verbose:
+                if self.engine == 'numpy':
+                    all_values[reachable] = values
+                    self.values = all_values
+                else:
+                    self.values = values
+                self.print_values(c, delta)
+
+            if self.engine == 'numpy':
+                # Diverging values overflow to inf then NaN, which is detected once the sweep is done
+                with np.errstate(over='ignore', invalid='ignore'):
+                    for group, transitions in groups:
+                        best = (transitions @ (rewards + self.gamma * values)).reshape(-1, len(ACTIONS)).max(axis=1)
+                        change = factor * (best - values[group])
+                        values[group] += change
+                        delta += np.abs(change).sum()
+                    largest = np.abs(values).max()
+            else:
+                for state in states.tolist():
+                    max_v = float('-inf')
+                    for action in ACTIONS:
+                        action_v = 0
+                        for next_state, probability in env.get_possible_next_states(state, action):
+                            action_v += probability * (env.get_reward(next_state) + self.gamma * values[next_state])
+                        max_v = max(max_v, action_v)
+                    change = factor * (max_v - values[state])
+                    values[state] += change
+                    delta += abs(change)
+                    largest = max(largest, abs(values[state]))
+
+            if writer is not None:
+                writer.write({'type': 'iteration', 'iteration': c, 'delta': float(delta)})
+            if self.metrics is not None:
+                self.record_iteration(delta, len(states))
+            if not math.isfinite(delta) or (limit is not None and largest > limit):
+                if factor == 1.0:
+                    raise ValueError(f'The values diverge after {c} iterations, gamma={self.gamma} may be too large')
+                factor = 1.0
+                values = initial.copy()
+                continue
+            if delta < self.epsilon:
+                break
+            if checkpoint is not None and checkpoint.due(c):
+                if self.engine == 'numpy':
+                    all_values[reachable] = values
+                    self.save_checkpoint(checkpoint, c, all_values)
+                else:
+                    self.save_checkpoint(checkpoint, c, values)
+
+        if self.engine == 'numpy':
+            all_values[reachable] = values
+            values = all_values.tolist()
+        self.values = values
+        self.stats = {'mode': self.mode, 'iterations': c, 'backups': c * len(states), 'relaxation': factor}
+
+
+    def prioritized_sweeping(self, verbose=False, writer=None):
+        """
+        Runs the value iteration algorithm with prioritized sweeping and stores the values for each state in self.values.
+        The states are kept in a heap ordered by their Bellman residual: the state with the largest residual is updated,
+        then only its predecessors are backed up again to refresh their residuals. The algorithm stops when the sum
+        of the residuals, which is the delta the next Jacobi sweep would have, is below epsilon.
+        Every update backs up all the predecessors of the state, so a full solve needs more backups than a Jacobi one:
+        this mode pays off when only a few states are far from their values, as after update_cells.
+        Here an iteration is the update of a single state. Walls and unreachable states are never backed up.
+        :param verbose: (bool) if True, print the values to the console once converged
+        :param writer: (TraceWriter) writer of the trace summary, None not to trace
+        """
+        env = self.game_env
+        indptr = env.indptr.tolist()
+        next_states = env.next_states.tolist()
+        probs = env.probs.tolist()
+        rewards = env.rewards.tolist()
+        pred_indptr, pred_states = env.predecessor_index()
+        pred_indptr = pred_indptr.tolist()
+        pred_states = pred_states.tolist()
+        _, index = env.compact_index()
+        skipped = ((np.frombuffer(env.cells, dtype=np.uint8) == 3) | (index < 0)).tolist()
+        values = [float(v) for v in self.values]
+        gamma = self.gamma
+
+        def backup(state):
+            max_v = float('-inf')
+            for k in range(state * 4, state * 4 + 4):
+                action_v = 0
+                for j in range(indptr[k], indptr[k + 1]):
+                    action_v += probs[j] * (rewards[next_states[j]] + gamma * values[next_states[j]])
+                max_v = max(max_v, action_v)
+            return max_v
+
+        # targets[s] is the backed up value of s, it is refreshed every time one of the successors of s changes
+        targets = [0.0] * env.num_states
+        residuals = [0.0] * env.num_states
+        heap = []
+        backups = 0
+        for state in range(env.num_states):
+            if skipped[state]:
+                continue
+            targets[state] = backup(state)
+            residuals[state] = abs(targets[state] - values[state])
+            backups += 1
+            if residuals[state] > 0:
+                heap.append((-residuals[state], state))
+        heapq.heapify(heap)
+        total = math.fsum(residuals)
+
+        c = 0
+        while heap:
+            if total < self.epsilon:
+                # Recompute the sum to get rid of the rounding errors accumulated by the updates
+                total = math.fsum(residuals)
+                if total < self.epsilon:
+                    break
+            priority, state = heapq.heappop(heap)
+            if -priority != residuals[state]:
+                # Outdated entry, the state has been pushed again with its new residual
+                continue
+            c += 1
+            values[state] = targets[state]
+            total -= residuals[state]
+            residuals[state] = 0.0
+            for pred in pred_states[pred_indptr[state]:pred_indptr[state + 1]]:
+                if skipped[pred]:
+                    continue
+                targets[pred] = backup(pred)
+                backups += 1
+                residual = abs(targets[pred] - values[pred])
+                total += residual - residuals[pred]
+                residuals[pred] = residual
+                if residual > 0:
+                    heapq.heappush(heap, (-residual, pred))
+
+        self.values = values
+        self.stats = {'mode': self.mode, 'iterations': c, 'backups': backups}
+        if writer is not None:
+            writer.write({'type': 'iteration', 'iteration': c, 'delta': total})
+        if self.metrics is not None:
+            # A single state is updated per iteration, they are recorded at once
+            self.record_iteration(total, backups, c)
+        if verbose:
+            self.print_values(c, total)
+
+
+    def multigrid_value_iteration(self, verbose=False, writer=None):
+        """
+        Runs policy iteration on a hierarchy of coarsened grids and stores the values for each state in self.values.
+        The coarsest level is solved first, then the values of each level are copied to the cells of its blocks as the
+        starting point of the next finer one. On each level, the values of the greedy policy are solved with a Krylov
+        method preconditioned by V-cycles over the coarser levels, until the distance to the optimal values, bounded
+        from the largest Bellman residual, is below epsilon: unlike the delta of the other modes, the test does not
+        depend on the number of states. A warm start skips the coarse levels.
+        Here an iteration is a Bellman backup of every state of a level. Walls and unreachable states are not solved.
+        :param verbose: (bool) if True, print the values to the console after each iteration of the finest level
+        :param writer: (TraceWriter) writer of the trace summary, None not to trace
+        """
+        env = self.game_env
+        reachable, _ = env.compact_index()
+        # The reachable walls (only the start state can be one) are backed up once at the end: no move leads to them
+        solved = np.frombuffer(env.cells, dtype=np.uint8)[reachable] != 3
+        positions = np.flatnonzero(solved)
+        transitions, rewards = env.compact_model()
+        rows = (positions[:, np.newaxis] * len(ACTIONS) + np.arange(len(ACTIONS))).ravel()
+        coords = np.stack(np.divmod(reachable[positions], env.num_cols), axis=1)
+        levels = build_levels(coords, transitions[rows][:, positions], rewards[positions])
+
+        all_values = np.asarray(self.values, dtype=float)
+        values = all_values[reachable[positions]]
+        first = 0 if np.any(values != 0) else len(levels) - 1
+        if first > 0:
+            values = np.zeros(len(levels[first]))
+        stats = []
+        c = 0
+        backups = 0
+        bound = 0.0
+        for depth in range(first, -1, -1):
+            level = levels[depth]
+            iterations = 0
+            krylov = 0
+            while True:
+                iterations += 1
+                backed_up, actions = bellman_backup(level, self.gamma, values)
+                bound = error_bound(self.gamma, values, backed_up)
+                values = backed_up
+                if depth == 0:
+                    c += 1
+                    if verbose:
+                        all_values[reachable[positions]] = values
+                        self.values = all_values
+                        self.print_values(c, bound)
+                    if writer is not None:
+                        writer.write({'type': 'iteration', 'iteration': c, 'delta': bound})
+                if self.metrics is not None:
+                    self.record_iteration(bound, len(level))
+                if bound < self.epsilon:
+                    break
+                values, steps = evaluate_policy(levels[depth:], np.arange(len(level)) * len(ACTIONS) + actions,
+                                                self.gamma, values)
+                krylov += steps
+            backups += iterations * len(level)
+            stats.append({'states': len(level), 'iterations': iterations, 'krylov_iterations': krylov})
+            if depth > 0:
+                values = levels[depth - 1].prolongation @ values
+
+        all_values[reachable[positions]] = values
+        if not solved.all():
+            q = self.q_array(all_values[reachable], compact=True)
+            all_values[reachable[~solved]] = q[~solved].max(axis=1)
+        self.values = all_values.tolist()
+        self.stats = {'mode': self.mode, 'iterations': c, 'backups': backups, 'error_bound': bound,
+                      'levels': stats[::-1]}
+
+
+    def update_cells(self, edits, verbose=False):
+        """
+        Change cells of the grid after a run and update the values and the policy incrementally, instead of solving
+        the whole grid again. Only the states whose backup changed are backed up first: the predecessors of the
+        edited cells, the states whose moves changed and the states that became reachable. Then, as in prioritized
+        sweeping, the state with the largest residual is updated and only its predecessors are backed up again, until
+        the sum of the residuals is below epsilon. The policy of every backed up state is refreshed, walls and
+        unreachable states get a value of 0 and an empty policy. self.stats['touched'] is the number of distinct
+        states backed up.
+        :param edits: new code of each edited cell, by position (dict of (row, col) -> int, or iterable of such pairs)
+        :param verbose: (bool) if True, print the values to the console once converged
+        """
+        env = self.game_env
+        _, old_index = env.compact_index()
+        edited, changed = env.set_cells(edits)
+        _, index = env.compact_index()
+        pred_indptr, pred_states = env.predecessor_index()
+        cells = env.cells
+        indptr, next_states, probs, rewards = env.indptr, env.next_states, env.probs, env.rewards
+        values = self.values if isinstance(self.values, list) else [float(v) for v in self.values]
+        gamma = self.gamma
+        self.iteration_start = time.perf_counter()
+
+        def skipped(state):
+            return cells[state] == 3 or index.item(state) < 0
+
+        def predecessors(state):
+            return pred_states[pred_indptr.item(state):pred_indptr.item(state + 1)].tolist()
+
+        def q_values(state):
+            q = []
+            for k in range(state * 4, state * 4 + 4):
+                action_v = 0
+                for j in range(indptr.item(k), indptr.item(k + 1)):
+                    next_state = next_states.item(j)
+                    action_v += probs.item(j) * (rewards.item(next_state) + gamma * values[next_state])
+                q.append(action_v)
+            return q
+
+        cleared = set(changed.tolist()) | set(np.flatnonzero((index < 0) & (old_index >= 0)).tolist())
+        seeds = set(changed.tolist()) | set(np.flatnonzero((index >= 0) & (old_index < 0)).tolist())
+        for state in edited.tolist():
+            seeds.update(predecessors(state))
+        for state in cleared:
+            if skipped(state):
+                values[state] = 0.0
+                self.policy[state] = ''
+
+        # targets[s] is the backed up value of s, it is refreshed every time one of the successors of s changes
+        targets = {}
+        residuals = {}
+        heap = []
+        backups = 0
+        for state in seeds:
+            if skipped(state):
+                continue
+            targets[state] = max(q_values(state))
+            residuals[state] = abs(targets[state] - values[state])
+            backups += 1
+            if residuals[state] > 0:
+                heap.append((-residuals[state], state))
+        heapq.heapify(heap)
+        total = math.fsum(residuals.values())
+
+        c = 0
+        while heap:
+            if total < self.epsilon:
+                # Recompute the sum to get rid of the rounding errors accumulated by the updates
+                total = math.fsum(residuals.values())
+                if total < self.epsilon:
+                    break
+            priority, state = heapq.heappop(heap)
+            if -priority != residuals[state]:
+                # Outdated entry, the state has been pushed again with its new residual
+                continue
+            c += 1
+            values[state] = targets[state]
+            total -= residuals[state]
+            residuals[state] = 0.0
+            for pred in predecessors(state):
+                if skipped(pred):
+                    continue
+                targets[pred] = max(q_values(pred))
+                backups += 1
+                residual = abs(targets[pred] - values[pred])
+                total += residual - residuals.get(pred, 0.0)
+                residuals[pred] = residual
+                if residual > 0:
+                    heapq.heappush(heap, (-residual, pred))
+
+        # The best action of a state only depends on the values of its successors, so only the states backed up
+        # above can have a new one. Ties go to the first action, as with argmax.
+        for state in targets:
+            q = q_values(state)
+            self.policy[state] = ACTIONS[q.index(max(q))]
+        self.values = values
+        self.stats = {'mode': 'incremental', 'iterations': c, 'backups': backups, 'touched': len(targets)}
+        if self.metrics is not None:
+            self.record_iteration(total, backups, c)
+        if verbose:
+            self.print_values(c, total)
 
 
     def compute_policy(self, trace=False, verbose=False):
         """
         Computes the policy for each state according to the computed values and stores it in self.policy.
-        :param trace: (bool) if True, write the policy to the file 'log-file_VI.txt'
+        With the 'numpy' engine, the states that cannot be reached from the start state keep an empty policy.
+        :param trace: (bool, str or TraceWriter) if set, write the policy to the file 'log-file_VI.txt', see value_iteration
         :param verbose: (bool) if True, print the policy to the console
         """
+        if self.engine == 'numpy':
+            states, _ = self.game_env.compact_index()
+            q = self.q_array(np.asarray(self.values, dtype=float)[states], compact=True)
+            best = np.full(self.game_env.num_states, len(ACTIONS))
+            best[states] = q.argmax(axis=1)
+            # States without any valid action keep an empty policy
+            best[states[np.all(q == float('-inf'), axis=1)]] = len(ACTIONS)
+            self.policy = [(ACTIONS + [''])[a] for a in best.tolist()]
+        else:
+            self.python_policy()
+        if trace:
+            self.trace_policy(trace)
+        if verbose:
+            self.print_policy()
+
+
+    def python_policy(self):
+        """
+        Computes the policy state by state and stores it in self.policy.
+        """
         for state in range(self.game_env.num_cols * self.game_env.num_rows):
             max_v = float('-inf')
             for action in ['up', 'down', 'left', 'right']:
@@ -114,10 +762,6 @@ class ValueIteration:
                 if action_v > max_v:
                     max_v = action_v
                     self.policy[state] = action
-        if trace:
-            self.trace_policy()
-        if verbose:
-            self.print_policy()
 
 
     def print_policy(self):
@@ -138,6 +782,9 @@ class ValueIteration:
                     print('←', end=' ')
                 elif self.policy[self.game_env.position_to_state((i, j))] == 'right':
                     print('→', end=' ')
+                elif self.policy[self.game_env.position_to_state((i, j))] == '':
+                    # Unreachable or unvisited state
+                    print(' ', end=' ')
                 else:
                     raise ValueError('Invalid action')
             print()
@@ -165,28 +812,16 @@ class ValueIteration:
         print(f'\n\ndelta: {delta:.8f}')
 
 
-    def trace_policy(self):
-        """
-        Write the policy to the file 'log-file_VI.txt'.
-        """
-        with open('log-file_VI.txt', 'a', encoding='utf-8') as f:
-            f.write('\n' + '=' * 50 + '\n\n')
-            f.write('Optimal policy\n\n')
-            for i in range(self.game_env.num_rows):
-                for j in range(self.game_env.num_cols):
-                    if self.game_env.grid[i][j] == 3:
-                        f.write('# ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'up':
-                        f.write('↑ ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'down':
-                        f.write('↓ ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'left':
-                        f.write('← ')
-                    elif self.policy[self.game_env.position_to_state((i, j))] == 'right':
-                        f.write('→ ')
-                    else:
-                        raise ValueError('Invalid action')
-                f.write('\n')
+    def trace_policy(self, trace=True):
+        """
+        Write the policy to the file self.log_file ('log-file_VI.txt').
+        :param trace: (bool, str or TraceWriter) see value_iteration
+        """
+        writer, owned = open_trace(trace, self.log_file)
+        if writer is None:
+            return
+        writer.write({'type': 'policy', 'solver': self.solver_name, 'grid': grid_rows(self.game_env), 'policy': list(self.policy)})
+        close_trace(writer, owned, self.log_file)
 
 
 if __name__ == '__main__':